@@ -25,6 +25,7 @@ from mvpa2.support.copy import deepcopy
 import numpy as np
 
 from mvpa2.base.state import ConditionalAttribute, ClassWithCollections
+from mvpa2.base.parallel import parallel_map
 from mvpa2.base.param import Parameter
 from mvpa2.base.constraints import *
 from mvpa2.mappers.procrustean import ProcrusteanMapper
@@ -63,6 +64,14 @@ class Hyperalignment(ClassWithCollections):
     datasets. This dataset list may or may not be identical to the training
     datasets.
 
+    Alignments of the individual datasets within each 2nd-level iteration,
+    and in the 3rd level, are independent of each other and could be computed
+    in parallel (see `nproc`).  Trained mappers are not kept during
+    training, and, with the default `combiner2`, the common space is
+    accumulated as a running average of the projected datasets.  For datasets
+    with many more features than samples consider
+    ``ProcrusteanMapper(svd='truncated')`` as `alignment`.
+
     The default values for the parameters of the algorithm (e.g. projection via
     Procrustean transformation, common space aggregation by averaging) resemble
     the setup reported in :ref:`Haxby et al., Neuron (2011) <HGC+11>` *A common,
@@ -156,7 +165,24 @@ class Hyperalignment(ClassWithCollections):
             The callable must return a single array. This combiner is called
             once with all datasets after 1st-level projection to create an
             updated common space, and is subsequently called again after each
-            2nd-level iteration.""")
+            2nd-level iteration.  The default (average) is computed as a
+            running sum without combining all datasets into a single
+            array.""")
+
+    nproc = Parameter(1, constraints=(EnsureInt() & EnsureRange(min=1)
+                                      | EnsureNone()),
+            doc="""Number of datasets to align in parallel within each
+            2nd-level iteration and in the 3rd level (the 1st level is
+            sequential by design).  If None, all available cores are used.
+            Memory demands grow with the number of simultaneous
+            alignments.""")
+
+    backend = Parameter(None,
+            constraints=(EnsureChoice('auto', 'multiprocessing', 'threads',
+                                      'pprocess', 'serial')
+                         | EnsureNone()),
+            doc="""Parallelization backend (see :mod:`~mvpa2.base.parallel`)
+            to use whenever nproc > 1.""")
 
 
     def __init__(self, **kwargs):
@@ -206,16 +232,10 @@ class Hyperalignment(ClassWithCollections):
         # zscore all data sets
         # ds = [ zscore(ds, chunks_attr=None) for ds in datasets]
 
-        # TODO since we are doing in-place zscoring create deep copies
-        # of the datasets with pruned targets and shallow copies of
-        # the collections (if they would come needed in the transformation)
-        # TODO: handle floats and non-floats differently to prevent
-        #       waste of memory if there is no need (e.g. no z-scoring)
-        #otargets = [ds.sa.targets for ds in datasets]
-        datasets = [ds.copy(deep=False) for ds in datasets]
-        #datasets = [Dataset(ds.samples.astype(float), sa={'targets': [None] * len(ds)})
-        #datasets = [Dataset(ds.samples, sa={'targets': [None] * len(ds)})
-        #            for ds in datasets]
+        # place datasets into a copy of the list since items might be
+        # reassigned -- datasets themselves are never modified (see
+        # _train_alignment)
+        datasets = list(datasets)
 
         if params.zscore_all:
             if __debug__:
@@ -240,21 +260,15 @@ class Hyperalignment(ClassWithCollections):
             commonspace = commonspace.astype(float)
             zscore(commonspace, chunks_attr=None)
 
-        # create a mapper per dataset
-        # might prefer some other way to initialize... later
-        mappers = [deepcopy(params.alignment) for ds in datasets]
-
         #
         # Level 1 -- initial projection
         #
-        lvl1_projdata = self._level1(datasets, commonspace, ref_ds, mappers,
-                                     residuals)
+        lvl1_projdata = self._level1(datasets, commonspace, ref_ds, residuals)
         #
         # Level 2 -- might iterate multiple times
         #
         # this is the final common space
-        self.commonspace = self._level2(datasets, lvl1_projdata, mappers,
-                                        residuals)
+        self.commonspace = self._level2(datasets, lvl1_projdata, residuals)
 
 
     def __call__(self, datasets):
@@ -319,9 +333,10 @@ class Hyperalignment(ClassWithCollections):
                     % alpha)
         wmappers = []
         for ids in xrange(len(datasets)):
-            U, S, Vh = np.linalg.svd(datasets[ids])
+            # singular vectors beyond the rank get zero weight below, so
+            # there is no need to compute them
+            U, S, Vh = np.linalg.svd(datasets[ids], full_matrices=False)
             S = 1/np.sqrt( (1-alpha)*np.square(S) + alpha )
-            S.resize(len(Vh))
             S = np.matrix(np.diag(S))
             W = np.matrix(Vh.T)*S*np.matrix(Vh)
             wmapper = StaticProjectionMapper(proj=W, auto_train=False)
@@ -331,26 +346,52 @@ class Hyperalignment(ClassWithCollections):
         return datasets, wmappers
 
 
-    def _level1(self, datasets, commonspace, ref_ds, mappers, residuals):
+    def _train_alignment(self, ds, commonspace):
+        """Train a new alignment mapper of a dataset into a common space"""
+        m = deepcopy(self.params.alignment)
+        # assign common space to ``space`` of the mapper, because this is
+        # where it will be looking for it -- within a shallow copy, so the
+        # dataset itself is not modified and could be aligned in parallel
+        ds = ds.copy(deep=False)
+        ds.sa[m.get_space()] = commonspace
+        m.train(ds)
+        return m
+
+
+    def _project(self, m, ds):
+        """Project a dataset into the common space"""
+        ds_ = m.forward(ds.samples)
+        if self.params.zscore_common:
+            zscore(ds_, chunks_attr=None)
+        return ds_
+
+
+    def _combine(self, data_mapped):
+        """Combine projected datasets into a common space (via combiner2)"""
+        params = self.params
+        if not params['combiner2'].is_default:
+            return params.combiner2(data_mapped)
+        # running average, without a copy of all datasets in a single array
+        commonspace = np.array(data_mapped[0], dtype=float)
+        for ds_ in data_mapped[1:]:
+            commonspace += ds_
+        commonspace /= len(data_mapped)
+        return commonspace
+
+
+    def _level1(self, datasets, commonspace, ref_ds, residuals):
         params = self.params            # for quicker access ;)
         data_mapped = [ds.samples for ds in datasets]
-        for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
+        for i, ds_new in enumerate(datasets):
             if __debug__:
                 debug('HPAL_', "Level 1: ds #%i" % i)
             if i == ref_ds:
                 continue
-            # assign common space to ``space`` of the mapper, because this is
-            # where it will be looking for it
-            ds_new.sa[m.get_space()] = commonspace
-            # find transformation of this dataset into the current common space
-            m.train(ds_new)
-            # remove common space attribute again to save on memory when the
-            # common space is updated for the next iteration
-            del ds_new.sa[m.get_space()]
-            # project this dataset into the current common space
-            ds_ = m.forward(ds_new.samples)
-            if params.zscore_common:
-                zscore(ds_, chunks_attr=None)
+            # find transformation of this dataset into the current common
+            # space, and project this dataset into it -- the mapper itself is
+            # not needed any longer
+            ds_ = self._project(self._train_alignment(ds_new, commonspace),
+                                ds_new)
             # replace original dataset with mapped one -- only the reference
             # dataset will remain unchanged
             data_mapped[i] = ds_
@@ -370,12 +411,12 @@ class Hyperalignment(ClassWithCollections):
         return data_mapped
 
 
-    def _level2(self, datasets, lvl1_data, mappers, residuals):
+    def _level2(self, datasets, lvl1_data, residuals):
         params = self.params            # for quicker access ;)
         data_mapped = lvl1_data
         # aggregate all processed 1st-level datasets into a new 2nd-level
         # common space
-        commonspace = params.combiner2(data_mapped)
+        commonspace = self._combine(data_mapped)
 
         # XXX Why is this commented out? Who knows what combiner2 is doing and
         # whether it changes the distribution of the data
@@ -383,40 +424,58 @@ class Hyperalignment(ClassWithCollections):
         #zscore(commonspace, chunks_attr=None)
 
         ndatasets = len(datasets)
+        streaming = params['combiner2'].is_default
+
+        def align(i, loop):
+            if __debug__:
+                debug('HPAL_', "Level 2 (%i-th iteration): ds #%i" % (loop, i))
+
+            # Optimization speed up heuristic
+            # Slightly modify the common space towards other feature
+            # spaces and reduce influence of this feature space for the
+            # to-be-computed projection
+            temp_commonspace = (commonspace * ndatasets - data_mapped[i]) \
+                                / (ndatasets - 1)
+
+            if params.zscore_common:
+                zscore(temp_commonspace, chunks_attr=None)
+            # retrain the mapper for this dataset, and obtain the 2nd-level
+            # projection
+            ds_ = self._project(
+                self._train_alignment(datasets[i], temp_commonspace),
+                datasets[i])
+            # compute residuals
+            residual = None
+            if residuals is not None:
+                residual = np.linalg.norm(ds_ - commonspace)
+            return i, ds_, residual
+
         for loop in xrange(params.level2_niter):
             # 2nd-level alignment starts from the original/unprojected datasets
-            # again
-            for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
-                if __debug__:
-                    debug('HPAL_', "Level 2 (%i-th iteration): ds #%i" % (loop, i))
-
-                # Optimization speed up heuristic
-                # Slightly modify the common space towards other feature
-                # spaces and reduce influence of this feature space for the
-                # to-be-computed projection
-                temp_commonspace = (commonspace * ndatasets - data_mapped[i]) \
-                                    / (ndatasets - 1)
-
-                if params.zscore_common:
-                    zscore(temp_commonspace, chunks_attr=None)
-                # assign current common space
-                ds_new.sa[m.get_space()] = temp_commonspace
-                # retrain the mapper for this dataset
-                m.train(ds_new)
-                # remove common space attribute again to save on memory when the
-                # common space is updated for the next iteration
-                del ds_new.sa[m.get_space()]
-                # obtain the 2nd-level projection
-                ds_ =  m.forward(ds_new.samples)
-                if params.zscore_common:
-                    zscore(ds_, chunks_attr=None)
-                # store for 2nd-level combiner
-                data_mapped[i] = ds_
-                # compute residuals
+            # again -- all of them independently
+            new_commonspace = None
+            for i, ds_, residual in parallel_map(
+                    align, [((i, loop), {}) for i in xrange(ndatasets)],
+                    nproc=params.nproc, backend=params.backend):
                 if residuals is not None:
-                    residuals[1+loop, i] = np.linalg.norm(ds_ - commonspace)
+                    residuals[1 + loop, i] = residual
+                if streaming:
+                    # accumulate the new common space right away
+                    if new_commonspace is None:
+                        new_commonspace = np.array(ds_, dtype=float)
+                    else:
+                        new_commonspace += ds_
+                    if loop == params.level2_niter - 1:
+                        # the last projection of this dataset is not needed
+                        # any longer
+                        ds_ = None
+                # store for the next iteration and 2nd-level combiner
+                data_mapped[i] = ds_
 
-            commonspace = params.combiner2(data_mapped)
+            if streaming:
+                commonspace = new_commonspace / ndatasets
+            else:
+                commonspace = params.combiner2(data_mapped)
 
         # and again
         if params.zscore_common:
@@ -428,8 +487,6 @@ class Hyperalignment(ClassWithCollections):
 
     def _level3(self, datasets):
         params = self.params            # for quicker access ;)
-        # create a mapper per dataset
-        mappers = [deepcopy(params.alignment) for ds in datasets]
 
         # key different from level-2; the common space is uniform
         #temp_commonspace = commonspace
@@ -439,21 +496,25 @@ class Hyperalignment(ClassWithCollections):
             residuals = np.zeros((1, len(datasets)))
             self.ca.residual_errors = Dataset(samples=residuals)
 
-        # start from original input datasets again
-        for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
+        def align(i):
             if __debug__:
                 debug('HPAL_', "Level 3: ds #%i" % i)
-
-            # retrain mapper on final common space
-            ds_new.sa[m.get_space()] = self.commonspace
-            m.train(ds_new)
-            # remove common space attribute again to save on memory
-            del ds_new.sa[m.get_space()]
-
+            # start from original input datasets again, and train a mapper
+            # on final common space
+            m = self._train_alignment(datasets[i], self.commonspace)
+            residual = None
             if residuals is not None:
                 # obtain final projection
-                data_mapped = m.forward(ds_new.samples)
-                residuals[0, i] = np.linalg.norm(data_mapped - self.commonspace)
+                data_mapped = m.forward(datasets[i].samples)
+                residual = np.linalg.norm(data_mapped - self.commonspace)
+            return m, residual
+
+        mappers = []
+        for i, (m, residual) in enumerate(parallel_map(
+                align, [((i,), {}) for i in xrange(len(datasets))],
+                nproc=params.nproc, backend=params.backend)):
+            mappers.append(m)
+            if residuals is not None:
+                residuals[0, i] = residual
 
         return mappers
-
@@ -0,0 +1,295 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Hyperalignment of whole-brain datasets within searchlights
+
+The :class:`SearchlightHyperalignment` class in this module computes local
+transformations into a common space within the searchlights of all center
+features, and aggregates them into a sparse whole-brain projection per
+dataset.
+
+.. versionadded:: 2.3.2
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import numpy as np
+
+from mvpa2.base import externals
+from mvpa2.base.state import ClassWithCollections
+from mvpa2.base.param import Parameter
+from mvpa2.base.constraints import *
+from mvpa2.base.parallel import get_nproc, parallel_map
+from mvpa2.support.copy import deepcopy
+from mvpa2.datasets import Dataset
+from mvpa2.algorithms.hyperalignment import Hyperalignment
+from mvpa2.mappers.zscore import ZScoreMapper, zscore
+from mvpa2.mappers.staticprojection import StaticProjectionMapper
+
+if externals.exists('scipy', raise_=True):
+    import scipy.sparse as sp
+
+if __debug__:
+    from mvpa2.base import debug
+
+__all__ = ['SearchlightHyperalignment']
+
+
+class SearchlightHyperalignment(ClassWithCollections):
+    """Align whole-brain datasets into a common space within searchlights
+
+    Datasets (e.g. of different subjects) have to share their feature space
+    (e.g. voxels in a common anatomical template) and samples (e.g. time
+    points of a movie).  Instead of a single transformation of all features
+    at once (as by :class:`~mvpa2.algorithms.hyperalignment.Hyperalignment`),
+    which is infeasible for whole-brain data, local transformations are
+    computed within the searchlight around each center feature, as
+    provided by a query engine.
+
+    Training derives a whole-brain common space: `hyperalignment` is trained
+    on the searchlight data of all datasets, and the resulting local common
+    spaces of all searchlights are averaged (each feature over all
+    searchlights it is part of).  Calling the instance aligns each dataset
+    within every searchlight with this common space (using the `alignment`
+    of `hyperalignment`), and sums the local transformations into a
+    sparse (features x features) projection matrix per dataset.  These are
+    returned as :class:`~mvpa2.mappers.staticprojection.StaticProjectionMapper`
+    instances.
+
+    Searchlights are processed in blocks, possibly in parallel (see `nproc`).
+
+    Notes
+    -----
+    Offsets of the local transformations are not part of the projections,
+    hence the datasets should be Z-scored (or at least demeaned) beforehand
+    (see `zscore_all`).  Reverse mapping uses the transposed projection, which
+    is an approximation of the inverse transformation only.
+    """
+
+    queryengine = Parameter(None,
+            doc="""Query engine providing the ids of the features within the
+            searchlight around each center feature (e.g.
+            :class:`~mvpa2.misc.neighborhood.IndexQueryEngine`).  It gets
+            trained on the reference dataset.""")
+
+    roi_ids = Parameter(None,
+            doc="""Ids of the center features of the searchlights, or the name
+            of a feature attribute of the reference dataset whose non-zero
+            values select them.  If None, all features known to the query
+            engine are used.""")
+
+    ref_ds = Parameter(0, constraints=EnsureInt() & EnsureRange(min=0),
+            doc="""Index of the dataset to be used as the reference for the
+            local common spaces, and to train the query engine on.""")
+
+    hyperalignment = Parameter(Hyperalignment(),
+            doc="""Hyperalignment instance to derive the local common spaces
+            with.  Its `alignment` mapper is used to compute the local
+            transformations into the whole-brain common space.  Its
+            `ref_ds` is overridden by the one of this instance.""")
+
+    zscore_all = Parameter(False, constraints='bool',
+            doc="""Flag to Z-score all datasets prior to alignment.  The
+            Z-scoring is not part of the returned mappers.""")
+
+    zscore_common = Parameter(True, constraints='bool',
+            doc="""Flag to Z-score the whole-brain common space.""")
+
+    dtype = Parameter('float64',
+            doc="""Datatype of the sparse projection matrices.""")
+
+    nproc = Parameter(1, constraints=(EnsureInt() & EnsureRange(min=1)
+                                      | EnsureNone()),
+            doc="""Number of blocks of searchlights to process in parallel.
+            If None, all available cores are used.""")
+
+    backend = Parameter(None,
+            constraints=(EnsureChoice('auto', 'multiprocessing', 'threads',
+                                      'pprocess', 'serial')
+                         | EnsureNone()),
+            doc="""Parallelization backend (see :mod:`~mvpa2.base.parallel`)
+            to use whenever nproc > 1.""")
+
+    nblocks = Parameter(None, constraints=(EnsureInt() & EnsureRange(min=1)
+                                           | EnsureNone()),
+            doc="""Number of blocks to split the searchlights into.  If None,
+            10 blocks per process are used, so the workers are loaded
+            evenly.""")
+
+    _nblocks_per_proc = 10
+
+    def __init__(self, **kwargs):
+        ClassWithCollections.__init__(self, **kwargs)
+        self.commonspace = None
+
+
+    def train(self, datasets):
+        """Derive a whole-brain common space from a series of datasets
+
+        Parameters
+        ----------
+        datasets : sequence of datasets
+        """
+        params = self.params
+        datasets = self._prepare(datasets)
+        nsamples, nfeatures = datasets[0].shape
+        if __debug__:
+            debug('HPAL', "Searchlight hyperalignment %s for %i datasets"
+                  % (self, len(datasets)))
+
+        def get_commonspaces(centers):
+            """Sum of the local common spaces of a block of searchlights"""
+            # own instance per block, as blocks might run in threads
+            hyper = deepcopy(params.hyperalignment)
+            hyper.params.ref_ds = params.ref_ds
+            rois = [self._get_roi(center) for center in centers]
+            # features covered by this block only
+            features = np.unique(np.concatenate(rois))
+            commonspace = np.zeros((nsamples, len(features)))
+            counts = np.zeros(len(features), dtype=int)
+            for roi in rois:
+                if __debug__:
+                    debug('HPAL_', "Local common space of %i features"
+                          % len(roi))
+                hyper.train([Dataset(ds.samples[:, roi]) for ds in datasets])
+                idx = np.searchsorted(features, roi)
+                commonspace[:, idx] += hyper.commonspace
+                counts[idx] += 1
+            return features, commonspace, counts
+
+        commonspace = np.zeros((nsamples, nfeatures))
+        counts = np.zeros(nfeatures, dtype=int)
+        for features, commonspace_, counts_ in self._map_blocks(
+                get_commonspaces, datasets[params.ref_ds]):
+            commonspace[:, features] += commonspace_
+            counts[features] += counts_
+        covered = counts > 0
+        commonspace[:, covered] /= counts[covered]
+        if params.zscore_common:
+            zscore(commonspace, chunks_attr=None)
+        self.commonspace = commonspace
+
+
+    def __call__(self, datasets):
+        """Compute whole-brain projections of datasets into the common space
+
+        The common space is derived from the datasets first, if the
+        instance was not trained already.
+
+        Parameters
+        ----------
+        datasets : sequence of datasets
+
+        Returns
+        -------
+        A list of trained StaticProjectionMappers matching the number of input
+        datasets.
+        """
+        if self.commonspace is None:
+            self.train(datasets)
+
+        params = self.params
+        datasets = self._prepare(datasets)
+        commonspace = self.commonspace
+        nfeatures = commonspace.shape[1]
+        if datasets[0].shape != commonspace.shape:
+            raise ValueError("Datasets of shape %s do not match the common "
+                             "space of shape %s"
+                             % (datasets[0].shape, commonspace.shape))
+        alignment = params.hyperalignment.params.alignment
+        dtype = np.dtype(params.dtype)
+
+        def get_projections(centers):
+            """Sum of the local transformations of a block of searchlights"""
+            rows, cols, values = [], [], [[] for ds in datasets]
+            for center in centers:
+                roi = self._get_roi(center)
+                rows.append(np.repeat(roi, len(roi)))
+                cols.append(np.tile(roi, len(roi)))
+                for i, ds in enumerate(datasets):
+                    m = deepcopy(alignment)
+                    m.train(Dataset(ds.samples[:, roi],
+                                    sa={m.get_space(): commonspace[:, roi]}))
+                    values[i].append(np.asarray(m.proj, dtype=dtype).ravel())
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            # duplicate entries get summed up upon conversion
+            return [sp.coo_matrix((np.concatenate(v), (rows, cols)),
+                                  shape=(nfeatures, nfeatures)).tocsr()
+                    for v in values]
+
+        projs = None
+        for projs_ in self._map_blocks(get_projections,
+                                       datasets[params.ref_ds]):
+            if projs is None:
+                projs = projs_
+            else:
+                projs = [p + p_ for p, p_ in zip(projs, projs_)]
+
+        return [StaticProjectionMapper(proj=proj, recon=proj.T.tocsr(),
+                                       demean=False)
+                for proj in projs]
+
+
+    def _prepare(self, datasets):
+        """Check the datasets, Z-score them if requested, and train the
+        query engine"""
+        params = self.params
+        shapes = set([ds.shape for ds in datasets])
+        if len(shapes) > 1:
+            raise ValueError("All datasets must have the same number of "
+                             "samples and features. Got shapes %s"
+                             % sorted(shapes))
+        if params.queryengine is None:
+            raise ValueError("%s requires a query engine to determine the "
+                             "searchlights" % self.__class__.__name__)
+        datasets = list(datasets)
+        if params.zscore_all:
+            if __debug__:
+                debug('HPAL', "Z-scoring all datasets")
+            for ids in xrange(len(datasets)):
+                zmapper = ZScoreMapper(chunks_attr=None)
+                zmapper.train(datasets[ids])
+                datasets[ids] = zmapper.forward(datasets[ids])
+        params.queryengine.train(datasets[params.ref_ds])
+        return datasets
+
+
+    def _get_roi_ids(self, ds):
+        """Determine the center features of the searchlights"""
+        roi_ids = self.params.roi_ids
+        if isinstance(roi_ids, basestring):
+            return ds.fa[roi_ids].value.nonzero()[0]
+        elif roi_ids is not None:
+            return roi_ids
+        return self.params.queryengine.ids
+
+
+    def _get_roi(self, center):
+        """Sorted feature ids of the searchlight around a center feature"""
+        return np.unique(np.asarray(self.params.queryengine[center],
+                                    dtype=int))
+
+
+    def _map_blocks(self, func, ref_ds):
+        """Apply `func` to blocks of searchlight centers, possibly in
+        parallel, and provide its results in the order of the blocks"""
+        params = self.params
+        roi_ids = np.asanyarray(self._get_roi_ids(ref_ds))
+        nproc = get_nproc(params.nproc, params.backend)
+        nblocks = params.nblocks
+        if nblocks is None:
+            nblocks = nproc * self._nblocks_per_proc
+        nblocks = max(1, min(nblocks, len(roi_ids)))
+        if __debug__:
+            debug('HPAL', "Processing %i searchlights in %i blocks"
+                  % (len(roi_ids), nblocks))
+        return parallel_map(func,
+                            [((block,), {})
+                             for block in np.array_split(roi_ids, nblocks)],
+                            nproc=nproc, backend=params.backend)
@@ -202,6 +202,7 @@ if __debug__:
     debug.register('DG', "Data generators")
     debug.register('LAZY', "Miscelaneous 'lazy' evaluations")
     debug.register('LOOP', "Support's loop construct")
+    debug.register('PAR', "Parallel execution of tasks")
     debug.register('PLR', "PLR call")
     debug.register('NBH', "Neighborhood estimations")
     debug.register('SLC', "Searchlight call")
@@ -270,11 +270,33 @@ class SequenceCollectable(Collectable):
 
 
 
+def _fuse_indices(first, second):
+    """Index selecting ``value[first][second]`` from ``value`` at once
+
+    Both `first` and `second` must be index sequences or boolean masks
+    (not slices).
+    """
+    first = np.asanyarray(first)
+    if first.dtype == bool:
+        first = first.nonzero()[0]
+    elif not len(first):
+        # [] would become a float array
+        first = first.astype(int)
+    second = np.asanyarray(second)
+    if not len(second) and second.dtype != bool:
+        second = second.astype(int)
+    return first[second]
+
+
 class ArrayCollectable(SequenceCollectable):
     """Collectable embedding an array.
 
     When shallow-copied it includes a view of the array in the copy.
     """
+
+    _lazy = None
+    """Postponed selection (source value, key, length) if any"""
+
     def __copy__(self):
         # preserve attribute type
         copied = self.__class__(name=self.name, doc=self.__doc__,
@@ -284,7 +306,63 @@ class ArrayCollectable(SequenceCollectable):
         return copied
 
 
+    def __len__(self):
+        if self._lazy is not None:
+            return self._lazy[2]
+        return SequenceCollectable.__len__(self)
+
+
+    def _get(self):
+        lazy = self._lazy
+        if lazy is not None:
+            # selection was postponed till the first access
+            source, key, _ = lazy
+            self._value = source[key]
+            self._lazy = None
+        return self._value
+
+
+    def select_from(self, attr, key, length):
+        """Assign a selection from the value of another collectable
+
+        Selection of ``attr.value[key]`` is postponed till the value gets
+        accessed for the first time, so selections of attributes which are
+        never used cost nothing.  If `attr` itself holds a postponed
+        selection, and neither of the selections is a slice, both get fused
+        into a single one, so the intermediate value is never computed.
+
+        Note that, just like a view, the selection references the value of
+        `attr`, so its in-place modifications prior to the first access
+        show up in the selection, and the value is kept in memory till
+        then.
+
+        Parameters
+        ----------
+        attr : ArrayCollectable
+          Collectable to select from.
+        key : slice or sequence or ndarray
+          Indices or boolean mask of the selection.
+        length : int
+          Length of the resulting value.
+        """
+        lazy = attr._lazy
+        if lazy is not None and not isinstance(lazy[1], slice) \
+               and not isinstance(key, slice):
+            source, key = lazy[0], _fuse_indices(lazy[1], key)
+        else:
+            source = attr.value
+        if not self._target_length is None and length != self._target_length:
+            raise ValueError("Value length [%i] does not match the required "
+                             "length [%i] of attribute '%s'."
+                             % (length, self._target_length, str(self.name)))
+        self._reset_unique()
+        self._value = None
+        self._lazy = (source, key, length)
+
+
     def _set(self, val):
+        # any postponed selection is obsolete now
+        self._lazy = None
         if not hasattr(val, 'view'):
             if is_sequence_type(val):
                 try:
@@ -590,11 +668,11 @@ class UniformLengthCollection(Collection):
             value = ArrayCollectable(value)
         if ulength is None:
             ulength = len(value)
-        elif not len(value.value) == ulength:
+        elif not len(value) == ulength:
             raise ValueError("Collectable '%s' with length [%i] does not match "
                              "the required length [%i] of collection '%s'."
                              % (key,
-                                len(value.value),
+                                len(value),
                                 ulength,
                                 str(self)))
         # tell the attribute to maintain the desired length
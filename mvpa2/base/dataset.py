@@ -12,6 +12,7 @@ __docformat__ = 'restructuredtext'
 
 import numpy as np
 import copy
+import itertools
 
 from mvpa2.base import externals, cfg, warning
 from mvpa2.base.collections import SampleAttributesCollection, \
@@ -406,9 +407,11 @@ class AttrDataset(object):
                                              axis=0)
 
 
-    def __getitem__(self, args):
+    def __getitem__(self, args, _lazy=False):
         """
         """
+        # _lazy: postpone selection of sample and feature attributes till
+        # their first access (used by select_view())
         # uniformize for checks below; it is not a tuple if just single slicing
         # spec is passed
         if not isinstance(args, tuple):
@@ -452,6 +455,9 @@ class AttrDataset(object):
                 # masks). TODO check in __debug__? or may be just do
                 # enforcing of proper dimensions and order manually?
                 samples = self.samples[np.ix_(*args)]
+        elif getattr(self.samples, 'orthogonal_indexing', False):
+            # e.g. HDF5Array -- reads only the selected samples/features
+            samples = self.samples[args[0], args[1]]
         else:
             # in all other cases we have to do the selection sequentially
             #
@@ -474,7 +480,10 @@ class AttrDataset(object):
             # preserve attribute type
             newattr = attr.__class__(doc=attr.__doc__)
             # slice
-            newattr.value = attr.value[args[0]]
+            if _lazy:
+                newattr.select_from(attr, args[0], samples.shape[0])
+            else:
+                newattr.value = attr.value[args[0]]
             # assign to target collection
             sa[attr.name] = newattr
 
@@ -484,7 +493,10 @@ class AttrDataset(object):
             # preserve attribute type
             newattr = attr.__class__(doc=attr.__doc__)
             # slice
-            newattr.value = attr.value[args[1]]
+            if _lazy:
+                newattr.select_from(attr, args[1], samples.shape[1])
+            else:
+                newattr.value = attr.value[args[1]]
             # assign to target collection
             fa[attr.name] = newattr
 
@@ -503,6 +515,30 @@ class AttrDataset(object):
         return self.__class__(samples, sa=sa, fa=fa, a=a)
 
 
+    def select_view(self, *args):
+        """Select samples and/or features avoiding copies whenever possible
+
+        Selection is specified as for ``ds[args]``, but index sequences or
+        boolean masks selecting regularly spaced elements (e.g. contiguous
+        ranges) are converted into slices, so samples and attributes of the
+        resulting dataset are views of the ones of this dataset.  Moreover,
+        sample and feature attributes get selected only upon their first
+        access, and repeated selections of attributes which were not
+        accessed yet are fused into a single one (see
+        :meth:`~mvpa2.base.collections.ArrayCollectable.select_from`).
+
+        Hence, unlike with ``ds[args]``, in-place modifications of the
+        selection might also affect this dataset, and in-place
+        modifications of attributes of this dataset might show up in the
+        selection (if it did not access them yet).
+        """
+        if len(args) == 1 and isinstance(args[0], tuple):
+            args = args[0]
+        return self.__getitem__(tuple(_index_as_slice(a, n)
+                                      for a, n in zip(args, self.shape)),
+                                _lazy=True)
+
+
     def __repr_full__(self):
         return "%s(%s, sa=%s, fa=%s, a=%s)" \
                 % (self.__class__.__name__,
@@ -551,7 +587,7 @@ class AttrDataset(object):
 
 
     @classmethod
-    def from_hdf5(cls, source, name=None):
+    def from_hdf5(cls, source, name=None, lazy=False):
         """Load a Dataset from HDF5 file
 
         Parameters
@@ -562,6 +598,12 @@ class AttrDataset(object):
           If file contains multiple entries at the 1st level, if
           provided, `name` specifies the group to be loaded as the
           AttrDataset.
+        lazy : bool, optional
+          If True, samples are not read into memory but memory-mapped, or
+          read upon selection of samples/features (see
+          `mvpa2.base.hdf5.hdf2obj()`).  In the latter case the file (if
+          provided as a filename) is left open, until closed with
+          `HDF5Array.close()` of the samples.
 
         Returns
         -------
@@ -576,7 +618,7 @@ class AttrDataset(object):
                 "Missing 'h5py' package -- saving is not possible.")
 
         import h5py
-        from mvpa2.base.hdf5 import hdf2obj
+        from mvpa2.base.hdf5 import hdf2obj, _LAZY_ARRAYS
 
         # look if we got an hdf file instance already
         if isinstance(source, h5py.highlevel.File):
@@ -586,31 +628,37 @@ class AttrDataset(object):
             own_file = True
             hdf = h5py.File(source, 'r')
 
-        if not name is None:
-            # some HDF5 subset is requested
-            if not name in hdf:
-                raise ValueError("Cannot find '%s' group in HDF file %s.  "
-                                 "File contains groups: %s"
-                                 % (name, source, hdf.keys()))
-
-            # access the group that should contain the dataset
-            dsgrp = hdf[name]
-            res = hdf2obj(dsgrp)
-            if not isinstance(res, AttrDataset):
-                # TODO: unittest before committing
-                raise ValueError, "%r in %s contains %s not a dataset.  " \
-                      "File contains groups: %s." \
-                      % (name, source, type(res), hdf.keys())
-        else:
-            # just consider the whole file
-            res = hdf2obj(hdf)
-            if not isinstance(res, AttrDataset):
-                # TODO: unittest before committing
-                raise ValueError, "Failed to load a dataset from %s.  " \
-                      "Loaded %s instead." \
-                      % (source, type(res))
-        if own_file:
-            hdf.close()
+        memo = {}
+        keep_open = not own_file
+        try:
+            if not name is None:
+                # some HDF5 subset is requested
+                if not name in hdf:
+                    raise ValueError("Cannot find '%s' group in HDF file %s.  "
+                                     "File contains groups: %s"
+                                     % (name, source, hdf.keys()))
+
+                # access the group that should contain the dataset
+                dsgrp = hdf[name]
+                res = hdf2obj(dsgrp, memo=memo, lazy=lazy)
+                if not isinstance(res, AttrDataset):
+                    # TODO: unittest before committing
+                    raise ValueError, "%r in %s contains %s not a dataset.  " \
+                          "File contains groups: %s." \
+                          % (name, source, type(res), hdf.keys())
+            else:
+                # just consider the whole file
+                res = hdf2obj(hdf, memo=memo, lazy=lazy)
+                if not isinstance(res, AttrDataset):
+                    # TODO: unittest before committing
+                    raise ValueError, "Failed to load a dataset from %s.  " \
+                          "Loaded %s instead." \
+                          % (source, type(res))
+            # samples loaded lazily still read from the file
+            keep_open = keep_open or bool(memo.get(_LAZY_ARRAYS))
+        finally:
+            if not keep_open:
+                hdf.close()
         return res
 
 
@@ -620,6 +668,52 @@ class AttrDataset(object):
     shape = property(fget=lambda self:self.samples.shape)
 
 
+def _index_as_slice(idx, length):
+    """Convert an index into an equivalent slice if possible
+
+    Parameters
+    ----------
+    idx
+      Integer, sequence of indices, boolean mask, or slice.
+    length : int
+      Length of the indexed axis.
+
+    Returns
+    -------
+    slice or idx
+      `idx` is returned as is if it cannot be expressed as a slice.
+    """
+    if isinstance(idx, slice):
+        return idx
+    if isinstance(idx, int):
+        idx = [idx]
+    idx_ = np.asanyarray(idx)
+    if idx_.ndim != 1:
+        return idx
+    if idx_.dtype == bool:
+        if len(idx_) != length:
+            # let numpy complain
+            return idx
+        idx_ = idx_.nonzero()[0]
+    elif not len(idx_):
+        return slice(0, 0)
+    elif not idx_.dtype.kind in 'iu':
+        return idx
+    else:
+        idx_ = np.where(idx_ < 0, idx_ + length, idx_)
+        if np.any(idx_ < 0) or np.any(idx_ >= length):
+            return idx
+    if not len(idx_):
+        return slice(0, 0)
+    start = int(idx_[0])
+    if len(idx_) == 1:
+        return slice(start, start + 1)
+    step = int(idx_[1] - idx_[0])
+    if step <= 0 or np.any(np.diff(idx_) != step):
+        return idx
+    return slice(start, int(idx_[-1]) + 1, step)
+
+
 def datasetmethod(func):
     """Decorator to easily bind functions to an AttrDataset class
     """
@@ -634,6 +728,138 @@ def datasetmethod(func):
     return func
 
 
+def _stack_into(buf, n, arr, axis=0, capacity=None):
+    """Copy `arr` into a stacking buffer after `n` already stacked elements
+
+    The buffer gets (re)allocated whenever it is too small or of a type
+    which cannot hold values of `arr`, growing by doubling, so stacking of
+    many arrays takes only amortized linear time.
+
+    Parameters
+    ----------
+    buf : ndarray or None
+      Buffer with the values stacked so far along `axis`.
+    n : int
+      Number of elements stacked in `buf` so far.
+    arr : ndarray
+      Values to append.
+    axis : int
+      Axis to stack along.
+    capacity : int, optional
+      Total number of elements to be stacked if known, so the buffer gets
+      allocated only once.
+
+    Returns
+    -------
+    ndarray
+      Buffer, which could be a new one.
+    """
+    arr = np.asanyarray(arr)
+    k = arr.shape[axis]
+    size = n + k
+    if buf is None:
+        dtype = arr.dtype
+    else:
+        if buf.ndim != arr.ndim or \
+           buf.shape[:axis] + buf.shape[axis + 1:] \
+           != arr.shape[:axis] + arr.shape[axis + 1:]:
+            raise ValueError("All the input array dimensions except for the "
+                             "concatenation axis must match exactly (got %s "
+                             "to stack after %s)"
+                             % (arr.shape, buf.shape))
+        dtype = np.result_type(buf, arr)
+        if dtype == buf.dtype and size <= buf.shape[axis]:
+            dtype = None                # buffer is good as is
+    if dtype is not None:
+        if capacity is not None and capacity >= size:
+            newsize = capacity
+        elif buf is None:
+            newsize = size
+        else:
+            newsize = max(size, 2 * buf.shape[axis])
+        shape = list(arr.shape)
+        shape[axis] = newsize
+        newbuf = np.empty(shape, dtype=dtype)
+        if buf is not None and n:
+            newbuf[_axis_slice(axis, 0, n)] = buf[_axis_slice(axis, 0, n)]
+        buf = newbuf
+    buf[_axis_slice(axis, n, size)] = arr
+    return buf
+
+
+def _axis_slice(axis, start, stop):
+    """Index tuple for a slice along `axis`"""
+    return (slice(None),) * axis + (slice(start, stop),)
+
+
+def _stack(datasets, axis, a=None):
+    """Common implementation of `vstack` (axis=0) and `hstack` (axis=1)
+
+    Samples and attributes are copied into preallocated (if the number of
+    datasets is known), or geometrically growing arrays, while datasets get
+    consumed one by one, so `datasets` might be any iterable.
+    """
+    it = iter(datasets)
+    try:
+        first = it.next()
+    except StopIteration:
+        raise ValueError('concatenation of zero-length sequences is impossible')
+    try:
+        second = it.next()
+    except StopIteration:
+        # trivial stack
+        return first
+    it = itertools.chain((first, second), it)
+
+    # fall back to numpy if it is not a dataset
+    if not is_datasetlike(first):
+        if axis == 0:
+            return AttrDataset(np.vstack(list(it)))
+        # we might get a list of 1Ds that would yield wrong results when
+        # turned into a dict (would run along samples-axis)
+        return AttrDataset(np.atleast_2d(np.hstack(list(it))))
+
+    # collection of the attributes to stack and the one to merge
+    col, other_col = ('sa', 'fa')[axis], ('fa', 'sa')[axis]
+    target = sorted(getattr(first, col).keys())
+
+    capacity = None
+    if hasattr(datasets, '__len__'):
+        capacity = sum(ds.shape[axis] for ds in datasets)
+
+    stacked_samp = None
+    stacked_attrs = dict((k, None) for k in target)
+    merged_other = {}
+    a_merger = _DatasetAttributesMerger(a)
+    n = 0
+    for ds in it:
+        ds_col = getattr(ds, col)
+        if __debug__:
+            if not sorted(ds_col.keys()) == target:
+                raise ValueError("%s attributes collections of to be stacked "
+                                 "datasets have varying attributes."
+                                 % ('Sample', 'Feature')[axis])
+        # will puke if not equal number of features/samples
+        stacked_samp = _stack_into(stacked_samp, n, ds.samples, axis=axis,
+                                   capacity=capacity)
+        for k in target:
+            stacked_attrs[k] = _stack_into(stacked_attrs[k], n,
+                                           ds_col[k].value,
+                                           capacity=capacity)
+        # later ones overwrite earlier ones
+        merged_other.update(getattr(ds, other_col))
+        a_merger.add(ds)
+        n += ds.shape[axis]
+
+    stacked_samp = stacked_samp[_axis_slice(axis, 0, n)]
+    stacked_attrs = dict((k, v[:n]) for k, v in stacked_attrs.iteritems())
+    # create the dataset
+    merged = first.__class__(stacked_samp, **{col: stacked_attrs})
+    getattr(merged, other_col).update(merged_other)
+    a_merger.merge_into(merged)
+    return merged
+
+
 def vstack(datasets, a=None):
     """Stacks datasets vertically (appending samples).
 
@@ -651,8 +877,10 @@ def vstack(datasets, a=None):
 
     Parameters
     ----------
-    datasets : tuple
-        Sequence of datasets to be stacked.
+    datasets : tuple or iterable
+        Sequence of datasets to be stacked.  Any iterable (e.g. a generator)
+        is accepted as well, so datasets do not need to be all present in
+        memory at once.
     a: {'unique','drop_nonunique','uniques','all'} or True or False or None (default: None)
         Indicates which dataset attributes from datasets are stored
         in merged_dataset. If an int k, then the dataset attributes from
@@ -671,35 +899,7 @@ def vstack(datasets, a=None):
     -------
     AttrDataset (or respective subclass)
     """
-    if not len(datasets):
-        raise ValueError('concatenation of zero-length sequences is impossible')
-    if not len(datasets) > 1:
-        # trivial vstack
-        return datasets[0]
-    # fall back to numpy if it is not a dataset
-    if not is_datasetlike(datasets[0]):
-        return AttrDataset(np.vstack(datasets))
-
-    if __debug__:
-        target = sorted(datasets[0].sa.keys())
-        if not np.all([sorted(ds.sa.keys()) == target for ds in datasets]):
-            raise ValueError("Sample attributes collections of to be stacked "
-                             "datasets have varying attributes.")
-    # will puke if not equal number of features
-    stacked_samp = np.concatenate([ds.samples for ds in datasets], axis=0)
-
-    stacked_sa = {}
-    for attr in datasets[0].sa:
-        stacked_sa[attr] = np.concatenate(
-            [ds.sa[attr].value for ds in datasets], axis=0)
-    # create the dataset
-    merged = datasets[0].__class__(stacked_samp, sa=stacked_sa)
-
-    for ds in datasets:
-        merged.fa.update(ds.fa)
-
-    _stack_add_equal_dataset_attributes(merged, datasets, a)
-    return merged
+    return _stack(datasets, 0, a)
 
 
 def hstack(datasets, a=None):
@@ -714,8 +914,10 @@ def hstack(datasets, a=None):
 
     Parameters
     ----------
-    datasets : tuple
-        Sequence of datasets to be stacked.
+    datasets : tuple or iterable
+        Sequence of datasets to be stacked.  Any iterable (e.g. a generator)
+        is accepted as well, so datasets do not need to be all present in
+        memory at once.
     a: {'unique','drop_nonunique','uniques','all'} or True or False or None (default: None)
         Indicates which dataset attributes from datasets are stored
         in merged_dataset. If an int k, then the dataset attributes from
@@ -737,39 +939,7 @@ def hstack(datasets, a=None):
     #
     # XXX Use CombinedMapper in here whenever it comes back
     #
-
-    if not len(datasets):
-        raise ValueError('concatenation of zero-length sequences is impossible')
-    if not len(datasets) > 1:
-        # trivial hstack
-        return datasets[0]
-    # fall back to numpy if it is not a dataset
-    if not is_datasetlike(datasets[0]):
-        # we might get a list of 1Ds that would yield wrong results when
-        # turned into a dict (would run along samples-axis)
-        return AttrDataset(np.atleast_2d(np.hstack(datasets)))
-
-    if __debug__:
-        target = sorted(datasets[0].fa.keys())
-        if not np.all([sorted(ds.fa.keys()) == target for ds in datasets]):
-            raise ValueError("Feature attributes collections of to be stacked "
-                             "datasets have varying attributes.")
-    # will puke if not equal number of samples
-    stacked_samp = np.concatenate([ds.samples for ds in datasets], axis=1)
-
-    stacked_fa = {}
-    for attr in datasets[0].fa:
-        stacked_fa[attr] = np.concatenate(
-            [ds.fa[attr].value for ds in datasets], axis=0)
-    # create the dataset
-    merged = datasets[0].__class__(stacked_samp, fa=stacked_fa)
-
-    for ds in datasets:
-        merged.sa.update(ds.sa)
-
-    _stack_add_equal_dataset_attributes(merged, datasets, a)
-
-    return merged
+    return _stack(datasets, 1, a)
 
 
 def all_equal(x, y):
@@ -824,6 +994,171 @@ def all_equal(x, y):
     # do a recursive call on all elements
     return all(all_equal(xx, yy) for (xx, yy) in zip(x, y))
 
+_HASHABLE_TYPES = (basestring, int, long, float, complex, np.number,
+                   np.bool_, type(None))
+"""Types whose hashes agree with `all_equal` (among values of a type)"""
+
+
+def _value_hash(value):
+    """Hash of a value consistent with `all_equal` among values of a type
+
+    Only values whose hashes are known to agree with equality (strings,
+    numbers, tuples of those, and arrays of numbers or strings) get
+    hashed, since e.g. objects providing `__eq__` might still be hashed by
+    their ids.
+
+    Returns
+    -------
+    int or None
+      None if the value should be compared against all the others.
+    """
+    if isinstance(value, _HASHABLE_TYPES):
+        return hash(value)
+    elif isinstance(value, tuple):
+        hashes = [_value_hash(v) for v in value]
+        if None in hashes:
+            return None
+        return hash(tuple(hashes))
+    elif isinstance(value, np.ndarray):
+        kind = value.dtype.kind
+        if kind in 'biuf' or (kind == 'c' and not np.any(value.imag)):
+            # equal values of different (e.g. int and float) dtypes get
+            # the same hash, and -0.0 the hash of 0.0
+            value = np.asarray(value.real, dtype=np.float64) + 0
+        elif kind == 'c':
+            value = np.asarray(value, dtype=np.complex128) + 0
+        elif kind in 'SU':
+            # regardless of the length of the strings
+            return hash((value.shape, tuple(value.ravel().tolist())))
+        else:
+            # objects, records, etc
+            return hash(value.shape)
+        return hash((value.shape, value.tostring()))
+    return None
+
+
+class _UniqueValues(object):
+    """Sequence of unique (in the sense of `all_equal`) values
+
+    Values get looked up by their hashes among the values of the same
+    type, so checking for presence does not require comparisons against all
+    the stored values.
+    """
+    def __init__(self):
+        self.values = []
+        self._hashed = {}               # (type, hash): values
+        self._by_type = {}              # type: hashed values
+        self._unhashed = []
+
+    def __contains__(self, value):
+        vtype, h = type(value), _value_hash(value)
+        if h is None:
+            candidates = self.values
+        else:
+            # values of other types (e.g. list and array) might still be
+            # equal
+            candidates = itertools.chain(
+                self._hashed.get((vtype, h), []), self._unhashed,
+                *[vals for t, vals in self._by_type.iteritems()
+                  if t is not vtype])
+        return any(all_equal(v, value) for v in candidates)
+
+    def append(self, value):
+        self.values.append(value)
+        h = _value_hash(value)
+        if h is None:
+            self._unhashed.append(value)
+        else:
+            vtype = type(value)
+            self._hashed.setdefault((vtype, h), []).append(value)
+            self._by_type.setdefault(vtype, []).append(value)
+
+
+class _DatasetAttributesMerger(object):
+    """Incremental merging of dataset attributes of datasets being stacked
+
+    See `_stack_add_equal_dataset_attributes` for the meaning of `a`.
+    """
+    def __init__(self, a=None):
+        if a is False:
+            a = None
+        elif a is True:
+            a = 'drop_nonunique'
+        allowed_values = ['unique', 'uniques', 'drop_nonunique', 'all']
+        if not (a is None or type(a) is int or a in allowed_values):
+            raise ValueError("a should be an int or one of "
+                            "%r" % allowed_values)
+        self._a = a
+        self._n = 0                     # number of datasets seen
+        self._values = {}
+        self._dropped = set()
+        # dataset attributes collection(s) for an int `a`
+        self._selected = []
+
+
+    def add(self, ds):
+        """Account for dataset attributes of the next dataset"""
+        a = self._a
+        if a is None:
+            pass
+        elif type(a) is int:
+            if a < 0:
+                # last -a ones
+                self._selected.append(ds.a)
+                if len(self._selected) > -a:
+                    del self._selected[0]
+            elif a == self._n:
+                self._selected.append(ds.a)
+        else:
+            for key in ds.a.keys():
+                value = ds.a[key].value
+                if a == 'all':
+                    self._values.setdefault(key, [None] * self._n).append(value)
+                    continue
+                if key in self._dropped:
+                    continue
+                values = self._values.setdefault(key, _UniqueValues())
+                if value in values:
+                    continue
+                if a in ('drop_nonunique', 'unique') and len(values.values):
+                    if a == 'unique':
+                        raise DatasetError("Not unique dataset attribute value "
+                                           " for %s: %s and %s" %
+                                           (key, values.values[0], value))
+                    self._dropped.add(key)
+                    del self._values[key]
+                    continue
+                values.append(value)
+            if a == 'all':
+                # the ones missing in this dataset
+                for values in self._values.itervalues():
+                    if len(values) == self._n:
+                        values.append(None)
+        self._n += 1
+
+
+    def merge_into(self, merged_dataset):
+        """Store merged dataset attributes in the `merged_dataset`"""
+        a = self._a
+        if a is None or not self._n:
+            return
+        if type(a) is int:
+            if not len(self._selected) or (a < 0 and len(self._selected) < -a):
+                raise IndexError("Cannot take dataset attributes from dataset "
+                                 "%d out of %d" % (a, self._n))
+            base_a = self._selected[0]
+            for key in base_a.keys():
+                merged_dataset.a[key] = base_a[key].value
+            return
+        for key, values in self._values.iteritems():
+            if a == 'all':
+                merged_dataset.a[key] = tuple(values)
+            elif a == 'uniques':
+                merged_dataset.a[key] = tuple(values.values)
+            else:
+                merged_dataset.a[key] = values.values[0]
+
+
 def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
     """Helper function for vstack and hstack to find dataset
     attributes common to a set of datasets, and at them to the output.
@@ -853,74 +1188,10 @@ def _stack_add_equal_dataset_attributes(merged_dataset, datasets, a=None):
         attributes are stored in merged_dataset. True is equivalent to
         'drop_nonunique'. False is equivalent to None.
     """
-    if a is None or a is False:
-        # do nothing
-        return
-    elif a is True:
-        a = 'drop_nonunique'
-
-    if not datasets:
-        # empty - so nothing to do
-        return
-
-    if type(a) is int:
-        base_dataset = datasets[a]
-
-        for key in base_dataset.a.keys():
-            merged_dataset.a[key] = base_dataset.a[key].value
-
-        return
-
-    allowed_values = ['unique', 'uniques', 'drop_nonunique', 'all']
-    if not a in allowed_values:
-        raise ValueError("a should be an int or one of "
-                        "%r" % allowed_values)
-
-    # consider all keys that are present in at least one dataset
-    all_keys = set.union(*[set(dataset.a.keys()) for dataset in datasets])
-
-
-    def _contains(xs, y, comparator=all_equal):
-        for x in xs:
-            if comparator(x, y):
-                return True
-        return False
-
-    for key in all_keys:
-        add_key = True
-        values = []
-        for i, dataset in enumerate(datasets):
-            if not key in dataset.a:
-                if a == 'all':
-                    values.append(None)
-                continue
-
-            value = dataset.a[key].value
-
-            if a in ('drop_nonunique', 'unique'):
-                if not values:
-                    values.append(value)
-                elif not _contains(values, value):
-                    if a == 'unique':
-                        raise DatasetError("Not unique dataset attribute value "
-                                         " for %s: %s and %s" %
-                                            (key, values[0], value))
-                    else:
-                        add_key = False
-                        break
-            elif a == 'uniques':
-                if not _contains(values, value):
-                    values.append(value)
-            elif a == 'all':
-                values.append(value)
-            else:
-                raise ValueError("this should not happen: %s" % a)
-
-        if add_key:
-            if a in ('drop_nonunique', 'unique'):
-                merged_dataset.a[key] = values[0]
-            else:
-                merged_dataset.a[key] = tuple(values)
+    merger = _DatasetAttributesMerger(a)
+    for dataset in datasets:
+        merger.add(dataset)
+    merger.merge_into(merged_dataset)
 
 
 def _expand_attribute(attr, length, attr_name):
@@ -1145,7 +1416,8 @@ DAE = DatasetAttributeExtractor
 
 
 @datasetmethod
-def save(dataset, destination, name=None, compression=None):
+def save(dataset, destination, name=None, compression=None, layout=None,
+         chunk_bytes=None, **kwargs):
     """Save Dataset into HDF5 file
 
     Parameters
@@ -1153,8 +1425,22 @@ def save(dataset, destination, name=None, compression=None):
     dataset : `Dataset`
     destination : `h5py.highlevel.File` or str
     name : str, optional
-    compression : None or int or {'gzip', 'szip', 'lzf'}, optional
+    compression : None or int or {'gzip', 'szip', 'lzf', 'blosc'}, optional
       Level of compression for gzip, or another compression strategy.
+      'blosc' (or e.g. 'blosc:zstd' to select its compressor) requires
+      `hdf5plugin`.
+    layout : None or {'samples', 'features', 'tiled'} or tuple, optional
+      Chunking policy for the samples: 'samples' for efficient access to
+      (subsets of) samples, 'features' for efficient access to (subsets
+      of) features, e.g. by searchlight workers, or 'tiled' for a
+      compromise.  A tuple gives the chunk shape explicitly.  If None,
+      samples are stored contiguously, unless compression requires h5py
+      to choose the chunking.
+    chunk_bytes : None or int, optional
+      Target size of a chunk in bytes (default: 1MB).
+    **kwargs
+      Additional arguments for `h5py.Group.create_dataset()`, e.g.
+      `compression_opts` or `shuffle`.
     """
     if not externals.exists('h5py'):
         raise RuntimeError("Missing 'h5py' package -- saving is not possible.")
@@ -1170,7 +1456,11 @@ def save(dataset, destination, name=None, compression=None):
         own_file = True
         hdf = h5py.File(destination, 'w')
 
-    obj2hdf(hdf, dataset, name, compression=compression)
+    if layout is not None:
+        kwargs['layout'] = layout
+        if chunk_bytes is not None:
+            kwargs['chunk_bytes'] = chunk_bytes
+    obj2hdf(hdf, dataset, name, compression=compression, **kwargs)
 
     # if we opened the file ourselves we close it now
     if own_file:
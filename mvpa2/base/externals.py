@@ -571,6 +571,7 @@ _KNOWN = {'libsvm':'import mvpa2.clfs.libsvmc._svm as __; x=__.seq_to_svm_node',
           'pywt': "__check('pywt')",
           'h5py': "__check_h5py()",
           'hdf5': "__check_h5py()",
+          'hdf5plugin': "__check('hdf5plugin')",
           'nipy': "__check('nipy')",
           'nipy.neurospin': "__check_nipy_neurospin()",
           'statsmodels': 'import statsmodels.api as __',
@@ -54,13 +54,299 @@ universal_classname_remapper = {
     ('mvpa2.mappers.base', 'FeatureSliceMapper'):
         ('mvpa2.featsel.base', 'StaticFeatureSelection'),
 }
+# key in the memo of hdf2obj to flag lazy loading of datasets
+_LAZY = '__lazy__'
+# key in the memo of hdf2obj to collect arrays still reading from the file
+_LAZY_ARRAYS = '__lazy_arrays__'
+
+chunk_layouts = ('samples', 'features', 'tiled')
+"""Chunking policies for 2D arrays (see `obj2hdf()`)"""
+
+# arguments of h5py.Group.create_dataset() which cannot be used for scalars
+_FILTER_KWARGS = ('compression', 'compression_opts', 'shuffle', 'fletcher32',
+                  'scaleoffset', 'chunks')
+
 # Comment: H5Py defines H5Error
 class HDF5ConversionError(Exception):
     """Generic exception to be thrown while doing conversions to/from HDF5
     """
     pass
 
-def hdf2obj(hdf, memo=None):
+
+class HDF5Array(object):
+    """Read-only array-like access to an array stored in an HDF5 dataset
+
+    Only the selected elements are read from the file upon indexing.  Unlike
+    with NumPy arrays, indexing with a tuple of index sequences (or boolean
+    masks) is orthogonal, i.e. it selects all the combinations of the
+    indices (as with `np.ix_`).  Conversion into an array (e.g. with
+    `np.asarray()`) reads the whole array.
+
+    The HDF5 file has to remain open while the array is in use.  Use
+    `close()` to close it afterwards.
+    """
+
+    orthogonal_indexing = True
+    """Flag for `AttrDataset` to select samples and features at once"""
+
+    def __init__(self, hdf):
+        """
+        Parameters
+        ----------
+        hdf : h5py.Dataset
+        """
+        self._hdf = hdf
+
+    shape = property(fget=lambda self: self._hdf.shape)
+    dtype = property(fget=lambda self: self._hdf.dtype)
+    ndim = property(fget=lambda self: len(self._hdf.shape))
+    size = property(fget=lambda self: int(np.prod(self._hdf.shape)))
+
+    @property
+    def layout(self):
+        """Chunk layout the array was stored with (see `obj2hdf()`)"""
+        layout = self._hdf.attrs.get('chunk_layout', None)
+        if layout is None or isinstance(layout, basestring):
+            return layout
+        # explicit chunk shape
+        return tuple(layout)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def file(self):
+        """HDF5 file the array is read from"""
+        return self._hdf.file
+
+    def close(self):
+        """Close the HDF5 file the array is read from
+
+        Other arrays read from the same file become unusable as well.
+        """
+        if self._hdf.id.valid:
+            self._hdf.file.close()
+
+    def __repr__(self):
+        return "%s(<%s in %s>)" % (self.__class__.__name__,
+                                   self._hdf.name, self._hdf.file.filename)
+
+    def __array__(self, dtype=None):
+        arr = np.empty(self.shape, self.dtype)
+        if arr.size:
+            self._hdf.read_direct(arr)
+        if dtype is not None:
+            arr = arr.astype(dtype)
+        return arr
+
+    def view(self):
+        """Return itself, since the array is read-only anyways"""
+        return self
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo=None):
+        return np.asarray(self)
+
+    def __reduce__(self):
+        # no way to pickle an open file -- pickle the content
+        return (np.asarray, (np.asarray(self),))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError("Too many indices (%d) for an array with %d "
+                             "dimensions" % (len(key), self.ndim))
+        key = key + (slice(None),) * (self.ndim - len(key))
+        hkey = []                       # selection to read from the file
+        post = []                       # selections to apply after reading
+        squeeze = []                    # axes indexed with scalars
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            idx = None
+            if isinstance(k, (int, long, np.integer)):
+                if not -n <= k < n:
+                    raise IndexError("Index %d is out of bounds for axis %d "
+                                     "with size %d" % (k, axis, n))
+                k = int(k) % n
+                hkey.append(slice(k, k + 1))
+                squeeze.append(axis)
+            elif isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step > 0:
+                    hkey.append(slice(start, max(start, stop), step))
+                else:
+                    # HDF5 does not support reverse order
+                    idx = np.arange(start, stop, step)
+            else:
+                idx = np.asanyarray(k)
+                if idx.dtype == bool:
+                    if idx.shape != (n,):
+                        raise IndexError("Boolean mask of shape %s does not "
+                                         "match axis %d with size %d"
+                                         % (idx.shape, axis, n))
+                    idx = idx.nonzero()[0]
+                elif not len(idx):
+                    idx = idx.astype(int)
+                if np.any(idx < -n) or np.any(idx >= n):
+                    raise IndexError("Index out of bounds for axis %d with "
+                                     "size %d" % (axis, n))
+                idx = np.where(idx < 0, idx + n, idx)
+            if idx is None:
+                post.append(None)
+                continue
+            # read sorted unique indices and order them as requested later
+            uidx, inv = np.unique(idx, return_inverse=True)
+            if len(uidx) == len(idx) and np.all(uidx == idx):
+                inv = None
+            if len(uidx) and (len(uidx) == 1
+                              or np.all(np.diff(uidx) == uidx[1] - uidx[0])):
+                # regularly spaced -- use a slice
+                step = len(uidx) > 1 and int(uidx[1] - uidx[0]) or 1
+                hkey.append(slice(int(uidx[0]), int(uidx[-1]) + 1, step))
+            else:
+                hkey.append(uidx)
+            post.append(inv)
+
+        # HDF5 allows for a single index list only, others get read by
+        # their bounding ranges.  With chunks spanning all samples, reading
+        # the bounding range of samples comes at no additional cost
+        lists = [i for i, k in enumerate(hkey) if not isinstance(k, slice)]
+        if self.layout == 'features':
+            lists = lists[::-1]
+        for i in lists[1:]:
+            uidx = hkey[i]
+            if len(uidx):
+                hkey[i] = slice(int(uidx[0]), int(uidx[-1]) + 1)
+                offsets = uidx - uidx[0]
+            else:
+                hkey[i] = slice(0, 0)
+                offsets = uidx
+            post[i] = offsets if post[i] is None else offsets[post[i]]
+
+        shape = tuple(len(k) if not isinstance(k, slice)
+                      else len(xrange(*k.indices(n)))
+                      for k, n in zip(hkey, self.shape))
+        if np.prod(shape) == 0:
+            # HDF5 fails to select nothing
+            data = np.empty(shape, dtype=self.dtype)
+        else:
+            data = self._hdf[tuple(hkey)]
+        for axis, p in enumerate(post):
+            if p is not None:
+                data = data.take(p, axis=axis)
+        if len(squeeze):
+            data = data[tuple(0 if i in squeeze else slice(None)
+                              for i in xrange(self.ndim))]
+        return data
+
+
+def _get_chunk_shape(shape, itemsize, layout, chunk_bytes=2**20):
+    """Determine the chunk shape of a 2D array for a chunk layout
+
+    Parameters
+    ----------
+    shape : tuple
+      Shape of the array.
+    itemsize : int
+      Number of bytes per element.
+    layout : {'samples', 'features', 'tiled'} or tuple
+      'samples' -- chunks span all columns (features), so single samples
+      are read efficiently.  'features' -- chunks span all rows, so single
+      features (e.g. ROIs of a searchlight) are read efficiently.  'tiled'
+      -- square-ish blocks as a compromise between both.  A tuple gives
+      the chunk shape explicitly (limited to the shape of the array).
+    chunk_bytes : int
+      Target size of a chunk in bytes.
+
+    Returns
+    -------
+    tuple or None
+      None if the array is empty, so it cannot be chunked.
+    """
+    nrows, ncols = shape
+    if not nrows or not ncols:
+        return None
+    if isinstance(layout, tuple):
+        if not len(layout) == 2:
+            raise ValueError("Explicit chunk shape %s does not match a 2D "
+                             "array" % (layout,))
+        return (max(1, min(nrows, layout[0])), max(1, min(ncols, layout[1])))
+    nitems = max(1, chunk_bytes // itemsize)
+    if layout == 'samples':
+        return (max(1, min(nrows, nitems // ncols)), ncols)
+    elif layout == 'features':
+        return (nrows, max(1, min(ncols, nitems // nrows)))
+    elif layout == 'tiled':
+        side = max(1, int(np.sqrt(nitems)))
+        rows = min(nrows, side)
+        return (rows, max(1, min(ncols, nitems // rows)))
+    raise ValueError("Unknown chunk layout %r.  Known are: %s"
+                     % (layout, ', '.join(chunk_layouts)))
+
+
+def _get_filter_kwargs(kwargs):
+    """Translate compression arguments into those of `create_dataset()`
+
+    Besides the compression filters known to h5py ('gzip', 'lzf', 'szip'),
+    'blosc' (optionally with a compressor, e.g. 'blosc:zstd') is supported
+    if `hdf5plugin` is available.  `compression_opts` specifies the
+    compression level for it.
+    """
+    compression = kwargs.get('compression', None)
+    if not isinstance(compression, basestring) \
+       or not compression.startswith('blosc'):
+        return kwargs
+    externals.exists('hdf5plugin', raise_=True)
+    import hdf5plugin
+    kwargs = kwargs.copy()
+    kwargs.pop('compression')
+    bkwargs = {}
+    if ':' in compression:
+        bkwargs['cname'] = compression.split(':', 1)[1]
+    if kwargs.get('compression_opts', None) is not None:
+        bkwargs['clevel'] = kwargs.pop('compression_opts')
+    if 'shuffle' in kwargs:
+        # filter of HDF5 would be applied in addition to the one of blosc
+        bkwargs['shuffle'] = kwargs.pop('shuffle') \
+                             and hdf5plugin.Blosc.SHUFFLE \
+                             or hdf5plugin.Blosc.NOSHUFFLE
+    kwargs.update(hdf5plugin.Blosc(**bkwargs))
+    return kwargs
+
+
+def _hdf2lazy(hdf, memo):
+    """Provide lazy access to an array stored in an HDF5 dataset
+
+    Uncompressed contiguously stored arrays are memory-mapped, others are
+    provided as `HDF5Array`, and collected in the memo, since the file has
+    to remain open for them.
+    """
+    offset = None
+    if hdf.chunks is None and hdf.compression is None \
+       and not hdf.dtype.hasobject:
+        try:
+            offset = hdf.id.get_offset()
+        except AttributeError:
+            # old h5py
+            pass
+    if offset is not None:
+        if __debug__:
+            debug('HDF5', "Memory-map HDF5 dataset [%s]" % hdf.name)
+        # plain ndarray view, so results of computations do not become
+        # np.memmap instances
+        return np.asarray(np.memmap(hdf.file.filename, dtype=hdf.dtype,
+                                    mode='r', offset=offset,
+                                    shape=hdf.shape))
+    if __debug__:
+        debug('HDF5', "Lazy access to HDF5 dataset [%s]" % hdf.name)
+    arr = HDF5Array(hdf)
+    memo.setdefault(_LAZY_ARRAYS, []).append(arr)
+    return arr
+
+
+def hdf2obj(hdf, memo=None, lazy=False):
     """Convert an HDF5 group definition into an object instance.
 
     Obviously, this function assumes the conventions implemented in the
@@ -74,6 +360,13 @@ def hdf2obj(hdf, memo=None):
     memo : dict
       Dictionary tracking reconstructed objects to prevent recursions (analog to
       deepcopy).
+    lazy : bool
+      If True, samples of datasets are not read into memory.  They are
+      memory-mapped if stored uncompressed and contiguously, and otherwise
+      provided as `HDF5Array` reading only the selected samples/features
+      upon slicing of the dataset.  The HDF5 file has to remain open for the
+      latter, which are listed in the memo (if provided) under
+      `_LAZY_ARRAYS` key.
 
     Notes
     -----
@@ -91,6 +384,8 @@ def hdf2obj(hdf, memo=None):
     if memo is None:
         # init object tracker
         memo = {}
+    if lazy:
+        memo[_LAZY] = True
     # note, older file formats did not store objrefs
     if 'objref' in hdf.attrs:
         objref = hdf.attrs['objref']
@@ -274,7 +569,14 @@ def _recon_customobj_customrecon(hdf, memo):
                         obj = None
                 if obj is not None:
                     memo[hdf.attrs['objref']] = obj
-        recon_args = _hdf_tupleitems_to_obj(recon_args_hdf, memo)
+        lazy_items = ()
+        if memo.get(_LAZY, False):
+            from mvpa2.base.dataset import AttrDataset
+            if isinstance(recon, type) and issubclass(recon, AttrDataset):
+                # samples
+                lazy_items = (0,)
+        recon_args = _hdf_tupleitems_to_obj(recon_args_hdf, memo,
+                                            lazy_items=lazy_items)
     else:
         recon_args = ()
 
@@ -421,13 +723,15 @@ def _hdf_list_to_objarray(hdf, memo):
             obj = obj.reshape(shape)
     return obj
 
-def _hdf_list_to_obj(hdf, memo, target_container=None):
+def _hdf_list_to_obj(hdf, memo, target_container=None, lazy_items=()):
     """Convert an HDF item sequence into a list
 
     Lists are used for storing also dicts.  To properly reference
     the actual items in memo, target_container could be specified
     to point to the actual data structure to be referenced, which
-    later would get populated with list's items.
+    later would get populated with list's items.  Plain arrays at the
+    positions listed in `lazy_items` are not read into memory (see
+    `_hdf2lazy`).
     """
     # new-style files have explicit length
     if 'length' in hdf.attrs:
@@ -483,7 +787,13 @@ def _hdf_list_to_obj(hdf, memo, target_container=None):
             objref = hdf_items.attrs[str_i]
         # do we have an actual value for this item
         if str_i in hdf_items:
-            obj = hdf2obj(hdf_items[str_i], memo=memo)
+            hdf_item = hdf_items[str_i]
+            if i in lazy_items and isinstance(hdf_item, h5py.Dataset) \
+               and not set(hdf_item.attrs.keys()).intersection(
+                   ('is_scalar', 'is_numpy_scalar', 'is_objarray')):
+                obj = _hdf2lazy(hdf_item, memo)
+            else:
+                obj = hdf2obj(hdf_item, memo=memo)
             # we need to signal that we got something, since it could as well
             # be None
             got_obj = True
@@ -510,9 +820,9 @@ def _hdf_list_to_obj(hdf, memo, target_container=None):
     return items
 
 
-def _hdf_tupleitems_to_obj(hdf, memo):
+def _hdf_tupleitems_to_obj(hdf, memo, lazy_items=()):
     """Same as _hdf_list_to_obj, but converts to tuple upon return"""
-    return tuple(_hdf_list_to_obj(hdf, memo))
+    return tuple(_hdf_list_to_obj(hdf, memo, lazy_items=lazy_items))
 
 
 def _seqitems_to_hdf(obj, hdf, memo, noid=False, **kwargs):
@@ -554,7 +864,14 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
       If True, the to be processed object has no usable id. Set if storing
       objects that were created temporarily, e.g. during type conversions.
     **kwargs
-      All additional arguments will be passed to `h5py.Group.create_dataset()`
+      All additional arguments will be passed to `h5py.Group.create_dataset()`,
+      except for the following ones.  `layout` ({'samples', 'features',
+      'tiled'} or tuple) selects the chunking policy for 2D arrays, such as
+      dataset samples (see `_get_chunk_shape()`), and `chunk_bytes` its
+      target chunk size in bytes (default: 1MB).  The layout is recorded
+      in the 'chunk_layout' attribute of the HDF5 dataset.  `compression`
+      could also be 'blosc' (or e.g. 'blosc:lz4') if `hdf5plugin` is
+      available.
     """
     if memo is None:
         # initialize empty recursion tracker
@@ -617,14 +934,33 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
             debug('HDF5', "Store '%s' (ref: %i) in [%s/%s]"
                           % (type(obj), obj_id, hdf.name, name))
         # the real action is here
-        if 'compression' in kwargs \
-               and (is_scalar or (is_ndarray and not len(obj.shape))):
+        dkwargs = dict([(k, v) for (k, v) in kwargs.iteritems()
+                        if not k in ('layout', 'chunk_bytes')])
+        layout = kwargs.get('layout', None)
+        if is_scalar or (is_ndarray and not len(obj.shape)):
             # recent (>= 2.0.0) h5py is strict not allowing
             # compression to be set for scalar types or anything with
             # shape==() ... TODO: check about is_objarrays ;-)
-            kwargs = dict([(k, v) for (k, v) in kwargs.iteritems()
-                           if k != 'compression'])
-        hdf.create_dataset(name, None, None, obj, **kwargs)
+            dkwargs = dict([(k, v) for (k, v) in dkwargs.iteritems()
+                            if not k in _FILTER_KWARGS])
+            layout = None
+        else:
+            dkwargs = _get_filter_kwargs(dkwargs)
+        if layout is not None and is_ndarray and len(obj.shape) == 2 \
+               and not obj.dtype.hasobject:
+            chunks = _get_chunk_shape(
+                obj.shape, obj.dtype.itemsize, layout,
+                chunk_bytes=kwargs.get('chunk_bytes', None) or 2**20)
+            if chunks is None:
+                layout = None
+            else:
+                dkwargs['chunks'] = chunks
+        else:
+            layout = None
+        hdf.create_dataset(name, None, None, obj, **dkwargs)
+        if layout is not None:
+            # let loaders know how to read efficiently
+            hdf[name].attrs.create('chunk_layout', layout)
         if not noid and not is_scalar:
             # objref for scalar items would be overkill
             hdf[name].attrs.create('objref', obj_id)
@@ -813,8 +1149,10 @@ def h5save(filename, data, name=None, mode='w', mkdir=True, **kwargs):
     mkdir : bool, optional
       Create target directory if it does not exist yet.
     **kwargs
-      All additional arguments will be passed to `h5py.Group.create_dataset`.
-      This could, for example, be `compression='gzip'`.
+      All additional arguments will be passed to `h5py.Group.create_dataset`
+      (see `obj2hdf()` for exceptions).  This could, for example, be
+      `compression='gzip'`, or `layout='features'` to chunk samples for
+      efficient reading of feature subsets.
     """
     if mkdir:
         target_dir = osp.dirname(filename)
@@ -829,7 +1167,7 @@ def h5save(filename, data, name=None, mode='w', mkdir=True, **kwargs):
         hdf.close()
 
 
-def h5load(filename, name=None):
+def h5load(filename, name=None, lazy=False):
     """Loads the content of an HDF5 file that has been stored by `h5save()`.
 
     This is a convenience wrapper around `hdf2obj()`. Please see its
@@ -841,6 +1179,11 @@ def h5load(filename, name=None):
       Name of the file to open and load its content.
     name : str
       Name of a specific object to load from the file.
+    lazy : bool
+      If True, samples of datasets are not read into memory (see
+      `hdf2obj()`).  The file is closed unless some samples are provided
+      as `HDF5Array`, which are read from the open file until it is closed
+      with `HDF5Array.close()`.
 
     Returns
     -------
@@ -848,12 +1191,14 @@ def h5load(filename, name=None):
       An object of whatever has been stored in the file.
     """
     hdf = h5py.File(filename, 'r')
+    memo = {}
+    keep_open = False
     try:
         if not name is None:
             if not name in hdf:
                 raise ValueError("No object of name '%s' in file '%s'."
                                  % (name, filename))
-            obj = hdf2obj(hdf[name])
+            obj = hdf2obj(hdf[name], memo=memo, lazy=lazy)
         else:
             if not len(hdf) and not len(hdf.attrs):
                 # there is nothing
@@ -863,19 +1208,23 @@ def h5load(filename, name=None):
                 if isinstance(hdf, h5py.Dataset) \
                    or ('class' in hdf.attrs or 'recon' in hdf.attrs):
                     # this is an object stored at the toplevel
-                    obj = hdf2obj(hdf)
+                    obj = hdf2obj(hdf, memo=memo, lazy=lazy)
                 else:
                     # no object into at the top-level, but maybe in the next one
                     # this would happen for plain mat files with arrays
                     if len(hdf) == 1 and '__unnamed__' in hdf:
                         # just a single with special name -> special case:
                         # return as is
-                        obj = hdf2obj(hdf['__unnamed__'])
+                        obj = hdf2obj(hdf['__unnamed__'], memo=memo,
+                                      lazy=lazy)
                     else:
                         # otherwise build dict with content
                         obj = {}
                         for k in hdf:
-                            obj[k] = hdf2obj(hdf[k])
+                            obj[k] = hdf2obj(hdf[k], memo=memo, lazy=lazy)
+        # arrays loaded lazily still read from the file
+        keep_open = bool(memo.get(_LAZY_ARRAYS))
     finally:
-        hdf.close()
+        if not keep_open:
+            hdf.close()
     return obj
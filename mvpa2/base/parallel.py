@@ -0,0 +1,374 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Pluggable backends for running independent tasks in parallel
+
+A task is a pair ``(args, kwargs)`` to be passed to a single callable.
+Available backends are
+
+serial
+  Plain sequential loop in the calling process.
+threads
+  Pool of threads (:class:`multiprocessing.pool.ThreadPool`).  Beneficial
+  only for computations which release the GIL (e.g. large numpy/BLAS
+  operations).
+multiprocessing
+  Pool of forked worker processes (:class:`multiprocessing.Pool`).
+  Callable and arguments are inherited by the workers through `fork`,
+  so they are never pickled; only the results are sent back.
+pprocess
+  Legacy backend using the `pprocess` module.
+auto
+  'multiprocessing' wherever `fork` is available, 'serial' otherwise.
+
+Default backend and number of processes can be specified in the
+``[parallel]`` section of the configuration file (options ``backend``
+and ``nproc``).
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import itertools
+import tempfile
+
+import numpy as np
+
+from mvpa2.base import cfg, externals, warning
+
+if __debug__:
+    from mvpa2.base import debug
+
+__all__ = ['backends', 'get_backend', 'get_nproc', 'parallel_map',
+           'share_dataset']
+
+backends = ('serial', 'threads', 'multiprocessing', 'pprocess')
+"""Names of all known backends (besides 'auto')"""
+
+# Registry of the jobs being executed.  It gets populated before worker
+# processes are forked, so workers get access to the callable and its
+# arguments without any pickling.  Keys are job ids.
+_jobs = {}
+_job_counter = itertools.count()
+
+
+def _in_daemon():
+    """Either we are running within a daemonic (e.g. pool worker) process
+
+    Such processes are not allowed to spawn children
+    """
+    import multiprocessing
+    return multiprocessing.current_process().daemon
+
+
+def get_backend(backend=None):
+    """Resolve the name of the parallelization backend
+
+    Parameters
+    ----------
+    backend : None or str
+      Name of the backend (see module documentation).  If None, the value
+      of the ``backend`` option in the ``[parallel]`` section of the
+      configuration is taken (defaults to 'auto').
+
+    Returns
+    -------
+    str
+      One of `backends`.
+    """
+    if backend is None:
+        backend = cfg.get('parallel', 'backend', default='auto')
+    backend = backend.lower()
+    if backend == 'auto':
+        backend = 'multiprocessing' if hasattr(os, 'fork') else 'serial'
+    if not backend in backends:
+        raise ValueError("Unknown parallelization backend %r. Known are: %s"
+                         % (backend, ', '.join(('auto',) + backends)))
+    if backend == 'multiprocessing' and not hasattr(os, 'fork'):
+        raise ValueError("'multiprocessing' backend requires a platform "
+                         "supporting fork. Use 'threads' or 'serial'")
+    return backend
+
+
+def get_nproc(nproc=None, backend=None):
+    """Figure out how many workers to use
+
+    Parameters
+    ----------
+    nproc : None or int
+      Requested number of workers.  If None, the value of the ``nproc``
+      option in the ``[parallel]`` section of the configuration is taken,
+      and if absent -- the number of available cores.
+    backend : None or str
+      Parallelization backend (see `get_backend`).
+    """
+    backend = get_backend(backend)
+    if backend == 'serial' or _in_daemon():
+        # nested parallelization is not possible from within worker
+        # processes
+        return 1
+    if nproc is None and cfg.has_option('parallel', 'nproc'):
+        nproc = cfg.getint('parallel', 'nproc')
+    if nproc is None:
+        if backend == 'pprocess':
+            if not externals.exists('pprocess'):
+                return 1
+            import pprocess
+            try:
+                nproc = pprocess.get_number_of_cores() or 1
+            except AttributeError:
+                warning("pprocess version %s has no API to figure out maximal "
+                        "number of cores. Using 1"
+                        % externals.versions['pprocess'])
+                nproc = 1
+        else:
+            import multiprocessing
+            try:
+                nproc = multiprocessing.cpu_count()
+            except NotImplementedError:
+                nproc = 1
+    return nproc
+
+
+def _run_task(job_task):
+    """Execute a single task of a registered job
+
+    Exceptions are not raised but returned, so the caller gets notified
+    about every finished task.  Arguments of the task are either passed
+    along (tasks provided by an iterator), or looked up in the registry.
+    """
+    jobid, itask = job_task[:2]
+    func, tasks = _jobs[jobid]
+    if len(job_task) > 2:
+        args, kwargs = job_task[2:]
+    else:
+        args, kwargs = tasks[itask]
+    try:
+        return itask, True, func(*args, **kwargs)
+    except Exception, e:
+        if __debug__:
+            import traceback
+            debug('PAR', "Task %d failed: %s"
+                  % (itask, traceback.format_exc()))
+        return itask, False, e
+
+
+def _get_worker_pids(pool):
+    """Process ids of the workers of a pool (none for a pool of threads)"""
+    return set([w.pid for w in pool._pool if getattr(w, 'pid', None)])
+
+
+def _check_workers(pool, pids):
+    """Raise if any worker of a pool died since `pids` were collected
+
+    Workers of a pool never exit on their own, so a missing (or exited)
+    worker was killed (e.g. by the OOM killer), and the task it was
+    running would never finish.  `Pool` replaces such workers silently.
+    """
+    if any([getattr(w, 'pid', None) and w.exitcode is not None
+            for w in pool._pool]) \
+       or _get_worker_pids(pool) != pids:
+        raise RuntimeError("A worker process died unexpectedly (killed "
+                           "due to lack of memory?). Results of its task "
+                           "would never become available")
+
+
+def _pool_map(pool_cls, func, tasks, nproc, ordered, poll_interval=1.0):
+    """Generator running tasks within a pool of workers
+
+    Similarly to pprocess, no more than `nproc` tasks are submitted ahead
+    of the results being consumed, so results of a large number of tasks
+    could be processed "on the fly" without accumulating in memory.
+    If `tasks` is an iterator, tasks are also consumed only as the results
+    are, but their arguments get pickled to be passed to the workers.
+    Liveness of the workers is checked whenever no result arrived within
+    `poll_interval` seconds.
+    """
+    import Queue
+    jobid = _job_counter.next()
+    if isinstance(tasks, list):
+        itasks = ((itask, ()) for itask in xrange(len(tasks)))
+    else:
+        itasks = enumerate(tasks)
+        tasks = None
+    # register before the pool gets created, so forked workers see it
+    _jobs[jobid] = (func, tasks)
+    pool = None
+    try:
+        pool = pool_cls(nproc)
+        pids = _get_worker_pids(pool)
+        done = Queue.Queue()
+        nsubmitted = [0]
+
+        def submit(n):
+            for itask, task in itertools.islice(itasks, n):
+                pool.apply_async(_run_task, ((jobid, itask) + tuple(task),),
+                                 callback=done.put)
+                nsubmitted[0] += 1
+
+        submit(nproc)
+        finished = {}               # finished but not yet provided results
+        inext = 0
+        while inext < nsubmitted[0]:
+            while not (inext in finished if ordered else finished):
+                # wait with a timeout so we remain interruptible, and
+                # do not wait forever for the task of a dead worker
+                try:
+                    itask, success, res = done.get(timeout=poll_interval)
+                except Queue.Empty:
+                    _check_workers(pool, pids)
+                    continue
+                if not success:
+                    raise res
+                finished[itask] = res
+                submit(1)
+            key = inext if ordered else finished.keys()[0]
+            inext += 1
+            yield finished.pop(key)
+        pool.close()
+        pool.join()
+    finally:
+        if pool is not None:
+            # no-op if closed already; takes care about the workers if
+            # we got interrupted
+            pool.terminate()
+        del _jobs[jobid]
+
+
+def _pprocess_map(func, tasks, nproc):
+    """Run tasks using pprocess (results are always ordered)"""
+    import pprocess
+    p_results = pprocess.Map(limit=nproc)
+    compute = p_results.manage(pprocess.MakeParallel(func))
+    for args, kwargs in tasks:
+        compute(*args, **kwargs)
+    return p_results
+
+
+def parallel_map(func, tasks, nproc=None, backend=None, ordered=True):
+    """Apply `func` to every task, possibly in parallel
+
+    Parameters
+    ----------
+    func : callable
+      Function to be called for every task.  It does not need to be
+      picklable, but its return values must be for process-based backends.
+    tasks : sequence or iterator of (tuple, dict)
+      Positional and keyword arguments for each invocation of `func`.
+      A sequence is converted into a list, and its tasks are passed to
+      forked workers without pickling.  An iterator is consumed lazily
+      (just a few tasks ahead of the consumed results), so it could provide
+      any number of tasks, but their arguments get pickled with
+      process-based backends.
+    nproc : None or int
+      Number of workers (see `get_nproc`).
+    backend : None or str
+      Parallelization backend (see `get_backend`).
+    ordered : bool
+      If True, results are provided in the order of the tasks.  Otherwise
+      -- in the order they become available, which allows for dynamic
+      load balancing among the workers.  'pprocess' and 'serial' backends
+      are always ordered.
+
+    Returns
+    -------
+    iterable
+      Results of `func` invocations.  For parallel backends they are
+      provided as they become available, so the iterable should be
+      consumed fully to let the workers finish.
+    """
+    backend = get_backend(backend)
+    nproc = get_nproc(nproc, backend)
+    if hasattr(tasks, '__len__'):
+        tasks = list(tasks)
+        nproc = min(nproc, len(tasks))
+        ntasks = len(tasks)
+    else:
+        tasks = iter(tasks)
+        ntasks = 'lazy'
+    if nproc <= 1:
+        backend = 'serial'
+
+    if __debug__:
+        debug('PAR', "Running %s tasks of %s using %s backend with nproc=%s"
+              % (ntasks, func, backend, nproc))
+
+    if backend == 'serial':
+        return (func(*args, **kwargs) for args, kwargs in tasks)
+    elif backend == 'threads':
+        from multiprocessing.pool import ThreadPool
+        return _pool_map(ThreadPool, func, tasks, nproc, ordered)
+    elif backend == 'multiprocessing':
+        from multiprocessing import Pool
+        return _pool_map(Pool, func, tasks, nproc, ordered)
+    elif backend == 'pprocess':
+        externals.exists('pprocess', raise_='always')
+        return _pprocess_map(func, tasks, nproc)
+    raise RuntimeError("Must not reach this point")
+
+
+def _get_shared_tmpdir(dirname=None):
+    """Directory for files backing up shared arrays
+
+    By default POSIX shared memory (/dev/shm) is used if available, and the
+    system's temporary directory otherwise.
+    """
+    if dirname is None:
+        dirname = cfg.get('parallel', 'shared tmpdir', default=None)
+    if dirname is None and os.path.isdir('/dev/shm') \
+            and os.access('/dev/shm', os.W_OK):
+        dirname = '/dev/shm'
+    return tempfile.mkdtemp(prefix='mvpa-shared-', dir=dirname)
+
+
+def share_dataset(ds, dirname=None):
+    """Place samples and numeric attributes of a dataset into shared memory
+
+    Samples and all numeric (boolean, integer, floating point, or complex)
+    sample and feature attributes are stored in files which are then
+    memory-mapped (read-only, shared).  Worker processes forked afterwards
+    (as with 'multiprocessing' and 'pprocess' backends) inherit the
+    mapping, so all of them access the same physical memory.  Note that
+    pickling the dataset would still copy the data.
+
+    Parameters
+    ----------
+    ds : Dataset
+    dirname : None or str
+      Directory where to create the temporary directory for the
+      files.  If None, the ``shared tmpdir`` option of the ``[parallel]``
+      configuration section is used, and if absent -- /dev/shm if
+      available, or system temporary directory otherwise.
+
+    Returns
+    -------
+    Dataset, str
+      Shallow copy of the dataset with shared arrays, and the temporary
+      directory which should be removed by the caller whenever the shared
+      dataset is no longer needed.
+    """
+    tmpdir = _get_shared_tmpdir(dirname)
+
+    def share(arr, name):
+        if not isinstance(arr, np.ndarray) or not arr.dtype.kind in 'biufc':
+            # sparse matrices, strings, objects, etc -- leave as is
+            return arr
+        filename = os.path.join(tmpdir, '%s.npy' % name)
+        np.save(filename, arr)
+        # plain ndarray view, so results of computations do not become
+        # np.memmap instances
+        return np.asarray(np.load(filename, mmap_mode='r'))
+
+    sds = ds.copy(deep=False)
+    sds.samples = share(ds.samples, 'samples')
+    for prefix, col in (('sa', sds.sa), ('fa', sds.fa)):
+        for i, v in enumerate(col.values()):
+            v.value = share(v.value, '%s%d' % (prefix, i))
+    if __debug__:
+        debug('PAR', "Shared %s via %s" % (ds, tmpdir))
+    return sds, tmpdir
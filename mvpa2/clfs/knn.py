@@ -16,7 +16,8 @@ _dict_has_key = sys.version_info >= (2, 5)
 
 import numpy as np
 
-from mvpa2.base import warning
+from mvpa2.base import warning, externals
+from mvpa2.base.dochelpers import _repr_attrs
 from mvpa2.datasets.base import Dataset
 from mvpa2.misc.support import indent_doc
 from mvpa2.base.state import ConditionalAttribute
@@ -30,6 +31,28 @@ if __debug__:
     from mvpa2.base import debug
 
 
+def _get_nearest(dists, k):
+    """Indices of and distances to the `k` nearest neighbors (per row)"""
+    if k < dists.shape[1] and hasattr(np, 'argpartition'):
+        # no need to sort them all
+        knns = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    else:
+        knns = dists.argsort(axis=1)[:, :k]
+    return knns, dists[np.arange(len(dists))[:, None], knns]
+
+
+def _bincount2d(idx, ncols, weights=None):
+    """Per-row counts (or sums of `weights`) of column indices in `idx`"""
+    nrows = len(idx)
+    flat = (idx + (np.arange(nrows) * ncols)[:, None]).ravel()
+    if weights is not None:
+        weights = weights.ravel()
+    # old NumPy refuses minlength=0
+    counts = np.bincount(flat, weights=weights,
+                         minlength=max(1, nrows * ncols))
+    return counts[:nrows * ncols].reshape(nrows, ncols)
+
+
 class kNN(Classifier):
     """
     k-Nearest-Neighbour classifier.
@@ -57,6 +80,10 @@ class kNN(Classifier):
     If enabled, kNN stores the votes per class in the 'values' state after
     calling predict().
 
+    Votes of all the test samples are computed at once.  Distances are
+    computed in blocks of test samples (see `block_size`), unless a spatial
+    index (see `index`) is used to find the nearest neighbors.
+
     """
 
     distances = ConditionalAttribute(enabled=False,
@@ -66,7 +93,7 @@ class kNN(Classifier):
     __tags__ = ['knn', 'non-linear', 'binary', 'multiclass']
 
     def __init__(self, k=2, dfx=squared_euclidean_distance,
-                 voting='weighted', **kwargs):
+                 voting='weighted', index=None, block_size=None, **kwargs):
         """
         Parameters
         ----------
@@ -80,6 +107,17 @@ class kNN(Classifier):
           Possible values are 'majority' (simple majority of classes
           determines vote) and 'weighted' (votes are weighted according to the
           relative frequencies of each class in the training data).
+        index : {None, 'auto', 'kdtree', 'balltree'}
+          Spatial index of the training samples to find the nearest
+          neighbors without computing all the distances.  'kdtree' requires
+          scipy, 'balltree' scikit-learn, and both support only the default
+          `dfx`.  'auto' uses a KD-tree for low-dimensional data (up to 16
+          features) if possible.  All distances are computed if None, or
+          if the 'distances' conditional attribute is enabled.
+        block_size : int, optional
+          Number of test samples to compute the distances for at once, to
+          limit memory demands for large test sets.  By default, a block of
+          distances takes up to 32MB.
         **kwargs
           Additional arguments are passed to the base class.
         """
@@ -87,11 +125,24 @@ class kNN(Classifier):
         # init base class first
         Classifier.__init__(self, **kwargs)
 
+        if not voting in ('majority', 'weighted'):
+            raise ValueError("kNN told to perform unknown voting '%s'."
+                             % voting)
+        if not index in (None, 'auto', 'kdtree', 'balltree'):
+            raise ValueError("Unknown index '%s'.  Known are 'auto', "
+                             "'kdtree', 'balltree'." % index)
+        if index in ('kdtree', 'balltree') \
+           and not dfx is squared_euclidean_distance:
+            raise ValueError("Index '%s' supports only the squared euclidean "
+                             "distance, got dfx=%s" % (index, dfx))
         self.__k = k
         self.__dfx = dfx
         self.__voting = voting
+        self.__index = index
+        self.__block_size = block_size
         self.__data = None
         self.__weights = None
+        self.__tree = None
 
 
     def __repr__(self, prefixes=[]): # pylint: disable-msg=W0102
@@ -100,6 +151,7 @@ class kNN(Classifier):
         return super(kNN, self).__repr__(
             ["k=%d" % self.__k, "dfx=%s" % self.__dfx,
              "voting=%s" % repr(self.__voting)]
+            + _repr_attrs(self, ['index', 'block_size'])
             + prefixes)
 
 
@@ -138,13 +190,37 @@ class kNN(Classifier):
             weights = \
                 [ 1.0 - ((labels == label).sum() / Nlabels) \
                     for label in uniquelabels ]
-            self.__weights = dict(zip(uniquelabels, weights))
+            self.__weights = np.array(weights)
         else:
             self.__weights = None
 
-        # create dictionary with an item for each condition
-        self.__votes_init = dict(zip(uniquelabels,
-                                     [0] * Nuniquelabels))
+        # labels as indices into uniquelabels for vectorized voting
+        label_idx = dict(zip(uniquelabels, range(Nuniquelabels)))
+        self.__label_idx = np.array([label_idx[l] for l in labels])
+
+        self.__tree = self._build_index(data.samples)
+
+    def _build_index(self, samples):
+        """Build a spatial index of the training samples if requested"""
+        index = self.__index
+        if index == 'auto':
+            if self.__dfx is squared_euclidean_distance \
+               and samples.shape[1] <= 16 and externals.exists('scipy'):
+                index = 'kdtree'
+            else:
+                index = None
+        if index is None:
+            return None
+        if __debug__:
+            debug('KNN', "Building %s of %s training samples"
+                  % (index, samples.shape))
+        if index == 'kdtree':
+            externals.exists('scipy', raise_=True)
+            from scipy.spatial import cKDTree
+            return cKDTree(samples)
+        externals.exists('skl', raise_=True)
+        from sklearn.neighbors import BallTree
+        return BallTree(samples)
 
 
     @accepts_dataset_as_samples
@@ -158,7 +234,6 @@ class kNN(Classifier):
 
         targets_sa_name = self.get_space()
         targets_sa = self.__data.sa[targets_sa_name]
-        labels = targets_sa.value
         uniquelabels = targets_sa.unique
 
         # checks only in debug mode
@@ -170,71 +245,66 @@ class kNN(Classifier):
                 raise ValueError, "Length of data samples (features) does " \
                                   "not match the classifier."
 
-        # compute the distance matrix between training and test data with
-        # distances stored row-wise, i.e. distances between test sample [0]
-        # and all training samples will end up in row 0
-        dists = self.__dfx(self.__data.samples, data).T
-        if self.ca.is_enabled('distances'):
+        ntrain = len(self.__data)
+        k = min(self.__k, ntrain)
+        if self.__tree is not None and not self.ca.is_enabled('distances'):
+            nn_dists, knns = self.__tree.query(data, k=k)
+            # shapes are squeezed for k=1, and the index gives the plain
+            # euclidean distances
+            knns = np.reshape(knns, (len(data), k))
+            nn_dists = np.reshape(nn_dists, (len(data), k)) ** 2
+        elif self.ca.is_enabled('distances'):
+            # compute the distance matrix between training and test data with
+            # distances stored row-wise, i.e. distances between test sample [0]
+            # and all training samples will end up in row 0
+            dists = self.__dfx(self.__data.samples, data).T
             # .sa.copy() now does deepcopying by default
             self.ca.distances = Dataset(dists, fa=self.__data.sa.copy())
-
-        # determine the k nearest neighbors per test sample
-        knns = dists.argsort(axis=1)[:, :self.__k]
-
-        # predictions and votes for all samples
-        all_votes, predictions = [], []
-        for inns, nns in enumerate(knns):
-            votes = self.__votes_init.copy()
-            # TODO: optimize!
-            for nn in nns:
-                votes[labels[nn]] += 1
-
-            # optionally weight votes
-            if self.__voting == 'majority':
-                pass
-            elif self.__voting == 'weighted':
-                # TODO: optimize!
-                for ul in uniquelabels:
-                    votes[ul] *= self.__weights[ul]
-            else:
-                raise ValueError, "kNN told to perform unknown voting '%s'." \
-                      % self.__voting
-
-            # reverse dictionary items and sort them to get the
-            # winners
-            # It would be more expensive than just to look for
-            # the maximum, but this piece should be the least
-            # cpu-intensive while distances computation should consume
-            # the most. Also it would allow to look and break the ties
-            votes_reversed = sorted([(v, k) for k, v in votes.iteritems()],
-                                    reverse=True)
-            # check for ties
-            max_vote, max_vote_label = votes_reversed[0]
-
-            if len(votes_reversed) > 1 and max_vote == votes_reversed[1][0]:
-                # figure out all ties and break them based on the mean
-                # distance
-                # TODO: theoretically we could break out of the loop earlier
-                ties = [x[1] for x in votes_reversed if x[0] == max_vote]
-
-                # compute mean distances to the corresponding clouds
-                # restrict analysis only to k-nn's
-                nns_labels = labels[nns]
-                nns_dists = dists[inns][nns]
-                ties_dists = [np.mean(nns_dists[nns_labels == t]) for t in ties]
-                max_vote_label = ties[np.argmin(ties_dists)]
-                if __debug__:
-                    debug('KNN',
-                          'Ran into the ties: %s with votes: %s, dists: %s, max_vote %r',
-                          (ties, votes_reversed, ties_dists, max_vote_label))
-
-            all_votes.append(votes)
-            predictions.append(max_vote_label)
+            knns, nn_dists = _get_nearest(dists, k)
+        else:
+            # determine the k nearest neighbors per block of test samples
+            block_size = self.__block_size or max(1, 2 ** 22 // ntrain)
+            knns, nn_dists = [], []
+            for start in xrange(0, max(1, len(data)), block_size):
+                dists = self.__dfx(self.__data.samples,
+                                   data[start:start + block_size]).T
+                b_knns, b_dists = _get_nearest(dists, k)
+                knns.append(b_knns)
+                nn_dists.append(b_dists)
+            knns = np.concatenate(knns)
+            nn_dists = np.concatenate(nn_dists)
+
+        # votes for all samples at once
+        nlabels = len(uniquelabels)
+        nn_labels = self.__label_idx[knns]
+        counts = _bincount2d(nn_labels, nlabels)
+
+        # optionally weight votes
+        if self.__voting == 'weighted':
+            votes = counts * self.__weights
+        else:
+            votes = counts
+
+        # winners are the classes with the most votes.  Ties are broken based
+        # on the mean distance to the corresponding k-nearest neighbors
+        mean_dists = _bincount2d(nn_labels, nlabels, weights=nn_dists) \
+                     / np.maximum(counts, 1)
+        ties = votes == votes.max(axis=1)[:, None]
+        mean_dists[~ties] = np.inf
+        # among equally distant ones the last class wins, as it always did
+        winners = nlabels - 1 - np.argmin(mean_dists[:, ::-1], axis=1)
+        if __debug__ and 'KNN' in debug.active:
+            tied = ties.sum(axis=1) > 1
+            debug('KNN', 'Ran into the ties for %d samples' % tied.sum())
+
+        predictions = list(np.asanyarray(uniquelabels)[winners])
 
         # store the predictions in the state. Relies on State._setitem to do
         # nothing if the relevant state member is not enabled
         self.ca.predictions = predictions
-        self.ca.estimates = all_votes # np.array([r[1] for r in results])
+        if self.ca.is_enabled('estimates'):
+            self.ca.estimates = [dict(zip(uniquelabels, v))
+                                 for v in votes.tolist()]
 
         return predictions
 
@@ -242,6 +312,9 @@ class kNN(Classifier):
         """Reset trained state"""
         self.__data = None
         self.__weights = None
+        self.__tree = None
         super(kNN, self)._untrain()
 
     dfx = property(fget=lambda self: self.__dfx)
+    index = property(fget=lambda self: self.__index)
+    block_size = property(fget=lambda self: self.__block_size)
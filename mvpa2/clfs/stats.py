@@ -12,11 +12,16 @@ from __future__ import with_statement   # Let's start using with
 
 __docformat__ = 'restructuredtext'
 
+import os
 import warnings
+import tempfile
+import threading
 
 import numpy as np
 
 from mvpa2.base import externals, warning
+from mvpa2.base.parallel import parallel_map, get_nproc, get_backend
+from mvpa2.support import copy
 from mvpa2.base.state import ClassWithCollections, ConditionalAttribute
 from mvpa2.generators.permutation import AttributePermutator
 from mvpa2.base.types import is_datasetlike
@@ -120,6 +125,191 @@ class Nonparametric(object):
                          np.vectorize(lambda v: (self._dist_samples >= v).mean()))
 
 
+def _empty_samples(shape, dtype, dirname=None):
+    """Allocate an array for samples, memory-mapped if `dirname` is given
+
+    The file backing up the array is created within `dirname` and removed
+    right away (where the platform allows that), so the disk space is
+    released as soon as the array is no longer in use.
+    """
+    if dirname is None:
+        return np.empty(shape, dtype=dtype)
+    fd, filename = tempfile.mkstemp(prefix='mvpa-nulldist-', suffix='.npy',
+                                    dir=dirname)
+    os.close(fd)
+    arr = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                    shape=shape)
+    try:
+        os.unlink(filename)
+    except OSError:
+        # e.g. on Windows, where opened files cannot be removed
+        pass
+    # plain ndarray view, so results of computations do not become
+    # np.memmap instances
+    return np.asarray(arr)
+
+
+def _searchsorted_columns(a, v, side='left'):
+    """Column-wise `np.searchsorted` for a 2D array with sorted columns
+
+    Binary search is carried out for all the columns simultaneously, so it
+    takes only ``log2(len(a))`` vectorized steps.
+
+    Parameters
+    ----------
+    a : ndarray
+      2D array, each column of which is sorted in ascending order (NaNs,
+      if any, at the end).
+    v : ndarray
+      1D array with a value to search for in each column of `a`.
+    side : {'left', 'right'}
+      As in `np.searchsorted`.
+
+    Returns
+    -------
+    ndarray
+      Indices of insertion points (i.e. number of values in each column
+      which are less, or less-or-equal for 'right', than the value in `v`).
+    """
+    if side == 'left':
+        before = np.less
+    elif side == 'right':
+        before = np.less_equal
+    else:
+        raise ValueError("Unknown side %r" % (side,))
+    ncols = a.shape[1]
+    cols = np.arange(ncols)
+    lo = np.zeros(ncols, dtype=int)
+    hi = np.empty(ncols, dtype=int)
+    hi.fill(len(a))
+    while True:
+        active = lo < hi
+        if not np.any(active):
+            break
+        mid = (lo + hi) // 2
+        # clip so the index is valid for already finished columns
+        goright = before(a[np.minimum(mid, len(a) - 1), cols], v) & active
+        lo = np.where(goright, mid + 1, lo)
+        hi = np.where(goright | ~active, hi, mid)
+    return lo
+
+
+class NonparametricArray(object):
+    """Non-parametric distributions of multiple elements at once.
+
+    Array-backed counterpart of a sequence of `Nonparametric` distributions:
+    samples of all the elements are stored in a single sorted
+    (nsamples x nelements) array, so cdf values for all the elements are
+    computed at once by a vectorized binary search instead of a Python loop
+    over per-element objects.
+    """
+
+    def __init__(self, dist_samples, correction='clip', dtype=None,
+                 out=None):
+        """
+        Parameters
+        ----------
+        dist_samples : ndarray
+          (nsamples x nelements) array of samples to assess the
+          distributions.
+        correction : {'clip'} or None, optional
+          See `Nonparametric`.
+        dtype : None or dtype, optional
+          Type to store samples with.  Lower precision types (e.g.
+          float32 or float16) reduce memory footprint at the cost of
+          quantising the samples.  Values queried with cdf/rcdf get
+          converted to the same type, so comparisons remain consistent.
+        out : None or ndarray, optional
+          Array (e.g. memory-mapped) of the same shape as `dist_samples`
+          to store sorted samples in.  Its type takes precedence over
+          `dtype`.  Samples are then sorted in chunks of columns, so no
+          complete in-memory copy of them is made.
+        """
+        dist_samples = np.asanyarray(dist_samples)
+        if dist_samples.ndim == 1:
+            dist_samples = dist_samples[:, np.newaxis]
+        if dist_samples.ndim != 2:
+            raise ValueError("%s requires a 2D array of samples, got %s"
+                             % (self.__class__.__name__, dist_samples.shape))
+        if out is None:
+            self._dist_samples = np.sort(
+                np.asarray(dist_samples, dtype=dtype), axis=0)
+        else:
+            if out.shape != dist_samples.shape:
+                raise ValueError("Array to store samples has shape %s, "
+                                 "whenever samples have shape %s"
+                                 % (out.shape, dist_samples.shape))
+            # ~8MB of float64 values per chunk
+            step = max(1, 2**20 // max(1, len(dist_samples)))
+            for i in xrange(0, dist_samples.shape[1], step):
+                out[:, i:i+step] = np.sort(dist_samples[:, i:i+step], axis=0)
+            self._dist_samples = out
+        self._correction = correction
+        # NaNs are sorted to the end and must not be counted as values
+        # in the right tail
+        self._nvalid = np.sum(~np.isnan(self._dist_samples), axis=0) \
+            if self._dist_samples.dtype.kind in 'fc' \
+            else len(self._dist_samples)
+
+    def __repr__(self):
+        return '%s(%r%s%s)' % (
+            self.__class__.__name__,
+            self._dist_samples,
+            ('', ', correction=%r' % self._correction)
+              [int(self._correction != 'clip')],
+            ('', ', dtype=%r' % self._dist_samples.dtype)
+              [int(self._dist_samples.dtype != np.float64)])
+
+    def __len__(self):
+        return self._dist_samples.shape[1]
+
+    def __getitem__(self, i):
+        return Nonparametric(self._dist_samples[:, i],
+                             correction=self._correction)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _cdf(self, x, counts_func):
+        """Helper to compute cdf proper or reverse for all the elements"""
+        x = np.asanyarray(x)
+        xshape = x.shape
+        x = np.asarray(x.reshape((-1,)), dtype=self._dist_samples.dtype)
+        if len(x) != len(self):
+            raise ValueError('Distributions were fit for %d elements, '
+                             'whenever now queried with %d elements'
+                             % (len(self), len(x)))
+        nsamples = len(self._dist_samples)
+        res = counts_func(x) / float(nsamples)
+        if self._correction == 'clip':
+            np.clip(res, 1.0/(nsamples+2), (nsamples+1.0)/(nsamples+2), res)
+        elif self._correction is None:
+            pass
+        else:
+            raise ValueError, \
+                  '%r is incorrect value for correction parameter of %s' \
+                  % (self._correction, self.__class__.__name__)
+        return res.reshape(xshape)
+
+    def cdf(self, x):
+        """Returns cdf values at `x` (a value per each element)
+        """
+        return self._cdf(x, lambda v: _searchsorted_columns(
+            self._dist_samples, v, side='right'))
+
+    def rcdf(self, x):
+        """Returns cdf values of reversed distributions at `x`
+
+        See `Nonparametric.rcdf`.
+        """
+        return self._cdf(x, lambda v: self._nvalid - _searchsorted_columns(
+            self._dist_samples, v, side='left'))
+
+    dist_samples = property(fget=lambda self: self._dist_samples,
+                            doc="Sorted (nsamples x nelements) samples")
+
+
 def _pvalue(x, cdf_func, rcdf_func, tail, return_tails=False, name=None):
     """Helper function to return p-value(x) given cdf and tail
 
@@ -322,8 +512,14 @@ class MCNullDist(NullDist):
     skipped = ConditionalAttribute(enabled=True,
                   doc='# of the samples which were skipped because '
                       'measure has failed to evaluated at them')
+    stopped_early = ConditionalAttribute(enabled=True,
+                  doc='# of permutations after which the estimation was '
+                      'stopped early (see `early_stop_alpha`), or None')
 
     def __init__(self, permutator, dist_class=Nonparametric, measure=None,
+                 nproc=1, backend=None, early_stop_alpha=None,
+                 early_stop_confidence=0.99, early_stop_step=100,
+                 early_stop_fraction=1.0, dtype=None, samples_dir=None,
                  **kwargs):
         """Initialize Monte-Carlo Permutation Null-hypothesis testing
 
@@ -339,6 +535,56 @@ class MCNullDist(NullDist):
         measure : Measure or None
           Optional measure that is used to compute results on permuted
           data. If None, a measure needs to be passed to ``fit()``.
+        nproc : None or int
+          Number of processes to compute the measure on permuted datasets
+          concurrently (None -- all available cores).  Permuted datasets
+          are still generated in the main process, just a few ahead of
+          the computed ones, and passed to a single pool of workers.  The
+          measure is evaluated with the global random number generator
+          set to the state right after the generation of
+          the respective permutation, and its random numbers do not affect
+          the generation of further permutations (in the serial run as
+          well).  Hence, with process-based backends, results match the
+          serial run exactly and do not depend on the scheduling.  With
+          'threads' backend this holds only for measures which do not
+          consume random numbers, since the generator is shared by all the
+          threads.
+        backend : None or str
+          Parallelization backend (see :mod:`~mvpa2.base.parallel`).
+        early_stop_alpha : None or float
+          If provided, the estimation stops as soon as it is confident
+          (see `early_stop_confidence`) for a fraction (see
+          `early_stop_fraction`) of the elements of the result whether
+          their p-values lie below or above this value.  Requires an
+          additional evaluation of the measure on the original dataset,
+          and `scipy` to compute confidence intervals.  Note that p-values
+          of elements close to alpha are decided only after many
+          permutations, so with the default `early_stop_fraction` of 1
+          there might be no early stopping at all for large maps (e.g.
+          of whole-brain searchlights).
+        early_stop_confidence : float
+          Coverage of the (Jeffreys) binomial confidence intervals for the
+          p-values used for early stopping.
+        early_stop_step : int
+          Early stopping is considered after every `early_stop_step`
+          permutations.
+        early_stop_fraction : float
+          Fraction of the elements which must be decided to stop early.
+          p-values of the undecided elements (close to alpha) are then
+          less precise, but it is not known whether they are below or
+          above alpha anyway.
+        dtype : None or dtype
+          With `Nonparametric` distribution, samples of all the elements
+          are stored in a single `NonparametricArray` using this type
+          (e.g. float32 to halve memory demands for large maps).
+        samples_dir : None or str
+          If provided, results of the permutations (``dist_samples``) and
+          the sorted samples of `NonparametricArray` are stored in
+          memory-mapped files within this directory instead of memory, so
+          null-distributions for maps larger than the available memory
+          could be estimated.  Where the platform allows, the files are
+          removed right away, so the disk space gets released as soon as
+          the samples are no longer in use.
         """
         NullDist.__init__(self, **kwargs)
 
@@ -347,11 +593,28 @@ class MCNullDist(NullDist):
         self._measure = measure
 
         self.__permutator = permutator
+        self._nproc = nproc
+        self._backend = backend
+        self._early_stop_alpha = early_stop_alpha
+        self._early_stop_confidence = early_stop_confidence
+        self._early_stop_step = early_stop_step
+        self._early_stop_fraction = early_stop_fraction
+        self._dtype = dtype
+        self._samples_dir = samples_dir
 
     def __repr__(self, prefixes=[]):
         prefixes_ = ["%s" % self.__permutator]
         if self._dist_class != Nonparametric:
             prefixes_.insert(0, 'dist_class=%r' % (self._dist_class,))
+        for arg, default in (('nproc', 1), ('backend', None),
+                             ('early_stop_alpha', None),
+                             ('early_stop_confidence', 0.99),
+                             ('early_stop_step', 100),
+                             ('early_stop_fraction', 1.0), ('dtype', None),
+                             ('samples_dir', None)):
+            value = getattr(self, '_' + arg)
+            if value != default:
+                prefixes_.append('%s=%r' % (arg, value))
         return super(MCNullDist, self).__repr__(
             prefixes=prefixes_ + prefixes)
 
@@ -379,8 +642,19 @@ class MCNullDist(NullDist):
             measure = self._measure
             measure.untrain()
 
-        dist_samples = []
+        dist_samples = None
         """Holds the values for randomized labels."""
+        ndist = 0                       # # of stored samples
+
+        nproc = get_nproc(self._nproc, self._backend)
+        early_stop = self._early_stop_alpha is not None
+        if early_stop:
+            # counts of permuted results (at or) below and above the
+            # original one
+            observed = np.asanyarray(measure(ds).samples)
+            counts_le = np.zeros(observed.shape, dtype=int)
+            counts_ge = np.zeros(observed.shape, dtype=int)
+        self.ca.stopped_early = None
 
         # estimate null-distribution
         # TODO this really needs to be more clever! If data samples are
@@ -389,43 +663,69 @@ class MCNullDist(NullDist):
         # null-distribution of transfer errors can be reduced dramatically
         # when the *right* permutations (the ones that matter) are done.
         skipped = 0                     # # of skipped permutations
-        for p, permuted_ds in enumerate(self.__permutator.generate(ds)):
-            # new permutation all the time
-            # but only permute the training data and keep the testdata constant
-            #
-            if __debug__:
-                debug('STATMC', "Doing %i permutations: %i" \
-                      % (self.__permutator.count, p+1), cr=True)
-
-            # compute and store the measure of this permutation
-            # assume it has `TransferError` interface
-            try:
-                res = measure(permuted_ds)
-                dist_samples.append(res.samples)
-            except LearnerError, e:
+        p = 0                           # # of processed permutations
+        # permutations are generated lazily, only as they are consumed
+        permuted_dss = self.__permutator.generate(ds)
+        if nproc > 1:
+            def tasks():
+                for permuted_ds in permuted_dss:
+                    # state as seen by the measure in the serial run
+                    yield permuted_ds, np.random.get_state()
+            results = self._parallel_permutations(measure, tasks(), nproc)
+        else:
+            results = self._serial_permutations(measure, permuted_dss)
+        try:
+            for res in results:
+                p += 1
+                # new permutation all the time
+                # but only permute the training data and keep the testdata
+                # constant
                 if __debug__:
-                    debug('STATMC', " skipped", cr=True)
-                warning('Failed to obtain value from %s due to %s.  Measurement'
-                        ' was skipped, which could lead to unstable and/or'
-                        ' incorrect assessment of the null_dist' % (measure, e))
-                skipped += 1
-                continue
+                    debug('STATMC', "Doing %i permutations: %i" \
+                          % (self.__permutator.count, p), cr=True)
+                if isinstance(res, LearnerError):
+                    if __debug__:
+                        debug('STATMC', " skipped", cr=True)
+                    warning('Failed to obtain value from %s due to %s.  '
+                            'Measurement was skipped, which could lead to '
+                            'unstable and/or incorrect assessment of the '
+                            'null_dist' % (measure, res))
+                    skipped += 1
+                    continue
+                dist_samples = self._store_sample(dist_samples, ndist, res)
+                ndist += 1
+                if early_stop:
+                    counts_le += res <= observed
+                    counts_ge += res >= observed
+                    if not ndist % self._early_stop_step \
+                       and self._is_decided(counts_le, counts_ge, ndist):
+                        if __debug__:
+                            debug('STATMC', ' Stopping early after %d '
+                                  'permutations' % p)
+                        self.ca.stopped_early = p
+                        break
+        finally:
+            # stops the workers, if computation is stopped early or failed
+            if hasattr(results, 'close'):
+                results.close()
 
         self.ca.skipped = skipped
 
         if __debug__:
             debug('STATMC', ' Skipped: %d permutations' % skipped)
 
-        if not len(dist_samples) and skipped > 0:
+        if not ndist and skipped > 0:
             raise RuntimeError(
                 'Failed to obtain any value from %s. %d measurements were '
                 'skipped. Check above warnings, and your code/data'
                 % (measure, skipped))
-        # store samples as (npermutations x nsamples x nfeatures)
-        dist_samples = np.asanyarray(dist_samples)
+        # samples are stored as (npermutations x nsamples x nfeatures)
+        dist_samples = dist_samples[:ndist] if ndist \
+                       else np.asanyarray([])
         # for the ca storage use a dataset with
         # (nsamples x nfeatures x npermutations) to make it compatible with the
-        # result dataset of the measure
+        # result dataset of the measure.  It is just a view, so no copy of
+        # the samples is made
         self.ca.dist_samples = Dataset(np.rollaxis(dist_samples,
                                        0, len(dist_samples.shape)))
 
@@ -439,9 +739,21 @@ class MCNullDist(NullDist):
         if nshape == 1:
             dist_samples = dist_samples[:, np.newaxis]
 
+        dist_samples_rs = dist_samples.reshape((shape[0], -1))
+        if self._dist_class is Nonparametric:
+            # all elements at once
+            if self._samples_dir is None:
+                out = None
+            else:
+                out = _empty_samples(dist_samples_rs.shape,
+                                     self._dtype or dist_samples_rs.dtype,
+                                     self._samples_dir)
+            self._dist = NonparametricArray(dist_samples_rs,
+                                            dtype=self._dtype, out=out)
+            return
+
         # fit per each element.
         # XXX could be more elegant? may be use np.vectorize?
-        dist_samples_rs = dist_samples.reshape((shape[0], -1))
         dist = []
         for samples in dist_samples_rs.T:
             params = self._dist_class.fit(samples)
@@ -452,6 +764,114 @@ class MCNullDist(NullDist):
         self._dist = dist
 
 
+    def _store_sample(self, dist_samples, n, res):
+        """Store results of `n`-th permutation, (re)allocating the storage
+
+        Returns
+        -------
+        ndarray
+          (npermutations x ...) storage with the results.
+        """
+        res = np.asanyarray(res)
+        if dist_samples is None or n >= len(dist_samples):
+            if dist_samples is None:
+                # preallocate for all the permutations if their count
+                # is known
+                size = getattr(self.__permutator, 'count', None) or 100
+            else:
+                size = 2 * len(dist_samples)
+            new_samples = _empty_samples((size,) + res.shape, res.dtype,
+                                         self._samples_dir)
+            if dist_samples is not None:
+                new_samples[:n] = dist_samples[:n]
+            dist_samples = new_samples
+        dist_samples[n] = res
+        return dist_samples
+
+
+    def _proc_permutation(self, measure, permuted_ds, rng_state=None):
+        """Compute the measure on a permuted dataset
+
+        Returns
+        -------
+        array or LearnerError
+          Samples of the result, or the exception if the learner failed.
+        """
+        # TODO: place exceptions separately so we could avoid circular imports
+        from mvpa2.base.learner import LearnerError
+        if rng_state is not None:
+            np.random.set_state(rng_state)
+        try:
+            return measure(permuted_ds).samples
+        except LearnerError, e:
+            return e
+
+
+    def _serial_permutations(self, measure, permuted_dss):
+        """Compute the measure on permuted datasets one by one"""
+        for permuted_ds in permuted_dss:
+            # the measure gets the state right after the generation of the
+            # permutation, but must not affect the generation of further
+            # ones -- as in the parallel run
+            rng_state = np.random.get_state()
+            res = self._proc_permutation(measure, permuted_ds)
+            np.random.set_state(rng_state)
+            yield res
+
+
+    def _parallel_permutations(self, measure, tasks, nproc):
+        """Compute the measure on permuted datasets concurrently
+
+        Parameters
+        ----------
+        tasks : iterator of (Dataset, tuple)
+          Permuted datasets along with the states of the global random
+          number generator right after their generation.  It is consumed
+          only as the results are.
+        """
+        if get_backend(self._backend) == 'threads':
+            # threads share the measure, so every thread gets a copy of
+            # its own.  Global RNG state cannot be set per thread
+            local = threading.local()
+            def proc(permuted_ds, rng_state):
+                if not hasattr(local, 'measure'):
+                    local.measure = copy.deepcopy(measure)
+                return self._proc_permutation(local.measure, permuted_ds)
+        else:
+            # forked workers have a copy of the measure of their own already
+            def proc(permuted_ds, rng_state):
+                return self._proc_permutation(measure, permuted_ds, rng_state)
+        return parallel_map(proc, ((task, {}) for task in tasks),
+                            nproc=nproc, backend=self._backend)
+
+
+    def _is_decided(self, counts_le, counts_ge, n):
+        """Whether p-values of enough elements are confidently below/above
+        alpha (see `early_stop_fraction`)
+        """
+        from mvpa2.misc.stats import binomial_proportion_ci
+        if not n:
+            return False
+        alpha = self._early_stop_alpha
+        tail = self.tail
+        if tail == 'left':
+            counts = counts_le
+        elif tail == 'right':
+            counts = counts_ge
+        else:
+            # the tail the value belongs to, as in _pvalue
+            counts = np.where(counts_le < 0.5 * n, counts_le, counts_ge)
+        counts = np.ravel(counts)
+        lower, upper = np.reshape(
+            binomial_proportion_ci(n, counts,
+                                   alpha=1 - self._early_stop_confidence),
+            (2, -1))
+        if tail == 'both':
+            lower, upper = 2 * lower, 2 * upper
+        decided = (upper < alpha) | (lower > alpha)
+        return np.mean(decided) >= self._early_stop_fraction
+
+
     def _cdf(self, x, cdf_func):
         """Return value of the cumulative distribution function at `x`.
         """
@@ -476,7 +896,11 @@ class MCNullDist(NullDist):
                   % (len(self._dist), len(x))
 
         # extract cdf values per each element
-        if cdf_func == 'cdf':
+        if isinstance(self._dist, NonparametricArray):
+            if not cdf_func in ('cdf', 'rcdf'):
+                raise ValueError
+            return getattr(self._dist, cdf_func)(x).reshape(xshape)
+        elif cdf_func == 'cdf':
             cdfs = [ dist.cdf(v) for v, dist in zip(x, self._dist) ]
         elif cdf_func == 'rcdf':
             cdfs = [ _auto_rcdf(dist)(v) for v, dist in zip(x, self._dist) ]
@@ -493,6 +917,9 @@ class MCNullDist(NullDist):
     def dists(self):
         return self._dist
 
+    nproc = property(fget=lambda self: self._nproc)
+    backend = property(fget=lambda self: self._backend)
+
     def clean(self):
         """Clean stored distributions
 
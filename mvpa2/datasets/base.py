@@ -113,7 +113,7 @@ class Dataset(AttrDataset):
             return self[self.sa.match(sadict, strict=strict),
                         self.fa.match(fadict, strict=strict)]
 
-    def __getitem__(self, args):
+    def __getitem__(self, args, _lazy=False):
         # uniformize for checks below; it is not a tuple if just single slicing
         # spec is passed
         if not isinstance(args, tuple):
@@ -138,7 +138,7 @@ class Dataset(AttrDataset):
         args = tuple(args_)
 
         # let the base do the work
-        ds = super(Dataset, self).__getitem__(args)
+        ds = super(Dataset, self).__getitem__(args, _lazy=_lazy)
 
         # and adjusting the mapper (if any)
         if len(args) > 1 and 'mapper' in ds.a:
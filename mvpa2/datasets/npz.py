@@ -0,0 +1,219 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Fast storage of datasets in a flat NPZ container.
+
+Unlike the generic HDF5 storage (see :mod:`~mvpa2.base.hdf5`), which
+disassembles arbitrary objects recursively, a dataset is stored as a ZIP
+archive (compatible with `numpy.load()`) with a flat list of members:
+
+``header.json``
+  Format name and version, class of the dataset, and names and storage
+  of all attributes.
+``samples.npy``
+  The samples array.
+``sa/<name>.npy``, ``fa/<name>.npy``, ``a/<name>.npy``
+  Array-valued attributes.
+``a/<name>.pkl``
+  Any other dataset attributes (e.g. mappers), pickled.
+
+Hence, loading a dataset needs to parse a single small header, and
+uncompressed arrays (except for arrays of objects) can be memory-mapped
+directly from the archive.
+
+.. versionadded:: 2.3.2
+
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import json
+import struct
+import tempfile
+import zipfile
+import cPickle
+
+import numpy as np
+
+from mvpa2.base.dataset import AttrDataset
+
+if __debug__:
+    from mvpa2.base import debug
+
+__all__ = ['to_npz', 'from_npz']
+
+_FORMAT = 'pymvpa-dataset'
+_VERSION = 1
+_HEADER = 'header.json'
+
+
+def _get_class_name(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def _get_class(name):
+    mod_name, cls_name = name.rsplit('.', 1)
+    mod = __import__(mod_name, fromlist=[cls_name])
+    return getattr(mod, cls_name)
+
+
+def _write_array(zf, arcname, arr):
+    """Store an array in the archive without an in-memory copy of it"""
+    fd, tmpname = tempfile.mkstemp(suffix='-pymvpa.npy')
+    try:
+        tmpfile = os.fdopen(fd, 'wb')
+        try:
+            np.lib.format.write_array(tmpfile, np.asanyarray(arr))
+        finally:
+            tmpfile.close()
+        zf.write(tmpname, arcname)
+    finally:
+        os.unlink(tmpname)
+
+
+def _get_data_offset(fileobj, zinfo):
+    """Offset of the data of an (uncompressed) member in the archive"""
+    fileobj.seek(zinfo.header_offset)
+    header = fileobj.read(zipfile.sizeFileHeader)
+    fheader = struct.unpack(zipfile.structFileHeader, header)
+    return zinfo.header_offset + zipfile.sizeFileHeader \
+           + fheader[zipfile._FH_FILENAME_LENGTH] \
+           + fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+
+
+def _read_array(zf, arcname, mmap):
+    """Read an array from the archive, memory-mapping it if possible"""
+    zinfo = zf.getinfo(arcname)
+    if mmap and zinfo.compress_type == zipfile.ZIP_STORED:
+        fileobj = open(zf.filename, 'rb')
+        try:
+            fileobj.seek(_get_data_offset(fileobj, zinfo))
+            version = np.lib.format.read_magic(fileobj)
+            if version == (1, 0):
+                shape, fortran_order, dtype = \
+                    np.lib.format.read_array_header_1_0(fileobj)
+            else:
+                shape, fortran_order, dtype = \
+                    np.lib.format.read_array_header_2_0(fileobj)
+            offset = fileobj.tell()
+        finally:
+            fileobj.close()
+        if not dtype.hasobject and np.prod(shape):
+            if __debug__:
+                debug('DS_', "Memory-map '%s' from %s"
+                      % (arcname, zf.filename))
+            return np.asarray(np.memmap(zf.filename, dtype=dtype, mode='r',
+                                        offset=offset, shape=shape,
+                                        order=fortran_order and 'F' or 'C'))
+    fileobj = zf.open(zinfo)
+    try:
+        return np.lib.format.read_array(fileobj)
+    finally:
+        fileobj.close()
+
+
+def to_npz(ds, filename, compress=False):
+    """Store a dataset in an NPZ container
+
+    Parameters
+    ----------
+    ds : AttrDataset
+      Dataset to store.  Any non-array dataset attributes (e.g. mappers)
+      have to be picklable.
+    filename : str
+      Name of the file.
+    compress : bool, optional
+      If True, members get deflated.  Compressed arrays cannot be
+      memory-mapped upon loading.
+    """
+    header = {'format': _FORMAT,
+              'version': _VERSION,
+              'class': _get_class_name(ds.__class__),
+              'shape': list(ds.shape),
+              'sa': sorted(ds.sa.keys()),
+              'fa': sorted(ds.fa.keys()),
+              'a': {}}
+    zf = zipfile.ZipFile(filename, 'w',
+                         compress and zipfile.ZIP_DEFLATED
+                         or zipfile.ZIP_STORED,
+                         allowZip64=True)
+    try:
+        _write_array(zf, 'samples.npy', ds.samples)
+        for col in ('sa', 'fa'):
+            collection = getattr(ds, col)
+            for name in header[col]:
+                _write_array(zf, '%s/%s.npy' % (col, name),
+                             collection[name].value)
+        for name in ds.a.keys():
+            value = ds.a[name].value
+            if isinstance(value, np.ndarray):
+                header['a'][name] = 'npy'
+                _write_array(zf, 'a/%s.npy' % name, value)
+            else:
+                header['a'][name] = 'pkl'
+                zf.writestr('a/%s.pkl' % name,
+                            cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        # header goes last, so an incomplete file is not loadable
+        zf.writestr(_HEADER, json.dumps(header))
+    finally:
+        zf.close()
+
+
+def from_npz(filename, mmap=False):
+    """Load a dataset stored with `to_npz()`
+
+    Parameters
+    ----------
+    filename : str
+      Name of the file.
+    mmap : bool, optional
+      If True, uncompressed arrays (samples and attributes) are
+      memory-mapped read-only instead of being read into memory.
+
+    Returns
+    -------
+    AttrDataset
+      Instance of the class the dataset was stored from.
+    """
+    zf = zipfile.ZipFile(filename, 'r')
+    try:
+        try:
+            header = json.loads(zf.read(_HEADER))
+        except KeyError:
+            raise ValueError("%s is not a dataset stored with to_npz()"
+                             % filename)
+        if header.get('format', None) != _FORMAT:
+            raise ValueError("%s contains unknown format %r"
+                             % (filename, header.get('format', None)))
+        if header['version'] > _VERSION:
+            raise ValueError("%s was stored in a more recent format version "
+                             "(%s) than supported (%s)"
+                             % (filename, header['version'], _VERSION))
+        cls = _get_class(header['class'])
+        if not issubclass(cls, AttrDataset):
+            raise ValueError("%s contains %s, not a dataset"
+                             % (filename, header['class']))
+        samples = _read_array(zf, 'samples.npy', mmap)
+        sa = dict([(name, _read_array(zf, 'sa/%s.npy' % name, mmap))
+                   for name in header['sa']])
+        fa = dict([(name, _read_array(zf, 'fa/%s.npy' % name, mmap))
+                   for name in header['fa']])
+        a = {}
+        for name, storage in header['a'].iteritems():
+            if storage == 'npy':
+                a[name] = _read_array(zf, 'a/%s.npy' % name, mmap)
+            else:
+                a[name] = cPickle.loads(zf.read('a/%s.pkl' % name))
+    finally:
+        zf.close()
+    # JSON gives unicode, while attribute names are plain strings
+    return cls(samples,
+               sa=dict([(str(k), v) for k, v in sa.iteritems()]),
+               fa=dict([(str(k), v) for k, v in fa.iteritems()]),
+               a=dict([(str(k), v) for k, v in a.iteritems()]))
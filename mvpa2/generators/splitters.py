@@ -140,14 +140,16 @@ class Splitter(Node):
                 # regular step sizes for the samples to be split
                 filter_ = mask2slice(filter_)
 
+            # views are fine, so attributes could be selected lazily as well
+            select = ds.__getitem__ if noslicing else ds.select_view
             if collection is ds.sa:
                 if __debug__:
                     debug('SPL', 'Split along samples axis')
-                split_ds = ds[filter_]
+                split_ds = select(filter_)
             elif collection is ds.fa:
                 if __debug__:
                     debug('SPL', 'Split along feature axis')
-                split_ds = ds[:, filter_]
+                split_ds = select((slice(None), filter_))
             else:
                 RuntimeError("This should never happen.")
 
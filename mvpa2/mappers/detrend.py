@@ -33,9 +33,42 @@ if externals.exists('scipy', raise_=True):
 
 from mvpa2.base.dochelpers import _str, borrowkwargs
 from mvpa2.mappers.base import Mapper
+from mvpa2.misc.support import get_unique_codes
 from ..base.param import Parameter
 from ..base import constraints as cts
 
+# max. number of elements in temporary arrays for blockwise processing
+_BLOCK_ELEMENTS = 2 ** 22
+
+
+def _get_basis(regs):
+    """Orthonormal basis of the space spanned by the columns of `regs`"""
+    if not regs.shape[1]:
+        return regs
+    u, s, _ = np.linalg.svd(regs, full_matrices=False)
+    # same tolerance as for np.linalg.matrix_rank()
+    tol = s.max() * max(regs.shape) * np.finfo(s.dtype).eps
+    return u[:, s > tol]
+
+
+def _remove_projection(samples, slicer, basis):
+    """Subtract the projection of samples onto a basis in-place
+
+    Only the samples selected by `slicer` (slice or index array) are
+    processed, for blocks of features to limit the size of temporary arrays.
+    """
+    # stay in the precision of the samples
+    basis = basis.astype(samples.dtype)
+    ncols = max(1, _BLOCK_ELEMENTS // max(1, len(basis)))
+    for start in xrange(0, samples.shape[1], ncols):
+        cols = slice(start, start + ncols)
+        block = samples[slicer, cols]
+        block -= np.dot(basis, np.dot(basis.T, block))
+        if not isinstance(slicer, slice):
+            # fancy indexing provided a copy
+            samples[slicer, cols] = block
+
+
 class PolyDetrendMapper(Mapper):
     """Mapper for regression-based removal of polynomial trends.
 
@@ -62,6 +95,15 @@ class PolyDetrendMapper(Mapper):
     but the dataset doesn't contain such an attribute evenly spaced coordinates
     are generated and this information is stored in the mapped dataset.
 
+    Since the polynomials of different chunks do not overlap, the regression
+    is not solved for the full (block-diagonal) design matrix, but with
+    an orthonormal basis of the polynomials of each chunk.  Optional
+    regressors are orthogonalized with respect to the polynomials first,
+    which yields the same residuals as a least squares fit of all regressors
+    at once.  Floating point data (e.g. float32) keeps its datatype, and
+    with `inplace` the samples of a mapped dataset are detrended without
+    making a copy of them first.
+
     Notes
     -----
     The mapper only support mapping of datasets, not plain data. Moreover,
@@ -113,6 +155,12 @@ class PolyDetrendMapper(Mapper):
           parameters.""",
           constraints=cts.AltConstraints(None, cts.EnsureListOf(str)))
 
+    inplace = Parameter(False, constraints='bool', doc=
+          """If True, samples of datasets are detrended in-place, i.e. the
+          input dataset is modified.  Only use it if the input dataset is not
+          needed any longer.  Integer samples are still upcasted (i.e.
+          replaced).""")
+
     def __init__(self, polyord=1, chunks_attr=None, opt_regs=None, **kwargs):
         """
         Parameters
@@ -132,10 +180,11 @@ class PolyDetrendMapper(Mapper):
 
         # things that come from train()
         self._polycoords = None
-        self._regs = None
-
-        # secret switch to perform in-place detrending
-        self._secret_inplace_detrend = False
+        self._nsamples = None
+        # (samples, polynomials, basis) for each chunk
+        self._chunks = None
+        self._opt_regs = None
+        self._opt_basis = None
 
         # need to init last to prevent base class puking
         Mapper.__init__(self, **kwargs)
@@ -166,8 +215,8 @@ class PolyDetrendMapper(Mapper):
         Parameters
         ----------
         ds : dataset
-        chunk_slicer : boolean array
-          True elements indicate samples selected for detrending.
+        chunk_slicer : array
+          Indices of the samples selected for detrending.
 
         Returns
         -------
@@ -178,7 +227,7 @@ class PolyDetrendMapper(Mapper):
         if chunk_slicer is None:
             nsamples = len(ds)
         else:
-            nsamples = chunk_slicer.sum()
+            nsamples = len(chunk_slicer)
 
         # if we don't have to take care of an inspace thing are easy
         if inspace is None:
@@ -199,6 +248,12 @@ class PolyDetrendMapper(Mapper):
             return polycoords, self._scale_array(polycoords.astype('float'))
 
 
+    def _get_polyregs(self, polyord, polycoords_scaled):
+        # polynomials up to the given order (time x reg)
+        return np.transpose([legendre_(n, polycoords_scaled)
+                             for n in range(polyord + 1)])
+
+
     def _train(self, ds):
         # local binding
         chunks_attr = self.params.chunks_attr
@@ -210,15 +265,14 @@ class PolyDetrendMapper(Mapper):
         # global detrending is desired
         if chunks_attr is None:
             # consider the entire dataset
-            reg = []
             # create the timespan
             self._polycoords, polycoords_scaled = self._get_polycoords(ds, None)
-            for n in range(polyord + 1):
-                reg.append(legendre_(n, polycoords_scaled)[:, np.newaxis])
+            chunks = [(slice(None),
+                       self._get_polyregs(polyord, polycoords_scaled))]
         # chunk-wise detrending is desired
         else:
-             # get the unique chunks
-            uchunks = ds.sa[chunks_attr].unique
+            # get the unique chunks
+            uchunks, codes = get_unique_codes(ds.sa[chunks_attr])
 
             # Process the polyord to be a list with length of the number of
             # chunks
@@ -230,8 +284,6 @@ class PolyDetrendMapper(Mapper):
                                  "they sequence length must match the "
                                  "number of unique chunks in the dataset.")
 
-            # loop over each chunk
-            reg = []
             update_polycoords = True
             # if the dataset know about the inspace we can store the
             # polycoords right away
@@ -243,59 +295,82 @@ class PolyDetrendMapper(Mapper):
                 # filled below -- we know that those polycoords are going to
                 # be ints
                 self._polycoords = np.empty(len(ds), dtype='int')
-            for n, chunk in enumerate(uchunks):
-                # get the indices for that chunk
-                cinds = ds.sa[chunks_attr].value == chunk
-
+            # indices of the samples of all chunks at once
+            order = np.argsort(codes, kind='mergesort')
+            chunks = []
+            for n, cinds in enumerate(
+                    np.split(order, np.cumsum(np.bincount(codes))[:-1])):
                 # create the timespan
                 polycoords, polycoords_scaled = self._get_polycoords(ds, cinds)
                 if update_polycoords and not polycoords is None:
                     self._polycoords[cinds] = polycoords
+                if cinds[-1] - cinds[0] + 1 == len(cinds):
+                    # contiguous chunk -- views instead of copies of samples
+                    cinds = slice(cinds[0], cinds[-1] + 1)
                 # create each polyord with the value for that chunk
-                for n in range(polyord[n] + 1):
-                    newreg = np.zeros((len(ds), 1))
-                    newreg[cinds, 0] = legendre_(n, polycoords_scaled)
-                    reg.append(newreg)
+                chunks.append(
+                    (cinds, self._get_polyregs(polyord[n], polycoords_scaled)))
 
         # if we don't handle in inspace, there is no need to store polycoords
         if inspace is None:
             self._polycoords = None
 
-        # see if add in optional regs
-        if not opt_reg is None:
-            # add in the optional regressors, too
-            for oreg in opt_reg:
-                reg.append(ds.sa[oreg].value[np.newaxis].T)
+        self._nsamples = len(ds)
+        self._chunks = [(cinds, regs, _get_basis(regs))
+                        for cinds, regs in chunks]
 
-        # combine the regs (time x reg)
-        self._regs = np.hstack(reg)
+        # see if add in optional regs
+        self._opt_regs = self._opt_basis = None
+        if opt_reg:
+            # combine the optional regressors (time x reg)
+            self._opt_regs = np.hstack([ds.sa[oreg].value[np.newaxis].T
+                                        for oreg in opt_reg]).astype(float)
+            # and orthogonalize them with respect to the polynomials
+            opt_regs = self._opt_regs.copy()
+            for cinds, regs, basis in self._chunks:
+                _remove_projection(opt_regs, cinds, basis)
+            self._opt_basis = _get_basis(opt_regs)
+
+
+    @property
+    def _regs(self):
+        """All regressors (time x reg) as a single design matrix"""
+        if self._chunks is None:
+            return None
+        reg = []
+        for cinds, regs, basis in self._chunks:
+            newreg = np.zeros((self._nsamples, regs.shape[1]))
+            newreg[cinds] = regs
+            reg.append(newreg)
+        if not self._opt_regs is None:
+            reg.append(self._opt_regs)
+        return np.hstack(reg)
 
 
     def _forward_dataset(self, ds):
         # auto-train the mapper if not yet done
-        if self._regs is None:
+        if self._chunks is None:
             self.train(ds)
 
-        if self._secret_inplace_detrend:
+        if self.params.inplace:
             mds = ds
         else:
             # shallow copy to put the new stuff in
             mds = ds.copy(deep=False)
 
         # local binding
-        regs = self._regs
         inspace = self.get_space()
         polycoords = self._polycoords
 
         # is it possible to map that dataset?
-        if inspace is None and len(regs) != len(ds):
+        if inspace is None and self._nsamples != len(ds):
             raise ValueError("Cannot detrend the dataset, since it neither "
                              "provides location information of its samples "
                              "in the space spanned by the polynomials, "
                              "nor does it match the number of samples this "
                              "this mapper has been trained on. (got: %i "
                              " and was trained on %i)."
-                             % (len(ds), len(regs)))
+                             % (len(ds), self._nsamples))
         # do we have to handle the polynomial space somehow?
         if not inspace is None:
             if inspace in ds.sa:
@@ -305,40 +380,37 @@ class PolyDetrendMapper(Mapper):
                 # let's first see whether the coords are identical to the
                 # trained ones (that should be the common case and nothing needs
                 # to be done
-                # otherwise look whether we can find the right regressors
                 if not np.all(space_coords == polycoords):
-                    # to make the stuff below work, we'd need to store chunk
-                    # info too, otherwise we cannot determine the correct
-                    # regressor rows
+                    # otherwise we would need to look for the right regressor
+                    # rows, but we'd need to store chunk info too, otherwise
+                    # we cannot determine them
                     raise NotImplementedError
-                    # determine the regressor rows that match the samples
-                    reg_idx = [np.argwhere(polycoords == c).flatten()[0]
-                                    for c in space_coords]
-                    # slice the regressors accordingly
-                    regs = regs[reg_idx]
             else:
                 # the input dataset knows nothing about the polyspace
                 # let's put that information into the output dataset
                 mds.sa[inspace] = self._polycoords
 
-        # regression for each feature
-        fit = np.linalg.lstsq(regs, ds.samples)
-        # actually we are only interested in the solution
-        # res[0] is (nregr x nfeatures)
-        y = fit[0]
-        # remove all and keep only the residuals
-        if self._secret_inplace_detrend:
-            # if we are in evil mode do evil
-
-            # cast the data to float, since in-place operations below do not
-            # upcast!
-            if np.issubdtype(mds.samples.dtype, np.integer):
-                mds.samples = mds.samples.astype('float')
-
-            mds.samples -= np.dot(regs, y)
+        # cast the data to float, since in-place operations below do not
+        # upcast!  floating point data keeps its precision though
+        samples = ds.samples
+        if samples.dtype.kind in 'fc':
+            dtype = samples.dtype
+        else:
+            dtype = np.dtype('float')
+        if self.params.inplace:
+            if samples.dtype != dtype:
+                mds.samples = samples.astype(dtype)
         else:
             # important to assign to ensure COW behavior
-            mds.samples = ds.samples - np.dot(regs, y)
+            mds.samples = np.array(samples, dtype=dtype, subok=True)
+
+        # remove the polynomials of each chunk, and then the (orthogonalized)
+        # optional regressors -- keeping only the residuals
+        samples = mds.samples
+        for cinds, regs, basis in self._chunks:
+            _remove_projection(samples, cinds, basis)
+        if not self._opt_basis is None:
+            _remove_projection(samples, slice(None), self._opt_basis)
 
         return mds
 
@@ -350,7 +422,7 @@ class PolyDetrendMapper(Mapper):
 
 
 
-@borrowkwargs(PolyDetrendMapper, '__init__')
+@borrowkwargs(PolyDetrendMapper, '__init__', exclude=['inplace'])
 def poly_detrend(ds, **kwargs):
     """In-place polynomial detrending.
 
@@ -366,8 +438,7 @@ def poly_detrend(ds, **kwargs):
       For all other arguments, please see the documentation of
       PolyDetrendMapper.
     """
-    dm = PolyDetrendMapper(**kwargs)
-    dm._secret_inplace_detrend = True
+    dm = PolyDetrendMapper(inplace=True, **kwargs)
     # map
     mapped = dm.forward(ds)
     # and append the mapper to the dataset
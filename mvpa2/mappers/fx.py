@@ -204,7 +204,6 @@ class FxMapper(Mapper):
 
 
     def _forward_dataset_grouped(self, ds):
-        mdata = [] # list of samples array pieces
         if self.__axis == 'samples':
             col = ds.sa
             axis = 0
@@ -214,66 +213,116 @@ class FxMapper(Mapper):
         else:
             raise RuntimeError("This should not have happened!")
 
+        # group index of each sample/feature, with groups sorted as requested
+        groups, starts, counts, ncombs = self.__get_groups(col)
+        ngroups = len(starts)
+        if ngroups < ncombs:
+            warning('There were no samples for %i out of %i combinations of '
+                    '%s. It might be a sign of a disbalanced dataset %s.'
+                    % (ncombs - ngroups, ncombs, self.__uattrs, ds))
+        if not ngroups:
+            raise ValueError("No samples to group by %s in %s"
+                             % (self.__uattrs, ds))
+
+        samples = ds.samples
+        reduceat = None
+        if (axis == 0 or samples.ndim == 2) and not len(self.__fxargs):
+            reduceat = _get_reduceat(self.__fx, samples.dtype)
+        if reduceat is not None:
+            # a single pass over the data ordered by groups
+            if __debug__:
+                debug('FX', "Applying %s to %i groups at once",
+                      (self.__fx, ngroups))
+            mdata = reduceat(samples.take(groups, axis=axis), starts, counts,
+                             axis)
+        else:
+            mdata = [] # list of samples array pieces
+            for start, count in zip(starts, counts):
+                selector = groups[start:start + count]
+                # process the samples
+                if axis == 0:
+                    gsamples = samples[selector]
+                else:
+                    gsamples = samples[:, selector]
+                mdata.append(self.__smart_apply_along_axis(gsamples))
+            if axis == 0:
+                mdata = np.vstack(mdata)
+            else:
+                mdata = np.vstack(np.transpose(mdata))
+
         attrs = dict(zip(col.keys(), [[] for i in col]))
+        if not self.__attrfx is None:
+            # and now all samples attributes
+            for attr in col:
+                value = col[attr].value
+                attrs[attr] = [self.__attrfx(value[groups[start:start + count]])
+                               for start, count in zip(starts, counts)]
+        return mdata, attrs
 
-        # create a dictionary for all unique elements in all attribute this
-        # mapper should operate on
-        self.__attrcombs = dict(zip(self.__uattrs,
-                                [col[attr].unique for attr in self.__uattrs]))
-        # let it generate all combinations of unique elements in any attr
-        order = self.order
-        order_keys = []
-        for comb in _orthogonal_permutations(self.__attrcombs):
-            selector = reduce(np.multiply,
-                                [array_whereequal(col[attr].value, value)
-                                 for attr, value in comb.iteritems()])
 
-            # process the samples
-            if axis == 0:
-                samples = ds.samples[selector]
+    def __get_groups(self, col):
+        """Determine groups of samples/features sharing the values of uattrs
+
+        Returns
+        -------
+        groups : array
+          Indices of the samples/features ordered by their groups (and by
+          their original order within groups).
+        starts, counts : array
+          Offset and size of each group in `groups`.
+        ncombs : int
+          Number of all possible combinations of unique attribute values.
+        """
+        uattrs = self.__uattrs
+        uniques, gcodes = [], None
+        for attr in uattrs:
+            value = col[attr].value
+            if value.dtype == np.object:
+                # might be hard to sort -- match each unique value
+                unique = col[attr].unique
+                codes = -np.ones(len(value), dtype=int)
+                for i, u in enumerate(unique):
+                    codes[array_whereequal(value, u)] = i
             else:
-                samples = ds.samples[:, selector]
-
-            # check if there were any samples for such a combination,
-            # if not -- warning and skip the rest of the loop body
-            if not len(samples):
-                warning('There were no samples for combination %s. It might be '
-                        'a sign of a disbalanced dataset %s.' % (comb, ds))
-                continue
-
-            fxed_samples = self.__smart_apply_along_axis(samples)
-            mdata.append(fxed_samples)
-            if not self.__attrfx is None:
-                # and now all samples attributes
-                for i, attr in enumerate(col):
-                    fxed_attr = self.__attrfx(col[attr].value[selector])
-                    attrs[attr].append(fxed_attr)
-            # possibly take care about collecting information to have groups ordered
-            if order == 'uattrs':
-                # reverse order as per docstring -- most of the time we have
-                # used uattrs=['targets', 'chunks'] and did expect chunks being
-                # groupped together.
-                order_keys.append([comb[a] for a in self.__uattrs[::-1]])
-            elif order == 'occurrence':
-                # First index should be sufficient since we are dealing
-                # with unique non-overlapping groups here (AFAIK ;) )
-                order_keys.append(np.where(selector)[0][0])
-
-        if order:
-            # reorder our groups using collected "order_keys"
-            # data
-            order_idxs = argsort(order_keys)
-            mdata = [mdata[i] for i in order_idxs]
-            # and attributes
-            attrs = dict((k, [v[i] for i in order_idxs])
-                         for k,v in attrs.iteritems())
-
-        if axis == 0:
-            mdata = np.vstack(mdata)
-        else:
-            mdata = np.vstack(np.transpose(mdata))
-        return mdata, attrs
+                unique, codes = np.unique(value, return_inverse=True)
+                if value.dtype.kind in 'fc':
+                    # NaN is not equal to anything
+                    codes[np.isnan(value)] = -1
+            uniques.append(unique)
+            if gcodes is None:
+                gcodes = codes.copy()
+            else:
+                gcodes = gcodes * len(unique) + codes
+                gcodes[codes < 0] = -1
+        ncombs = _product_len(uniques)
 
+        selected = np.where(gcodes >= 0)[0]
+        ugcodes, first, ginv = np.unique(gcodes[selected], return_index=True,
+                                         return_inverse=True)
+        order = self.order
+        if order == 'uattrs':
+            # reverse order as per docstring -- most of the time we have
+            # used uattrs=['targets', 'chunks'] and did expect chunks being
+            # groupped together.
+            acodes = np.unravel_index(ugcodes, [len(u) for u in uniques]) \
+                     if len(ugcodes) else [[]] * len(uniques)
+            order_keys = zip(*[[u[c] for c in ac]
+                               for u, ac in zip(uniques, acodes)][::-1])
+            gorder = argsort(order_keys)
+        elif order == 'occurrence':
+            gorder = np.argsort(first)
+        else:
+            gorder = np.arange(len(ugcodes))
+        # rank of the group of each selected sample
+        grank = np.empty(len(ugcodes), dtype=int)
+        grank[gorder] = np.arange(len(ugcodes))
+        grank = grank[ginv]
+        # stable sort to keep the original order within groups
+        groups = selected[np.argsort(grank, kind='mergesort')]
+        counts = np.bincount(grank, minlength=len(ugcodes)) \
+                 if len(grank) else np.zeros(0, dtype=int)
+        starts = np.cumsum(counts) - counts
+        return groups, starts, counts, ncombs
 
     def _forward_dataset_full(self, ds):
         # simply map the all of the data
@@ -544,6 +593,48 @@ def argsort(seq, reverse=False):
     # cmp was not passed through since seems to be absent in python3
     return sorted(range(len(seq)), key=seq.__getitem__, reverse=reverse)
 
+def _product_len(sequences):
+    """Number of combinations of the elements of the sequences"""
+    return reduce(lambda x, y: x * len(y), sequences, 1)
+
+
+def _mean_reduceat(data, starts, counts, axis):
+    if data.dtype.kind in 'biu':
+        # as np.mean
+        sums = np.add.reduceat(data, starts, axis=axis, dtype=np.float64)
+    else:
+        sums = np.add.reduceat(data, starts, axis=axis)
+    shape = [1] * data.ndim
+    shape[axis] = len(counts)
+    return sums / counts.reshape(shape).astype(sums.dtype)
+
+
+def _get_reduceat(fx, dtype):
+    """Grouped implementation of a known reduction along an axis
+
+    Returns
+    -------
+    callable or None
+      Called with the data (ordered by groups), start indices and sizes of
+      the groups, and the axis.  None if there is no such implementation
+      for `fx` and data of `dtype`.
+    """
+    if dtype.kind in 'fc':
+        ufunc = {np.sum: np.add, np.max: np.maximum,
+                 np.min: np.minimum}.get(fx, None)
+    elif dtype.kind in 'biu':
+        # sum would differ in the dtype of the result
+        ufunc = {np.max: np.maximum, np.min: np.minimum}.get(fx, None)
+    else:
+        return None
+    if fx is np.mean:
+        return _mean_reduceat
+    if ufunc is None:
+        return None
+    return lambda data, starts, counts, axis: \
+           ufunc.reduceat(data, starts, axis=axis)
+
+
 def _orthogonal_permutations(a_dict):
     """
     Takes a dictionary with lists as values and returns all permutations
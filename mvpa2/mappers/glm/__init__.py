@@ -141,6 +141,8 @@ class GLMMapper(Mapper):
     #def _reverse_dataset(self, ds):
         # reconstruct timeseries from model fit
 
+from .native_glm import NativeGLMMapper
+__all__.append('NativeGLMMapper')
 from mvpa2 import externals
 if externals.exists('nipy'):
     from .nipy_glm import NiPyGLMMapper
@@ -0,0 +1,298 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""GLMMapper implementation fitting all features at once with NumPy."""
+
+__docformat__ = 'restructuredtext'
+
+import numpy as np
+
+from mvpa2.base import externals
+from mvpa2.datasets import Dataset
+from mvpa2.mappers.glm import GLMMapper
+
+if __debug__:
+    from mvpa2.base import debug
+
+__all__ = ['MassUnivariateGLM', 'NativeGLMMapper']
+
+# descriptions of the results of t- and F-tests, as in UnivariateStatsModels
+_TTEST_DESCR = ['tvalue', 'pvalue', 'effect', 'sd', 'df', 'zvalue']
+_FTEST_DESCR = ['fvalue', 'pvalue', 'df_num', 'df_denom']
+
+
+def _ar1_whiten(a, rho):
+    """Prewhiten (the columns of) `a` for an AR(1) process"""
+    out = a.copy()
+    out[1:] -= rho * a[:-1]
+    out[0] *= np.sqrt(1 - rho ** 2)
+    return out
+
+
+def _residual_stats(X, B, Y, lag1=False, block_size=10000):
+    """Sum of squared residuals (and their lag-1 products) per column
+
+    Residuals are computed for blocks of columns only, to limit memory
+    demands.
+    """
+    ssr = np.empty(Y.shape[1])
+    if lag1:
+        lag1 = np.empty(Y.shape[1])
+    for start in xrange(0, Y.shape[1], block_size):
+        cols = slice(start, start + block_size)
+        resid = Y[:, cols] - np.dot(X, B[:, cols])
+        ssr[cols] = np.sum(resid ** 2, axis=0)
+        if lag1 is not False:
+            lag1[cols] = np.sum(resid[1:] * resid[:-1], axis=0)
+    if lag1 is False:
+        return ssr
+    return ssr, lag1
+
+
+class MassUnivariateGLM(object):
+    """General linear model fitted to many variables at once
+
+    The design matrix is (pseudo-)inverted only once, and parameter
+    estimates, residual variances, as well as t- and F-statistics of
+    contrasts are computed for all variables (columns of the data) with
+    matrix products.
+
+    Optionally, the data are prewhitened for an AR(1) process of the
+    residuals: the AR(1) coefficient is estimated for each variable from
+    the residuals of an OLS fit, and the model is refitted to the whitened
+    data and design.  The coefficients get rounded (see `ar1_bins`), so
+    only a limited number of whitened designs needs to be inverted.
+
+    After `fit()`, the fitted model provides `params`, `bse`, `tvalues`,
+    `pvalues`, `ssr`, `scale` (residual variance), `df_resid`, and `rho`
+    (AR(1) coefficients, if prewhitening was done) with a value per
+    variable (in columns).  p- and z-values require scipy.
+    """
+
+    def __init__(self, X, ar1=False, ar1_bins=100):
+        """
+        Parameters
+        ----------
+        X : array
+          Design matrix (observations in rows, regressors in columns).
+        ar1 : bool
+          Whether to prewhiten the data for an AR(1) process.
+        ar1_bins : int
+          Number of bins per unit of the AR(1) coefficient, i.e. precision
+          of the coefficients used for prewhitening.
+        """
+        self.X = np.asanyarray(X, dtype=float)
+        self.ar1 = ar1
+        self.ar1_bins = ar1_bins
+        self.params = None
+        self.ssr = None
+        self.rho = None
+        # columns of the data and unscaled covariance of the parameter
+        # estimates for each design (unique AR(1) coefficient)
+        self._groups = None
+
+    def fit(self, Y):
+        """Fit the model to the data
+
+        Parameters
+        ----------
+        Y : array
+          Data with observations in rows, and variables in columns.
+        """
+        X = self.X
+        Y = np.asanyarray(Y)
+        if Y.ndim == 1:
+            Y = Y[:, None]
+        if not len(Y) == len(X):
+            raise ValueError("Data with %i observations does not match the "
+                             "design with %i" % (len(Y), len(X)))
+        nobs, nvars = Y.shape
+        self.rank = np.linalg.matrix_rank(X)
+        self.df_resid = nobs - self.rank
+        if not self.df_resid > 0:
+            raise ValueError("No degrees of freedom left for the residuals "
+                             "with a design of rank %i" % self.rank)
+
+        pinv = np.linalg.pinv(X)
+        params = np.dot(pinv, Y)
+        if not self.ar1:
+            self.params = params
+            self.ssr = _residual_stats(X, params, Y)
+            self._groups = [(slice(None), np.dot(pinv, pinv.T))]
+            return self
+
+        # estimate AR(1) coefficients from the OLS residuals
+        ssr, lag1 = _residual_stats(X, params, Y, lag1=True)
+        rho = lag1 / np.where(ssr > 0, ssr, 1)
+        rho = np.clip(np.round(rho * self.ar1_bins) / self.ar1_bins,
+                      -0.99, 0.99)
+        urho, rho_idx = np.unique(rho, return_inverse=True)
+        if __debug__:
+            debug('MAP', "Prewhitening of %i variables for %i AR(1) "
+                         "coefficients" % (nvars, len(urho)))
+        params = np.empty((X.shape[1], nvars))
+        ssr = np.empty(nvars)
+        self._groups = []
+        for i, r in enumerate(urho):
+            cols = np.where(rho_idx == i)[0]
+            Xw = _ar1_whiten(X, r)
+            Yw = _ar1_whiten(Y[:, cols], r)
+            pinv = np.linalg.pinv(Xw)
+            params[:, cols] = np.dot(pinv, Yw)
+            ssr[cols] = _residual_stats(Xw, params[:, cols], Yw)
+            self._groups.append((cols, np.dot(pinv, pinv.T)))
+        self.params = params
+        self.ssr = ssr
+        self.rho = rho
+        return self
+
+    scale = property(fget=lambda self: self.ssr / self.df_resid,
+                     doc="Residual variance")
+
+    def _map_groups(self, fx, shape=()):
+        """Compute `fx(unscaled_cov, cols)` for all groups of variables"""
+        out = np.empty(shape + (self.params.shape[1],))
+        for cols, cov in self._groups:
+            out[..., cols] = fx(cov, cols)
+        return out
+
+    @property
+    def bse(self):
+        """Standard errors of the parameter estimates"""
+        scale = self.scale
+        return self._map_groups(
+            lambda cov, cols: np.sqrt(np.diag(cov)[:, None] * scale[cols]),
+            shape=(self.params.shape[0],))
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        externals.exists('scipy', raise_=True)
+        import scipy.stats as stats
+        return 2 * stats.t.sf(np.abs(self.tvalues), self.df_resid)
+
+    def t_test(self, contrast):
+        """t-test of a contrast of the parameters
+
+        Parameters
+        ----------
+        contrast : array
+          Contrast vector with a weight per regressor.
+
+        Returns
+        -------
+        dict
+          'tvalue', 'pvalue' (two-sided), 'effect', 'sd', 'df', and
+          'zvalue' of the test for each variable.
+        """
+        externals.exists('scipy', raise_=True)
+        import scipy.stats as stats
+        c = np.asanyarray(contrast, dtype=float)
+        effect = np.dot(c, self.params)
+        scale = self.scale
+        sd = self._map_groups(
+            lambda cov, cols: np.sqrt(np.dot(c, np.dot(cov, c)) * scale[cols]))
+        tvalue = effect / sd
+        df = self.df_resid
+        return {'tvalue': tvalue,
+                'pvalue': 2 * stats.t.sf(np.abs(tvalue), df),
+                'effect': effect,
+                'sd': sd,
+                'df': np.repeat(float(df), len(tvalue)),
+                'zvalue': stats.norm.ppf(stats.t.cdf(tvalue, df))}
+
+    def f_test(self, contrasts):
+        """F-test of a contrast matrix
+
+        Parameters
+        ----------
+        contrasts : array
+          Contrast matrix with a contrast per row.
+
+        Returns
+        -------
+        dict
+          'fvalue', 'pvalue', 'df_num', and 'df_denom' of the test for each
+          variable.
+        """
+        externals.exists('scipy', raise_=True)
+        import scipy.stats as stats
+        R = np.atleast_2d(np.asanyarray(contrasts, dtype=float))
+        effect = np.dot(R, self.params)
+        df_num = np.linalg.matrix_rank(R)
+        scale = self.scale
+
+        def fvalue(cov, cols):
+            icov = np.linalg.pinv(np.dot(R, np.dot(cov, R.T)))
+            e = effect[:, cols]
+            return np.sum(e * np.dot(icov, e), axis=0) / df_num / scale[cols]
+
+        fvalue = self._map_groups(fvalue)
+        return {'fvalue': fvalue,
+                'pvalue': stats.f.sf(fvalue, df_num, self.df_resid),
+                'df_num': np.repeat(float(df_num), len(fvalue)),
+                'df_denom': np.repeat(float(self.df_resid), len(fvalue))}
+
+
+class NativeGLMMapper(GLMMapper):
+    """GLMMapper implementation fitting all features at once
+
+    Based on :class:`~mvpa2.mappers.glm.native_glm.MassUnivariateGLM`, it
+    requires no 3rd-party package (except for scipy for p- and z-values)
+    and is orders of magnitude faster than fitting a model per feature.
+    Results are specified like for
+    :class:`~mvpa2.mappers.glm.statsmodels_glm.StatsmodelsGLMMapper`.
+    """
+    def __init__(self, regs, results='params', ar1=False, **kwargs):
+        """
+        Parameters
+        ----------
+        regs : list
+          Names of sample attributes to be extracted from an input dataset and
+          used as design matrix columns.
+        results : {'params', 'bse', 'tvalues', 'pvalues', 'scale', 'ssr', 'rho'} or array, optional
+          If a str, the corresponding attribute of the fitted
+          `MassUnivariateGLM`.  If a 1d-array, results of a t-test of this
+          contrast vector, and if a 2d-array of an F-test of this contrast
+          matrix.  Descriptions of the returned statistics are available in
+          the 'descr' sample attribute.  By default parameter estimates are
+          returned.
+        ar1 : bool, optional
+          If True, data are prewhitened for an AR(1) process of the
+          residuals.
+        """
+        GLMMapper.__init__(self, regs, **kwargs)
+        self.result_expr = results
+        self.ar1 = ar1
+
+    def _fit_model(self, ds, X, reg_names):
+        glm = MassUnivariateGLM(X, ar1=self.ar1).fit(ds.samples)
+        res = self.result_expr
+        if isinstance(res, basestring):
+            samples = getattr(glm, res)
+            if samples is None:
+                raise ValueError("Fitted model provides no '%s'" % res)
+            samples = np.atleast_2d(samples)
+            sa = {'descr': [res] * len(samples)}
+            if len(samples) == len(reg_names):
+                sa[self.get_space()] = reg_names
+        else:
+            res = np.asanyarray(res)
+            if res.ndim == 1:
+                stats, descr = glm.t_test(res), _TTEST_DESCR
+            elif res.ndim == 2:
+                stats, descr = glm.f_test(res), _FTEST_DESCR
+            else:
+                raise ValueError("Test specification (via `results`) has to "
+                                 "be 1d or 2d array")
+            samples = np.vstack([stats[d] for d in descr])
+            sa = {'descr': descr}
+        return glm, Dataset(samples, sa=sa)
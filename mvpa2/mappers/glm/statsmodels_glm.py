@@ -27,6 +27,10 @@ class StatsmodelsGLMMapper(GLMMapper):
     :class:`~mvpa2.measures.statsmodels_adaptor.UnivariateStatsModels`.
     In particular, it supports all ``model_gen`` and ``results`` arguments
     as described in the documentation for this class.
+
+    Since a model is fitted to each feature separately, consider
+    :class:`~mvpa2.mappers.glm.native_glm.NativeGLMMapper` for OLS (or
+    AR(1)) models of many features.
     """
     def __init__(self, regs, model_gen=None, results='params',
                  **kwargs):
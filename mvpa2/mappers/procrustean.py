@@ -55,9 +55,19 @@ class ProcrusteanMapper(ProjectionMapper):
                  doc="""Cutoff for 'small' singular values to regularize the
                      inverse. See :class:`~numpy.linalg.lstsq` for more
                      information.""")
-    svd = Parameter('numpy', constraints=EnsureChoice('numpy', 'scipy', 'dgesvd'),
+    svd = Parameter('numpy',
+                 constraints=EnsureChoice('numpy', 'scipy', 'dgesvd',
+                                          'truncated'),
                  doc="""Implementation of SVD to use. dgesvd requires ctypes to
-                 be available.""")
+                 be available. 'truncated' computes only the (at most
+                 number of samples) non-trivial singular vectors from QR
+                 decompositions of the data, without the SVD of a
+                 features x features matrix.  It is much faster for
+                 datasets with many more features than samples, and the
+                 transformation of the training data is identical, but
+                 the directions not spanned by the training data are
+                 discarded instead of being arbitrarily rotated.  Does not
+                 support `reflection=False`.""")
     def __init__(self, space='targets', **kwargs):
         ProjectionMapper.__init__(self, space=space, **kwargs)
 
@@ -163,6 +173,17 @@ class ProcrusteanMapper(ProjectionMapper):
                 from mvpa2.support.lapack_svd import svd as dgesvd
                 U, s, Vh = dgesvd(np.dot(target.T, source),
                                     full_matrices=True, algo='svd')
+            elif params.svd == 'truncated':
+                if not params.reflection:
+                    raise ValueError("svd='truncated' does not support "
+                                     "reflection=False")
+                # target.T * source == qt * (rt * rs.T) * qs.T, so only a
+                # small matrix needs to be decomposed
+                qt, rt = np.linalg.qr(target.T)
+                qs, rs = np.linalg.qr(source.T)
+                U, s, Vh = np.linalg.svd(np.dot(rt, rs.T))
+                U = np.dot(qt, U)
+                Vh = np.dot(Vh, qs.T)
             else:
                 raise ValueError('Unknown type of svd %r'%(params.svd))
             T = np.dot(Vh.T, U.T)
@@ -114,8 +114,9 @@ class ProjectionMapper(Mapper):
         if demean and self._offset_in is not None:
             d = d - self._offset_in
 
-        # Do forward projection
-        res = (d * self._proj).A
+        # Do forward projection (np.asarray, since the projection might
+        # also be a scipy.sparse matrix)
+        res = np.asarray(d * self._proj)
 
         # Add output offset if present
         if demean and self._offset_out is not None:
@@ -133,7 +134,7 @@ class ProjectionMapper(Mapper):
             d = d - self._offset_out
 
         # Do reverse projection
-        res = (d * self.recon).A
+        res = np.asarray(d * self.recon)
 
         # Add offset in input space
         if self._demean and self._offset_in is not None:
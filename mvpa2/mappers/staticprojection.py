@@ -28,9 +28,9 @@ class StaticProjectionMapper(ProjectionMapper):
 
         Parameters
         ----------
-        proj : 2-D array
+        proj : 2-D array or scipy.sparse matrix
           Projection matrix to be used for forward projection.
-        recon: 2-D array
+        recon: 2-D array or scipy.sparse matrix
           Projection matrix to be used for reverse projection.
           If this is not given, `numpy.linalg.pinv` of proj
           will be used by default.
@@ -45,9 +45,15 @@ class StaticProjectionMapper(ProjectionMapper):
     def _train(self, dummyds):
         """Do Nothing
         """
-        if __debug__:
+        if __debug__ and "MAP_" in debug.active:
+            proj = self._proj
+            if hasattr(proj, 'multiply'):
+                # scipy.sparse matrix
+                norm = np.sqrt(proj.multiply(proj).sum())
+            else:
+                norm = np.linalg.norm(proj)
             debug("MAP_", "Mixing matrix has %s shape and norm=%f" %
-                  (self._proj.shape, np.linalg.norm(self._proj)))
+                  (proj.shape, norm))
 
 
 
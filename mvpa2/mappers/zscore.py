@@ -16,9 +16,60 @@ from mvpa2.base import warning
 from mvpa2.base.dochelpers import _str, borrowkwargs, _repr_attrs
 from mvpa2.mappers.base import accepts_dataset_as_samples, Mapper
 from mvpa2.datasets.base import Dataset
-from mvpa2.datasets.miscfx import get_nsamples_per_attr, get_samples_by_attr
+from mvpa2.datasets.miscfx import get_samples_by_attr
+from mvpa2.misc.support import get_unique_codes
 from mvpa2.support import copy
 
+# max. number of elements in temporary arrays for blockwise processing
+_BLOCK_ELEMENTS = 2 ** 22
+
+
+def _get_column_blocks(shape):
+    """Slices of columns for blockwise processing of an array"""
+    ncols = max(1, _BLOCK_ELEMENTS // max(1, shape[0]))
+    return [slice(start, start + ncols)
+            for start in xrange(0, shape[1], ncols)]
+
+
+def _get_group_stats(samples, codes, ngroups):
+    """Mean and standard deviation of all features for groups of samples
+
+    Statistics of all groups are computed at once, for blocks of features,
+    and are accumulated in double precision.  Samples with a negative code
+    are ignored.
+
+    Returns
+    -------
+    (means, stds)
+      Arrays with a row per group (NaN for groups without samples).
+    """
+    order = np.argsort(codes, kind='mergesort')
+    order = order[codes[order] >= 0]
+    counts = np.bincount(codes[order], minlength=ngroups)
+    present = counts > 0
+    starts = (np.cumsum(counts) - counts)[present]
+    counts = counts[present]
+    # no need to reorder already sorted samples
+    in_order = len(order) == len(samples) \
+               and np.all(order == np.arange(len(order)))
+    means = np.empty((ngroups, samples.shape[1]))
+    means.fill(np.nan)
+    stds = means.copy()
+    if not len(order):
+        return means, stds
+    for cols in _get_column_blocks(samples.shape):
+        if in_order:
+            block = samples[:, cols].astype(np.float64)
+        else:
+            block = samples[order, cols].astype(np.float64)
+        mean = np.add.reduceat(block, starts, axis=0) / counts[:, None]
+        block -= np.repeat(mean, counts, axis=0)
+        block **= 2
+        means[present, cols] = mean
+        stds[present, cols] = np.sqrt(
+            np.add.reduceat(block, starts, axis=0) / counts[:, None])
+    return means, stds
+
 
 class ZScoreMapper(Mapper):
     """Mapper to normalize features (Z-scoring).
@@ -35,7 +86,12 @@ class ZScoreMapper(Mapper):
     which these parameters should be estimated.
 
     If necessary, data is upcasted into a configurable datatype to prevent
-    information loss.
+    information loss.  Floating point data (e.g. float32) keeps its datatype,
+    while parameters are estimated in double precision.
+
+    Z-scoring parameters of all chunks are estimated, and applied, at once
+    for blocks of features.  With `inplace` the samples of a mapped dataset
+    are Z-scored without making a copy of them first.
 
     Notes
     -----
@@ -49,7 +105,7 @@ class ZScoreMapper(Mapper):
     Reverse-mapping is currently not implemented.
     """
     def __init__(self, params=None, param_est=None, chunks_attr='chunks',
-                 dtype='float64', **kwargs):
+                 dtype='float64', inplace=False, **kwargs):
         """
         Parameters
         ----------
@@ -73,6 +129,11 @@ class ZScoreMapper(Mapper):
         dtype : Numpy dtype, optional
           Target dtype that is used for upcasting, in case integer data is to be
           Z-scored.
+        inplace : bool, optional
+          If True, samples of datasets (and plain data arrays) are Z-scored
+          in-place, i.e. the input data is modified.  Only use it if the
+          input data is not needed any longer.  Integer samples of datasets
+          are still upcasted (i.e. replaced).
         """
         Mapper.__init__(self, **kwargs)
 
@@ -81,16 +142,15 @@ class ZScoreMapper(Mapper):
         self.__param_est = param_est
         self.__params_dict = None
         self.__dtype = dtype
-
-        # secret switch to perform in-place z-scoring
-        self._secret_inplace_zscore = False
+        self.__inplace = inplace
 
 
     def __repr__(self, prefixes=[]):
         return super(ZScoreMapper, self).__repr__(
             prefixes=prefixes
             + _repr_attrs(self, ['params', 'param_est', 'chunks_attr'])
-            + _repr_attrs(self, ['dtype'], default='float64'))
+            + _repr_attrs(self, ['dtype'], default='float64')
+            + _repr_attrs(self, ['inplace'], default=False))
 
 
     def __str__(self):
@@ -116,25 +176,30 @@ class ZScoreMapper(Mapper):
             if not param_est is None:
                 est_attr, est_attr_values = param_est
                 # which samples to use for estimation
-                est_ids = set(get_samples_by_attr(ds, est_attr,
-                                                  est_attr_values))
+                est_ids = np.unique(get_samples_by_attr(ds, est_attr,
+                                                        est_attr_values))
             else:
-                est_ids = slice(None)
+                est_ids = None
 
             # now we can either do it one for all, or per chunk
             if not chunks_attr is None:
-                # per chunk estimate
-                params = {}
-                for c in ds.sa[chunks_attr].unique:
-                    slicer = np.where(ds.sa[chunks_attr].value == c)[0]
-                    if not isinstance(est_ids, slice):
-                        slicer = list(est_ids.intersection(set(slicer)))
-                    params[c] = self._compute_params(ds.samples[slicer])
+                # per chunk estimate, for all chunks at once
+                uchunks, codes = get_unique_codes(ds.sa[chunks_attr])
+                if not est_ids is None:
+                    # ignore samples not to be used for estimation
+                    est_codes = -np.ones(len(codes), dtype=int)
+                    est_codes[est_ids] = codes[est_ids]
+                    codes = est_codes
+                means, stds = _get_group_stats(ds.samples, codes, len(uchunks))
+                params = dict([(c, (means[i], stds[i]))
+                               for i, c in enumerate(uchunks)])
             else:
                 # global estimate
-                if isinstance(est_ids, set):
-                    est_ids = list(est_ids)
-                params = {'__all__': self._compute_params(ds.samples[est_ids])}
+                if est_ids is None:
+                    samples = ds.samples
+                else:
+                    samples = ds.samples[est_ids]
+                params = {'__all__': self._compute_params(samples)}
 
 
         self.__params_dict = params
@@ -145,53 +210,60 @@ class ZScoreMapper(Mapper):
         chunks_attr = self.__chunks_attr
         dtype = self.__dtype
 
-        if __debug__ and not chunks_attr is None:
-            nsamples_per_chunk = get_nsamples_per_attr(ds, chunks_attr)
-            min_nsamples_per_chunk = np.min(nsamples_per_chunk.values())
-            if min_nsamples_per_chunk in range(3, 6):
-                warning("Z-scoring chunk-wise having a chunk with only "
-                        "%d samples is 'discouraged'. "
-                        "You have chunks with following number of samples: %s"
-                        % (min_nsamples_per_chunk, nsamples_per_chunk,))
-            if min_nsamples_per_chunk <= 2:
-                warning("Z-scoring chunk-wise having a chunk with less "
-                        "than three samples will set features in these "
-                        "samples to either zero (with 1 sample in a chunk) "
-                        "or -1/+1 (with 2 samples in a chunk). "
-                        "You have chunks with following number of samples: %s"
-                        % (nsamples_per_chunk,))
+        if not chunks_attr is None:
+            uchunks, codes = get_unique_codes(ds.sa[chunks_attr])
+            if __debug__:
+                nsamples_per_chunk = dict(zip(uchunks, np.bincount(codes)))
+                min_nsamples_per_chunk = np.min(nsamples_per_chunk.values())
+                if min_nsamples_per_chunk in range(3, 6):
+                    warning("Z-scoring chunk-wise having a chunk with only "
+                            "%d samples is 'discouraged'. "
+                            "You have chunks with following number of "
+                            "samples: %s"
+                            % (min_nsamples_per_chunk, nsamples_per_chunk,))
+                if min_nsamples_per_chunk <= 2:
+                    warning("Z-scoring chunk-wise having a chunk with less "
+                            "than three samples will set features in these "
+                            "samples to either zero (with 1 sample in a "
+                            "chunk) or -1/+1 (with 2 samples in a chunk). "
+                            "You have chunks with following number of "
+                            "samples: %s"
+                            % (nsamples_per_chunk,))
 
         params = self.__params_dict
         if params is None:
             raise RuntimeError, \
                   "ZScoreMapper needs to be trained before call to forward"
 
-        if self._secret_inplace_zscore:
+        samples = ds.samples
+        # floating point data keeps its precision
+        if samples.dtype.kind in 'fc':
+            dtype = samples.dtype
+        if self.__inplace:
             mds = ds
+            # cast the data to float, since in-place operations below do not
+            # upcast!
+            if samples.dtype != dtype:
+                mds.samples = samples.astype(dtype)
         else:
             # shallow copy to put the new stuff in
             mds = ds.copy(deep=False)
-            # but deepcopy the samples since _zscore would modify inplace
-            mds.samples = mds.samples.copy()
-
-        # cast the data to float, since in-place operations below do not upcast!
-        if np.issubdtype(mds.samples.dtype, np.integer):
-            mds.samples = mds.samples.astype(dtype)
+            # but copy (and cast) the samples since _zscore modifies in-place
+            mds.samples = np.array(samples, dtype=dtype, subok=True)
 
         if '__all__' in params:
             # we have a global parameter set
-            mds.samples = self._zscore(mds.samples, *params['__all__'])
+            self._zscore(mds.samples, *params['__all__'])
         else:
-            # per chunk z-scoring
-            for c in mds.sa[chunks_attr].unique:
+            # per chunk z-scoring, all chunks at once
+            for c in uchunks:
                 if not c in params:
                     raise RuntimeError(
                         "%s has no parameters for chunk '%s'. It probably "
                         "wasn't present in the training dataset!?"
                         % (self.__class__.__name__, c))
-                slicer = np.where(mds.sa[chunks_attr].value == c)[0]
-                mds.samples[slicer] = self._zscore(mds.samples[slicer],
-                                                   *params[c])
+            means, stds = zip(*[params[c] for c in uchunks])
+            self._zscore(mds.samples, means, stds, codes=codes)
 
         return mds
 
@@ -214,12 +286,12 @@ class ZScoreMapper(Mapper):
         # mappers should not modify the input data
         # cast the data to float, since in-place operations below to not upcast!
         if np.issubdtype(data.dtype, np.integer):
-            if self._secret_inplace_zscore:
+            if self.__inplace:
                 raise TypeError(
                     "Cannot perform inplace z-scoring since data is of integer "
                     "type. Please convert to float before calling zscore")
             mdata = data.astype(self.__dtype)
-        elif self._secret_inplace_zscore:
+        elif self.__inplace:
             mdata = data
         else:
             # do not call .copy() directly, since it might not be an array
@@ -230,41 +302,64 @@ class ZScoreMapper(Mapper):
 
 
     def _compute_params(self, samples):
-        return (np.mean(samples, axis=0), np.std(samples, axis=0))
+        means, stds = _get_group_stats(samples,
+                                       np.zeros(len(samples), dtype=int), 1)
+        return means[0], stds[0]
 
 
-    def _zscore(self, samples, mean, std):
-        # de-mean
-        if np.isscalar(mean) or samples.shape[1] == len(mean):
-            mean = np.asanyarray(mean)  # assure array
-            samples -= mean
-        else:
-            raise RuntimeError("mean should be a per-feature vector. Got: %r"
-                               % (mean,))
+    def _zscore(self, samples, mean, std, codes=None):
+        """Z-score samples in-place
 
-        # scale
-        if np.isscalar(std):
-            if std == 0:
-                samples[:] = 0
-            else:
-                samples /= std
-        else:
-            std = np.asanyarray(std)
-            if samples.shape[1] != len(std):
+        Without `codes` a single set of parameters is used for all samples.
+        Otherwise `mean` and `std` are sequences of parameter sets, and
+        `codes` indicates the set to be used for each sample.
+        """
+        nfeatures = samples.shape[1]
+        if codes is None:
+            mean, std = [mean], [std]
+        # per-feature parameters of all sets
+        means = np.empty((len(mean), nfeatures))
+        stds = np.empty((len(std), nfeatures))
+        # sets with a scalar std of zero -- samples are set to zero
+        zeroed = np.zeros(len(std), dtype=bool)
+        for i, (m, s) in enumerate(zip(mean, std)):
+            if not (np.isscalar(m) or nfeatures == len(m)):
+                raise RuntimeError("mean should be a per-feature vector. "
+                                   "Got: %r" % (m,))
+            if not (np.isscalar(s) or nfeatures == len(s)):
                 raise RuntimeError("std should be a per-feature vector.")
+            zeroed[i] = np.isscalar(s) and s == 0
+            means[i] = m
+            stds[i] = s
+        # do not scale invariant features
+        stds[stds == 0] = 1
+
+        # de-mean and scale, for blocks of features to limit the size of
+        # temporary arrays
+        for cols in _get_column_blocks(samples.shape):
+            block = samples[:, cols]
+            if codes is None:
+                block -= means[0, cols]
+                block /= stds[0, cols]
+            else:
+                block -= means[codes, cols]
+                block /= stds[codes, cols]
+
+        if np.any(zeroed):
+            if codes is None:
+                samples[:] = 0
             else:
-                # check for invariant features
-                std_nz = std != 0
-                samples[:, std_nz] /= np.asanyarray(std)[std_nz]
+                samples[zeroed[codes]] = 0
         return samples
 
     params = property(fget=lambda self:self.__params)
     param_est = property(fget=lambda self:self.__param_est)
     chunks_attr = property(fget=lambda self:self.__chunks_attr)
     dtype = property(fget=lambda self:self.__dtype)
+    inplace = property(fget=lambda self:self.__inplace)
 
 
-@borrowkwargs(ZScoreMapper, '__init__')
+@borrowkwargs(ZScoreMapper, '__init__', exclude=['inplace'])
 def zscore(ds, **kwargs):
     """In-place Z-scoring of a `Dataset` or `ndarray`.
 
@@ -279,8 +374,7 @@ def zscore(ds, **kwargs):
     **kwargs
       For all other arguments, please see the documentation of `ZScoreMapper`.
     """
-    zm = ZScoreMapper(**kwargs)
-    zm._secret_inplace_zscore = True
+    zm = ZScoreMapper(inplace=True, **kwargs)
     # train
     if isinstance(ds, Dataset):
         zm.train(ds)
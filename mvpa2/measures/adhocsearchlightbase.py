@@ -20,9 +20,11 @@ from mvpa2.measures.searchlight import BaseSearchlight
 from mvpa2.base import externals, warning
 from mvpa2.base.dochelpers import borrowkwargs, _repr_attrs
 from mvpa2.generators.splitters import Splitter
+from mvpa2.base.parallel import parallel_map
+from mvpa2.support import copy
 
 #from mvpa2.base.param import Parameter
-#from mvpa2.base.state import ConditionalAttribute
+from mvpa2.base.state import ConditionalAttribute
 #from mvpa2.measures.base import Sensitivity
 
 from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere
@@ -106,6 +108,111 @@ def lastdim_columnsums_spmatrix(a, inds, out):
     out[:] = sums.reshape(in_shape+(n_sums,))
 
 
+def lastdim_columnsums_dense(a, inds, out, block_nelements=2**22):
+    # the same as above but via products with dense 0/1 indicator
+    # matrices, each one limited to ~`block_nelements` elements, so
+    # BLAS could do the heavy lifting for not so sparse neighborhoods
+    n_cols = a.shape[-1]
+    in_shape = a.shape[:-1]
+
+    if externals.exists('scipy') and sps.isspmatrix(inds):
+        n_sums = inds.shape[1]
+        inds_c = inds.tocsc()
+    else:
+        n_sums = len(inds)
+        inds_c = None
+
+    ar = a.reshape((-1, n_cols))
+    sums = np.empty((ar.shape[0], n_sums))
+    block_size = max(1, block_nelements // max(1, n_cols))
+    for start in xrange(0, n_sums, block_size):
+        stop = min(start + block_size, n_sums)
+        if inds_c is not None:
+            m = inds_c[:, start:stop].toarray()
+        else:
+            m = np.zeros((n_cols, stop - start))
+            for i, inds_ in enumerate(inds[start:stop]):
+                # counts, so repeated indices contribute as many times
+                # as with fancy indexing
+                m[:, i] = np.bincount(np.asarray(inds_, dtype=int),
+                                      minlength=n_cols)
+        sums[:, start:stop] = np.dot(ar, m)
+    out[:] = sums.reshape(in_shape+(n_sums,))
+
+
+def _time_indexsum(indexsum, a, inds, n_cols, ncalls):
+    """Time preparation of `inds` and `ncalls` summations for an engine
+
+    Returns
+    -------
+    float
+      Seconds spent.
+    """
+    import time
+    n_sums = len(inds)
+    t0 = time.time()
+    if indexsum == 'sparse':
+        inds = inds_to_coo(inds, shape=(n_cols, n_sums))
+    fx = _INDEXSUM_FX[indexsum]
+    out = np.empty(a.shape[:-1] + (n_sums,))
+    for i in xrange(ncalls):
+        fx(a, inds, out)
+    return time.time() - t0
+
+
+def _benchmark_indexsum(a, roi_fids, ncalls, indexsums, nsample=100):
+    """Estimate time needed by each engine to compute all the sums
+
+    Timings are carried out on two evenly spaced samples of ROIs (of
+    `nsample` and twice as many ROIs) and linearly extrapolated to the
+    total number of ROIs, so fixed costs (e.g. conversion of the data to a
+    sparse matrix) are accounted for.  If there are not that many ROIs, all
+    of them are used.
+
+    Parameters
+    ----------
+    a : array
+      Data of the shape similar to the one to be summed over.
+    roi_fids : list
+      Indices of features for each ROI.
+    ncalls : int
+      How many times summation will be carried out (e.g. number of
+      splits).
+    indexsums : list of str
+      Names of the engines to benchmark.
+
+    Returns
+    -------
+    dict
+      Estimated time (in seconds) for each engine.
+    """
+    nrois = len(roi_fids)
+    n_cols = a.shape[-1]
+    if nrois <= 2 * nsample:
+        samples = [(nrois, roi_fids)]
+    else:
+        samples = [(n, [roi_fids[i]
+                         for i in np.linspace(0, nrois - 1, n).astype(int)])
+                   for n in (nsample, 2 * nsample)]
+    timings = {}
+    for indexsum in indexsums:
+        t = [_time_indexsum(indexsum, a, sample, n_cols, ncalls)
+             for n, sample in samples]
+        if len(t) > 1:
+            (n1, n2), (t1, t2) = [s[0] for s in samples], t
+            t = t2 + max(0, t2 - t1) * (nrois - n2) / float(n2 - n1)
+        else:
+            t = t[0]
+        timings[indexsum] = t
+    return timings
+
+
+_INDEXSUM_FX = {'fancy': lastdim_columnsums_fancy_indexing,
+                'sparse': lastdim_columnsums_spmatrix,
+                'dense': lastdim_columnsums_dense}
+"""Engines to compute sums over arbitrary columns"""
+
+
 class _STATS:
     """Just a dummy container to group/access stats
     """
@@ -128,10 +235,18 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
 
     refactored from the original GNBSearchlight
 
+    Cross-validation splits are processed in parallel only if `nproc`
+    is explicitly set to more than 1.  With the default `nproc=None`
+    they are processed serially, as before.
+
     """
 
-    # TODO: implement parallelization (see #67) and then uncomment
-    __init__doc__exclude__ = ['nproc']
+    indexsum_engine = ConditionalAttribute(enabled=True,
+        doc="Engine used to compute sums over ROIs' features (useful "
+            "whenever indexsum='auto')")
+    indexsum_timings = ConditionalAttribute(enabled=False,
+        doc="Estimated time (in seconds) needed by each engine to compute "
+            "all the sums, as benchmarked with indexsum='auto'")
 
     def __init__(self, generator, queryengine, errorfx=mean_mismatch_error,
                  indexsum=None,
@@ -147,11 +262,16 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
         errorfx : func, optional
           Functor that computes a scalar error value from the vectors of
           desired and predicted values (e.g. subclass of `ErrorFunction`).
-        indexsum : ('sparse', 'fancy'), optional
+        indexsum : ('sparse', 'fancy', 'dense', 'auto'), optional
           What use to compute sums over arbitrary columns.  'fancy'
           corresponds to regular fancy indexing over columns, whenever
           in 'sparse', product of sparse matrices is used (usually
-          faster, so is default if `scipy` is available).
+          faster, so is default if `scipy` is available).  'dense' uses
+          products with blocks of dense indicator matrices (could be
+          the fastest for large neighborhoods with an optimized BLAS).
+          'auto' benchmarks all available engines on a sample of ROIs
+          and chooses the fastest one (see `indexsum_engine` and
+          `indexsum_timings` conditional attributes).
         reuse_neighbors : bool, optional
           Compute neighbors information only once, thus allowing for
           efficient reuse on subsequent calls where dataset's feature
@@ -178,15 +298,12 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
                 indexsum = 'fancy'
         self._indexsum = indexsum
 
-        if not self.nproc in (None, 1):
-            raise NotImplementedError, "For now only nproc=1 (or None for " \
-                  "autodetection) is supported by GNBSearchlight"
-
         self.__pb = None            # statistics per each block/label
         self.__reuse_neighbors = reuse_neighbors
 
         # Storage to be used for neighborhood information
         self.__roi_fids = None
+        self.__indexsum_engine = None
 
     def __repr__(self, prefixes=[]):
         return super(SimpleStatBaseSearchlight, self).__repr__(
@@ -292,7 +409,6 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
         # Local bindings
         generator = self.generator
         qe = self.queryengine
-        errorfx = self.errorfx
 
         if __debug__:
             time_start = time.time()
@@ -452,8 +568,18 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
         self.ca.roi_sizes = roi_sizes
 
         indexsum = self._indexsum
+        reused = self.reuse_neighbors and self.__roi_fids is not None
+        if indexsum == 'auto':
+            if reused:
+                indexsum = self.__indexsum_engine
+            else:
+                indexsum = self._select_indexsum(
+                    roi_fids, (nlabels, max(1, nsamples // max(1, nsplits)),
+                               dataset.nfeatures),
+                    nsplits)
+                self.__indexsum_engine = indexsum
         if indexsum == 'sparse':
-            if not self.reuse_neighbors or self.__roi_fids is None:
+            if not reused:
                 if __debug__:
                     debug('SLC',
                           'Phase 4b. Converting neighbors to sparse matrix '
@@ -462,12 +588,11 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
                 # 1s only at the roi_fids[j] indices
                 roi_fids = inds_to_coo(roi_fids,
                                        shape=(dataset.nfeatures, nroi_fids))
-            indexsum_fx = lastdim_columnsums_spmatrix
-        elif indexsum == 'fancy':
-            indexsum_fx = lastdim_columnsums_fancy_indexing
-        else:
+        elif not indexsum in _INDEXSUM_FX:
             raise ValueError, \
                   "Do not know how to deal with indexsum=%s" % indexsum
+        indexsum_fx = _INDEXSUM_FX[indexsum]
+        self.ca.indexsum_engine = indexsum
 
         # Store roi_fids
         if self.reuse_neighbors and self.__roi_fids is None:
@@ -478,42 +603,29 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
             debug('SLC', 'Phase 5. Major loop' )
 
 
-        for isplit, split in enumerate(splits):
-            if __debug__:
-                debug('SLC', ' Split %i out of %i' % (isplit, nsplits))
-            # figure out for a given splits the blocks we want to work
-            # with
-            # sample_indicies
-            training_sis = split[0].samples[:, 0]
-            testing_sis = split[1].samples[:, 0]
-
-            # That is the GNB specificity
-            targets, predictions = self._sl_call_on_a_split(
-                split, X,               # X2 might light to go
-                training_sis, testing_sis,
-                ## training_nsamples,      # GO? == np.sum(pl.nsamples)
-                ## training_non0labels,
-                ## pl.sums, pl.means, pl.sums2, pl.variances,
-                # passing nroi_fids as well since in 'sparse' way it has no 'length'
-                nroi_fids, roi_fids,
-                indexsum_fx,
-                labels_numeric,
-                )
-
-            # assess the errors
+        split_args = (X, nroi_fids, roi_fids, indexsum_fx, labels_numeric)
+        # splits are processed in parallel only if explicitly asked for,
+        # since nproc=None resolves to all available cores
+        if self.nproc is not None and nproc > 1 and nsplits > 1:
+            # splits are independent, so they could be processed in
+            # parallel, each one with its own storage for the statistics
+            nproc_needed = min(nproc, nsplits)
             if __debug__:
-                debug('SLC', "  Assessing accuracies")
-
-            if errorfx is mean_mismatch_error:
-                results[isplit, :] = \
-                    (predictions != targets[:, None]).sum(axis=0) \
-                    / float(len(targets))
-            else:
-                # somewhat silly but a way which allows to use pre-crafted
-                # error functions without a chance to screw up
-                for i, fpredictions in enumerate(predictions.T):
-                    results[isplit, i] = errorfx(fpredictions, targets)
+                debug('SLC', ' Processing %i splits using %i processes'
+                      % (nsplits, nproc_needed))
+            tasks = [((isplit, split) + split_args,
+                      dict(pl_stats_shape=(nlabels, ) + s_shape))
+                     for isplit, split in enumerate(splits)]
+            split_results = parallel_map(self._proc_split, tasks,
+                                         nproc=nproc_needed,
+                                         backend=self.backend, ordered=False)
+        else:
+            split_results = (self._proc_split(isplit, split, *split_args)
+                             for isplit, split in enumerate(splits))
 
+        # reduce errors of all the splits
+        for isplit, errors in split_results:
+            results[isplit, :] = errors
 
         if __debug__:
             debug('SLC', "%s._call() is done in %.3g sec" %
@@ -521,6 +633,95 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
 
         return Dataset(results)
 
+    def _select_indexsum(self, roi_fids, shape, ncalls):
+        """Benchmark available engines to compute sums over ROIs
+
+        Parameters
+        ----------
+        roi_fids : list
+          Indices of features for each ROI.
+        shape : tuple
+          Shape of the data to sum over in a single split.
+        ncalls : int
+          How many times sums will be computed.
+
+        Returns
+        -------
+        str
+          Name of the fastest engine.
+        """
+        indexsums = ['fancy', 'dense']
+        if externals.exists('scipy'):
+            indexsums.append('sparse')
+        # values do not matter, so no need to consume random numbers
+        a = np.ones(shape)
+        timings = _benchmark_indexsum(a, roi_fids, ncalls, indexsums,
+                                      nsample=self._indexsum_nsample)
+        indexsum = min(indexsums, key=timings.get)
+        if __debug__:
+            debug('SLC', "Phase 4b. Chose indexsum=%r based on estimated "
+                  "timings %s" % (indexsum, timings))
+        self.ca.indexsum_timings = timings
+        return indexsum
+
+    _indexsum_nsample = 100
+    """Number of ROIs (and twice as many) to benchmark indexsum engines on"""
+
+    def _proc_split(self, isplit, split, X, nroi_fids, roi_fids, indexsum_fx,
+                    labels_numeric, pl_stats_shape=None):
+        """Compute errors of all ROIs for a single split
+
+        Parameters
+        ----------
+        pl_stats_shape : tuple, optional
+          If provided, the split is processed by a shallow copy of the
+          searchlight with its own storage of the per-label statistics of
+          that shape, so multiple splits could be processed concurrently.
+
+        Returns
+        -------
+        isplit, errors
+        """
+        if __debug__:
+            debug('SLC', ' Split %i' % isplit)
+        sl = self
+        if pl_stats_shape is not None:
+            sl = copy.copy(self)
+            sl._reserve_pl_stats_space(pl_stats_shape)
+        # figure out for a given splits the blocks we want to work
+        # with
+        # sample_indicies
+        training_sis = split[0].samples[:, 0]
+        testing_sis = split[1].samples[:, 0]
+
+        # That is the GNB specificity
+        targets, predictions = sl._sl_call_on_a_split(
+            split, X,               # X2 might light to go
+            training_sis, testing_sis,
+            ## training_nsamples,      # GO? == np.sum(pl.nsamples)
+            ## training_non0labels,
+            ## pl.sums, pl.means, pl.sums2, pl.variances,
+            # passing nroi_fids as well since in 'sparse' way it has no 'length'
+            nroi_fids, roi_fids,
+            indexsum_fx,
+            labels_numeric,
+            )
+
+        # assess the errors
+        if __debug__:
+            debug('SLC', "  Assessing accuracies")
+
+        errorfx = self.errorfx
+        if errorfx is mean_mismatch_error:
+            errors = (predictions != targets[:, None]).sum(axis=0) \
+                     / float(len(targets))
+        else:
+            # somewhat silly but a way which allows to use pre-crafted
+            # error functions without a chance to screw up
+            errors = np.array([errorfx(fpredictions, targets)
+                               for fpredictions in predictions.T])
+        return isplit, errors
+
     generator = property(fget=lambda self: self._generator)
     errorfx = property(fget=lambda self: self._errorfx)
     indexsum = property(fget=lambda self: self._indexsum)
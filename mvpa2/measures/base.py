@@ -37,6 +37,7 @@ from mvpa2.base.dataset import AttrDataset, vstack
 from mvpa2.datasets import Dataset, vstack, hstack
 from mvpa2.mappers.fx import BinaryFxNode
 from mvpa2.generators.splitters import Splitter
+from mvpa2.base.parallel import parallel_map, get_nproc
 
 if __debug__:
     from mvpa2.base import debug
@@ -176,6 +177,54 @@ class Measure(Learner):
         return result
 
 
+    def call_batch(self, samples, mask, dataset):
+        """Compute the measure for multiple ROIs at once
+
+        Only measures for which `is_batchable` is True support it.  No
+        training, post-processing, or estimation of the NULL distribution
+        is done, and no conditional attributes are assigned.
+
+        Parameters
+        ----------
+        samples : ndarray
+          Samples of all ROIs in an array of shape (nsamples, nrois,
+          maxfeatures), with the ROIs having less than `maxfeatures`
+          features padded with zeros.
+        mask : ndarray
+          Boolean array of shape (nrois, maxfeatures) marking the actual
+          (not padded) features of every ROI.
+        dataset : Dataset
+          Original dataset (e.g. for the sample attributes).
+
+        Returns
+        -------
+        Dataset
+          The same results as a `hstack` of the results of calling the
+          measure on every ROI would provide, i.e. with the same number of
+          features per ROI and the features of the i-th ROI being
+          contiguous.
+        """
+        return self._call_batch(samples, mask, dataset)
+
+
+    def _call_batch(self, samples, mask, dataset):
+        raise NotImplementedError
+
+
+    def _is_batchable(self):
+        """Either `_call_batch` supports current parameters of the measure"""
+        return False
+
+
+    @property
+    def is_batchable(self):
+        """Either the measure could be computed for multiple ROIs at once"""
+        return self._is_batchable() and self.is_trained \
+               and self.__null_dist is None \
+               and self.get_postproc() is None \
+               and self.pass_attr is None
+
+
     @property
     def null_dist(self):
         """Return Null Distribution estimator"""
@@ -259,6 +308,8 @@ class RepeatedMeasure(Measure):
                  generator,
                  callback=None,
                  concat_as='samples',
+                 nproc=1,
+                 backend=None,
                  **kwargs):
         """
         Parameters
@@ -280,6 +331,18 @@ class RepeatedMeasure(Measure):
           By default, results are 'vstacked' as multiple samples in the output
           dataset. Setting this argument to 'features' will change this to
           'hstacking' along the feature axis.
+        nproc : None or int
+          How many processes to use for running repetitions (e.g.
+          cross-validation folds) concurrently.  Each repetition is then
+          carried out by a deep copy of the `node`, so the `node` itself
+          remains untouched.  Callback, post-processing and merging of the
+          results and `stats` are still done in the order of the
+          repetitions, so the output does not depend on `nproc`.  None
+          -- use all available cores.
+        backend : None or str
+          Parallelization backend (see :mod:`~mvpa2.base.parallel`).  With
+          process-based backends the `node` (and its results) must be
+          picklable.
         """
         Measure.__init__(self, **kwargs)
 
@@ -287,6 +350,8 @@ class RepeatedMeasure(Measure):
         self._generator = generator
         self._callback = callback
         self._concat_as = concat_as
+        self._nproc = nproc
+        self._backend = backend
 
     def __repr__(self, prefixes=[], exclude=[]):
         return super(RepeatedMeasure, self).__repr__(
@@ -294,6 +359,8 @@ class RepeatedMeasure(Measure):
             + _repr_attrs(self, [x for x in ['node', 'generator', 'callback']
                                  if not x in exclude])
             + _repr_attrs(self, ['concat_as'], default='samples')
+            + _repr_attrs(self, ['nproc'], default=1)
+            + _repr_attrs(self, ['backend'])
             )
 
 
@@ -315,15 +382,20 @@ class RepeatedMeasure(Measure):
 
         # run the node an all generated datasets
         results = []
-        for i, sds in enumerate(generator.generate(ds)):
+        nproc = get_nproc(self._nproc, self._backend)
+        if nproc > 1:
+            repetitions = self._parallel_repetitions(generator.generate(ds),
+                                                     nproc)
+        else:
+            repetitions = ((sds, node, node(sds))
+                           for sds in generator.generate(ds))
+        for i, (sds, node, result) in enumerate(repetitions):
             if __debug__:
                 debug('REPM', "%d-th iteration of %s on %s",
                       (i, self, sds))
             if ca.is_enabled("datasets"):
                 # store dataset in ca
                 ca.datasets.append(sds)
-            # run the beast
-            result = node(sds)
             # callback
             if not self._callback is None:
                 self._callback(data=sds, node=node, result=result)
@@ -361,6 +433,32 @@ class RepeatedMeasure(Measure):
         return results
 
 
+    def _parallel_repetitions(self, dss, nproc):
+        """Run the node on all datasets concurrently
+
+        Returns
+        -------
+        generator
+          (dataset, node, result) for each dataset in the original order,
+          where node is the copy of the node which produced the result.
+        """
+        dss = list(dss)
+        if __debug__:
+            debug('REPM', "Running %d repetitions of %s using %d processes",
+                  (len(dss), self, nproc))
+        tasks = [((sds,), {}) for sds in dss]
+        for sds, (node, result) in zip(
+                dss, parallel_map(self._proc_repetition, tasks,
+                                  nproc=nproc, backend=self._backend)):
+            yield sds, node, result
+
+
+    def _proc_repetition(self, ds):
+        """Run a copy of the node on a single dataset"""
+        node = copy.deepcopy(self._node)
+        return node, node(ds)
+
+
     def _repetition_postcall(self, ds, node, result):
         """Post-processing handler for each repetition.
 
@@ -393,6 +491,8 @@ class RepeatedMeasure(Measure):
     generator = property(fget=lambda self: self._generator)
     callback = property(fget=lambda self: self._callback)
     concat_as = property(fget=lambda self: self._concat_as)
+    nproc = property(fget=lambda self: self._nproc)
+    backend = property(fget=lambda self: self._backend)
 
 
 class CrossValidation(RepeatedMeasure):
@@ -21,6 +21,59 @@ from mvpa2.base.constraints import EnsureChoice
 if externals.exists('scipy', raise_=True):
     from scipy.spatial.distance import pdist, squareform
     from scipy.stats import rankdata, pearsonr
+    from scipy.special import betainc
+
+
+# pairwise metrics supported by _batch_pdist
+_batch_metrics = ('correlation', 'cosine', 'euclidean', 'sqeuclidean')
+
+def _batch_pdist(samples, mask, metric, center_data=False, square=False):
+    """Pairwise distances between samples within multiple ROIs at once
+
+    Parameters
+    ----------
+    samples : ndarray
+      (nsamples, nrois, maxfeatures) array with padded features being 0.
+    mask : ndarray
+      (nrois, maxfeatures) boolean array of actual features.
+    metric : str
+      One of `_batch_metrics`.
+    center_data : bool
+      Either to center each feature first.
+    square : bool
+      Either to return square matrices instead of upper triangles.
+
+    Returns
+    -------
+    ndarray
+      (nrois, npairs) or (nrois, nsamples, nsamples) if square.
+    """
+    x = samples.astype(float)
+    if center_data:
+        # padded features remain 0
+        x = x - x.mean(axis=0)
+    if metric == 'correlation':
+        # center every sample across the features of each ROI
+        x = x - (x.sum(axis=2) / mask.sum(axis=1))[..., None]
+        x *= mask
+    # (nrois, nsamples, nsamples) dot products
+    dots = np.einsum('ibf,jbf->bij', x, x)
+    sqnorms = np.einsum('bii->bi', dots)
+    if metric in ('correlation', 'cosine'):
+        norms = np.sqrt(sqnorms)
+        dists = 1.0 - dots / (norms[:, :, None] * norms[:, None, :])
+    else:
+        dists = np.clip(sqnorms[:, :, None] + sqnorms[:, None, :] - 2 * dots,
+                        0, np.inf)
+        if metric == 'euclidean':
+            dists = np.sqrt(dists)
+    nsamples = samples.shape[0]
+    diag = np.arange(nsamples)
+    dists[:, diag, diag] = 0
+    if square:
+        return dists
+    return dists[(slice(None),) + np.triu_indices(nsamples, 1)]
+
 
 class PDist(Measure):
     """Compute dissimiliarity matrix for samples in a dataset
@@ -81,6 +134,19 @@ class PDist(Measure):
                           sa=dict(pairs=list(combinations(range(len(ds)), 2))))
         return out
 
+    def _is_batchable(self):
+        return self.params.pairwise_metric in _batch_metrics
+
+    def _call_batch(self, samples, mask, ds):
+        dsms = _batch_pdist(samples, mask, self.params.pairwise_metric,
+                            center_data=self.params.center_data,
+                            square=self.params.square)
+        if self.params.square:
+            return Dataset(
+                dsms.transpose((1, 0, 2)).reshape((len(ds), -1)), sa=ds.sa)
+        return Dataset(dsms.T,
+                       sa=dict(pairs=list(combinations(range(len(ds)), 2))))
+
 
 class PDistConsistency(Measure):
     """Calculate the correlations of PDist measures across chunks
@@ -230,3 +296,29 @@ class PDistTargetSimilarity(Measure):
             return Dataset([rho], fa={'metrics': ['rho']})
         else:
             return Dataset([[rho,p]], fa={'metrics': ['rho', 'p']})
+
+    def _is_batchable(self):
+        # ranking with ties is not vectorized
+        return self.params.pairwise_metric in _batch_metrics \
+               and self.params.comparison_metric == 'pearson'
+
+    def _call_batch(self, samples, mask, dataset):
+        dsms = _batch_pdist(samples, mask, self.params.pairwise_metric,
+                            center_data=self.params.center_data)
+        # Pearson correlation of every DSM with the target, with the
+        # p-value computed as in scipy.stats.pearsonr
+        target = np.asanyarray(self.target_dsm, dtype=float)
+        target = target - target.mean()
+        dsms = dsms - dsms.mean(axis=1)[:, None]
+        rho = np.dot(dsms, target) \
+              / np.sqrt(np.sum(dsms ** 2, axis=1) * np.sum(target ** 2))
+        rho = np.clip(rho, -1.0, 1.0)
+        if self.params.corrcoef_only:
+            return Dataset(rho[None], fa={'metrics': ['rho'] * len(rho)})
+        df = len(target) - 2
+        with np.errstate(divide='ignore'):
+            t_squared = rho ** 2 * (df / ((1.0 - rho) * (1.0 + rho)))
+        p = betainc(0.5 * df, 0.5, df / (df + t_squared))
+        p[np.abs(rho) == 1.0] = 0.0
+        return Dataset(np.array([rho, p]).T.reshape((1, -1)),
+                       fa={'metrics': ['rho', 'p'] * len(rho)})
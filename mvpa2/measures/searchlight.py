@@ -15,7 +15,13 @@ if __debug__:
 
 import numpy as np
 import tempfile, os
+import re
+import shutil
+import hashlib
+import json
 import time
+import threading
+import multiprocessing
 
 import mvpa2
 from mvpa2.base import externals, warning
@@ -23,6 +29,8 @@ from mvpa2.base.types import is_datasetlike
 from mvpa2.base.dochelpers import borrowkwargs, _repr_attrs
 from mvpa2.base.types import is_datasetlike
 from mvpa2.base.progress import ProgressBar
+from mvpa2.base.parallel import get_backend, get_nproc, parallel_map, \
+     share_dataset
 if externals.exists('h5py'):
     # Is optionally required for passing searchlight
     # results via storing/reloading hdf5 files
@@ -36,6 +44,143 @@ from mvpa2.base.state import ConditionalAttribute
 from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere
 from mvpa2.mappers.base import ChainMapper
 
+class _StreamingHStack(object):
+    """Incrementally hstack datasets into preallocated arrays
+
+    Every added dataset provides the results for `nunits` consecutive
+    units (e.g. searchlight ROIs) starting at unit `iunit`.  Datasets could
+    be added in arbitrary order and are copied right away into
+    preallocated samples and feature attributes arrays, so there is no
+    need to keep them all around until the final hstack.  If the number of
+    features per unit is not constant, it falls back to collecting the
+    datasets for a regular `hstack`.
+
+    As in `hstack`, sample attributes are merged (with values of later
+    units taking precedence) and no dataset attributes are preserved.
+    """
+    def __init__(self, nunits):
+        self._nunits = nunits
+        self._nfpu = None               # number of features per unit
+        self._samples = None
+        self._fa = None
+        self._dtypes = {}               # original non-numeric dtypes
+        self._sa = {}
+        self._sa_iunit = -1
+        self._cls = None
+        self._added = []                # (iunit, nunits) stored in arrays
+        self._pieces = None             # fallback storage: iunit -> dataset
+
+
+    def _allocate(self, ds, nunits):
+        """Allocate storage based on the first added dataset"""
+        if ds.nfeatures % nunits:
+            self._pieces = {}
+            return
+        self._nfpu = nfpu = ds.nfeatures // nunits
+        nfeatures = self._nunits * nfpu
+        self._samples = self._empty(ds.samples, nfeatures, 'samples', axis=1)
+        self._fa = dict([(k, self._empty(v.value, nfeatures, k, axis=0))
+                         for k, v in ds.fa.iteritems()])
+
+
+    def _empty(self, value, length, key, axis):
+        """Allocate an array for `value` with `length` along `axis`"""
+        value = np.asanyarray(value)
+        shape = list(value.shape)
+        shape[axis] = length
+        dtype = value.dtype
+        if not dtype.kind in 'biufc':
+            # to not truncate strings etc
+            self._dtypes[key] = dtype
+            dtype = object
+        return np.empty(tuple(shape), dtype=dtype)
+
+
+    @staticmethod
+    def _store(target, start, stop, value, axis):
+        """Store value into target, upcasting target if necessary"""
+        value = np.asanyarray(value)
+        if target.dtype != object and \
+               not np.can_cast(value.dtype, target.dtype):
+            target = target.astype(np.result_type(target, value))
+        if axis == 0:
+            target[start:stop] = value
+        else:
+            target[:, start:stop] = value
+        return target
+
+
+    def _restore(self, value, key):
+        """Restore original non-numeric dtype"""
+        dtype = self._dtypes.get(key)
+        if dtype is None or dtype.kind == 'O':
+            return value
+        return np.array(value.tolist())
+
+
+    def _switch_to_pieces(self):
+        """Fall back to storing datasets for a regular hstack"""
+        self._pieces = {}
+        nfpu = self._nfpu
+        for iunit, nunits in self._added:
+            start, stop = iunit * nfpu, (iunit + nunits) * nfpu
+            self._pieces[iunit] = self._cls(
+                self._restore(self._samples[:, start:stop], 'samples'),
+                fa=dict([(k, self._restore(v[start:stop], k))
+                         for k, v in self._fa.iteritems()]))
+        self._samples = self._fa = None
+
+
+    def add(self, ds, iunit, nunits=1):
+        """Add results for `nunits` units starting at `iunit`"""
+        # merge sample attributes
+        for k, v in ds.sa.iteritems():
+            if iunit >= self._sa_iunit or not k in self._sa:
+                self._sa[k] = v.value
+        self._sa_iunit = max(iunit, self._sa_iunit)
+
+        if self._cls is None:
+            self._cls = ds.__class__
+            self._allocate(ds, nunits)
+        elif self._pieces is None \
+                 and (ds.nfeatures != nunits * self._nfpu
+                      or len(ds) != len(self._samples)):
+            self._switch_to_pieces()
+
+        if self._pieces is not None:
+            self._pieces[iunit] = ds
+            return
+
+        if __debug__ and not sorted(ds.fa.keys()) == sorted(self._fa.keys()):
+            raise ValueError("Feature attributes collections of to be "
+                             "stacked datasets have varying attributes.")
+        start, stop = iunit * self._nfpu, (iunit + nunits) * self._nfpu
+        self._samples = self._store(self._samples, start, stop, ds.samples,
+                                    axis=1)
+        for k, v in ds.fa.iteritems():
+            self._fa[k] = self._store(self._fa[k], start, stop, v.value,
+                                      axis=0)
+        self._added.append((iunit, nunits))
+
+
+    def get(self):
+        """Return the stacked dataset"""
+        if self._cls is None:
+            return None
+        if self._pieces is not None:
+            pieces = [self._pieces[i] for i in sorted(self._pieces)]
+            for p in pieces:
+                # sample attributes are merged separately
+                p.sa.clear()
+            res = hstack(pieces)
+        else:
+            res = self._cls(self._restore(self._samples, 'samples'),
+                            fa=dict([(k, self._restore(v, k))
+                                     for k, v in self._fa.iteritems()]))
+        res.sa.update(self._sa)
+        return res
+
+
 class BaseSearchlight(Measure):
     """Base class for searchlights.
 
@@ -56,7 +201,7 @@ class BaseSearchlight(Measure):
     """Indicate that this measure is always trained."""
 
 
-    def __init__(self, queryengine, roi_ids=None, nproc=None,
+    def __init__(self, queryengine, roi_ids=None, nproc=None, backend=None,
                  **kwargs):
         """
         Parameters
@@ -70,20 +215,29 @@ class BaseSearchlight(Measure):
           feature attribute of the input dataset, whose non-zero values
           determine the feature ids. By default all features will be used.
         nproc : None or int
-          How many processes to use for computation.  Requires `pprocess`
-          external module.  If None -- all available cores will be used.
+          How many processes to use for computation.  If None -- all
+          available cores will be used (or as specified in the
+          configuration, see :mod:`~mvpa2.base.parallel`).
+        backend : None or {'auto', 'multiprocessing', 'threads', 'pprocess', 'serial'}
+          Which parallelization backend to use whenever nproc > 1.
+          'threads' is beneficial only for measures releasing the GIL.
+          If None -- the one specified in the configuration is used
+          (defaults to 'auto').  See :mod:`~mvpa2.base.parallel`.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa2.measures.base.Measure`.
       """
         Measure.__init__(self, **kwargs)
 
-        if nproc is not None and nproc > 1 and not externals.exists('pprocess'):
+        if nproc is not None and nproc > 1 \
+                and get_backend(backend) == 'pprocess' \
+                and not externals.exists('pprocess'):
             raise RuntimeError("The 'pprocess' module is required for "
-                               "multiprocess searchlights. Please either "
-                               "install python-pprocess, or reduce `nproc` "
-                               "to 1 (got nproc=%i) or set to default None"
-                               % nproc)
+                               "multiprocess searchlights with 'pprocess' "
+                               "backend. Please either install "
+                               "python-pprocess, choose another backend, "
+                               "or reduce `nproc` to 1 (got nproc=%i) or "
+                               "set to default None" % nproc)
 
         self._queryengine = queryengine
         if roi_ids is not None and not isinstance(roi_ids, str) \
@@ -92,6 +246,7 @@ class BaseSearchlight(Measure):
                   "Cannot run searchlight on an empty list of roi_ids"
         self.__roi_ids = roi_ids
         self.nproc = nproc
+        self.backend = backend
 
 
     def __repr__(self, prefixes=[]):
@@ -101,24 +256,14 @@ class BaseSearchlight(Measure):
         """
         return super(BaseSearchlight, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc']))
+            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc',
+                                 'backend']))
 
 
     def _call(self, dataset):
         """Perform the ROI search.
         """
-        # local binding
-        nproc = self.nproc
-
-        if nproc is None and externals.exists('pprocess'):
-            import pprocess
-            try:
-                nproc = pprocess.get_number_of_cores() or 1
-            except AttributeError:
-                warning("pprocess version %s has no API to figure out maximal "
-                        "number of cores. Using 1"
-                        % externals.versions['pprocess'])
-                nproc = 1
+        nproc = get_nproc(self.nproc, self.backend)
         # train the queryengine
         self._queryengine.train(dataset)
 
@@ -192,6 +337,18 @@ class Searchlight(BaseSearchlight):
     interest, which is ran at each spatial location.
     """
 
+    block_timings = ConditionalAttribute(enabled=False,
+        doc="Timing information for each processed block of ROIs: list of "
+            "dicts with 'iblock', 'worker', 'nrois', 'start' and 'duration' "
+            "(in seconds) entries. Allows to verify load balancing across "
+            "workers.")
+
+    _nblocks_per_proc = 10
+    """Number of blocks per process for 'dynamic' and 'balanced' schedules"""
+
+    _batch_nelements = 2 ** 22
+    """Maximal number of elements in padded samples of a batch of ROIs"""
+
     @staticmethod
     def _concat_results(sl=None, dataset=None, roi_ids=None, results=None):
         """The simplest implementation for collecting the results --
@@ -227,6 +384,62 @@ class Searchlight(BaseSearchlight):
         if sl.ca.is_enabled('roi_center_ids'):
             sl.ca.roi_center_ids = [r.a.roi_center_ids for r in results]
 
+        return Searchlight._finalize_results(result_ds, dataset, roi_ids)
+
+    @staticmethod
+    def _stream_results(sl=None, dataset=None, roi_ids=None, results=None):
+        """Assemble results of all blocks incrementally
+
+        Default way to collect the results whenever neither custom
+        `results_fx` nor `results_postproc_fx` were provided.  Each block
+        provides a single dataset with the results of all its ROIs (see
+        `Searchlight._proc_block`) which gets copied into the preallocated
+        output right upon arrival.
+        """
+        nrois = len(roi_ids)
+        sink = _StreamingHStack(nrois)
+        store_roi_feature_ids = sl.ca.is_enabled('roi_feature_ids')
+        store_roi_sizes = sl.ca.is_enabled('roi_sizes')
+        store_roi_center_ids = sl.ca.is_enabled('roi_center_ids')
+        roi_feature_ids = [None] * nrois
+        roi_sizes = np.zeros(nrois, dtype=int)
+        roi_center_ids = [None] * nrois
+
+        for block_ds in results:
+            offset = block_ds.a.roi_offset
+            nblock = block_ds.a.roi_nrois
+            if __debug__:
+                debug('SLC', " storing results for %d ROIs at offset %d"
+                      % (nblock, offset))
+            block_slice = slice(offset, offset + nblock)
+            if store_roi_feature_ids:
+                roi_feature_ids[block_slice] = block_ds.a.roi_feature_ids
+            if store_roi_sizes:
+                roi_sizes[block_slice] = block_ds.a.roi_sizes
+            if store_roi_center_ids:
+                roi_center_ids[block_slice] = block_ds.a.roi_center_ids
+            block_ds.a.clear()
+            sink.add(block_ds, offset, nblock)
+            del block_ds
+
+        result_ds = sink.get()
+
+        if __debug__:
+            debug('SLC', " assembled results of shape %s" % (result_ds.shape,))
+
+        if store_roi_feature_ids:
+            sl.ca.roi_feature_ids = roi_feature_ids
+        if store_roi_sizes:
+            sl.ca.roi_sizes = list(roi_sizes)
+        if store_roi_center_ids:
+            sl.ca.roi_center_ids = roi_center_ids
+
+        return Searchlight._finalize_results(result_ds, dataset, roi_ids)
+
+    @staticmethod
+    def _finalize_results(result_ds, dataset, roi_ids):
+        """Assign the mapper and center ids to the results dataset
+        """
         if 'mapper' in dataset.a:
             # since we know the space we can stick the original mapper into the
             # results as well
@@ -260,13 +473,20 @@ class Searchlight(BaseSearchlight):
                  results_fx=None,
                  tmp_prefix='tmpsl',
                  nblocks=None,
+                 schedule='dynamic',
+                 share_dataset=False,
+                 checkpoint_dir=None,
                  **kwargs):
         """
         Parameters
         ----------
         datameasure : callable
           Any object that takes a :class:`~mvpa2.datasets.base.Dataset`
-          and returns some measure when called.
+          and returns some measure when called.  If it is a
+          :class:`~mvpa2.measures.base.Measure` which `is_batchable`, it
+          gets called on batches of ROIs at once (see
+          :meth:`~mvpa2.measures.base.Measure.call_batch`), unless
+          `add_center_fa` is requested.
         add_center_fa : bool or str
           If True or a string, each searchlight ROI dataset will have a boolean
           vector as a feature attribute that indicates the feature that is the
@@ -280,21 +500,51 @@ class Searchlight(BaseSearchlight):
         results_backend : ('native', 'hdf5'), optional
           Specifies the way results are provided back from a processing block
           in case of nproc > 1. 'native' is pickling/unpickling of results by
-          pprocess, while 'hdf5' would use h5save/h5load functionality.
+          the parallelization backend, while 'hdf5' would use h5save/h5load functionality.
           'hdf5' might be more time and memory efficient in some cases.
         results_fx : callable, optional
           Function to process/combine results of each searchlight
-          block run.  By default it would simply append them all into
-          the list.  It receives as keyword arguments sl, dataset,
-          roi_ids, and results (iterable of lists).  It is the one to take
-          care of assigning roi_* ca's
+          block run.  By default (and if no `results_postproc_fx` was
+          provided) results of each ROI are copied right away into the
+          preallocated output dataset.  It receives as keyword arguments
+          sl, dataset, roi_ids, and results (iterable of lists of results
+          per each ROI).  It is the one to take care of assigning roi_* ca's
         tmp_prefix : str, optional
           If specified -- serves as a prefix for temporary files storage
           if results_backend == 'hdf5'.  Thus can specify the directory to use
           (trailing file path separator is not added automagically).
         nblocks : None or int
           Into how many blocks to split the computation (could be larger than
-          nproc).  If None -- nproc is used.
+          nproc).  If None -- nproc is used for the 'static' schedule, and
+          10 blocks per process for the others.
+        schedule : {'static', 'dynamic', 'balanced'}, optional
+          How ROIs get distributed among the processes in case of nproc > 1.
+          'static' splits them into `nblocks` equally sized blocks.
+          'dynamic' does the same but with a larger number of smaller
+          blocks, so they are handed out to the processes as those
+          become available.  'balanced' splits ROIs into blocks of
+          approximately equal total number of features (queries all
+          ROIs first to figure out their sizes) which are also handed
+          out dynamically.
+        share_dataset : bool or str, optional
+          If True, samples and numeric attributes of the dataset are placed
+          into shared memory (memory-mapped files in /dev/shm if available)
+          once for all the workers in case of nproc > 1, instead of each
+          worker relying on its own (copy-on-write or pickled) copy.  If a
+          string -- specifies the directory where to create the files
+          (see :func:`~mvpa2.base.parallel.share_dataset`).
+        checkpoint_dir : None or str, optional
+          If specified, results of every completed block of ROIs are stored
+          (in HDF5 format) within this directory along with a manifest
+          describing the computation.  If the searchlight gets interrupted,
+          invoking it again on the same dataset with the same query engine,
+          measure, and checkpoint directory computes only the ROIs which
+          are not stored yet.  Checkpoints of a different computation are
+          refused (ValueError), as identified by the data, and `repr()` of
+          the query engine and of the measure.  Checkpoints are removed
+          upon successful completion.
+          Granularity of checkpointing is a block (see `nblocks`), and
+          blocks are used even with nproc == 1.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa2.measures.searchlight.BaseSearchlight`.
@@ -310,6 +560,14 @@ class Searchlight(BaseSearchlight):
                           if results_fx is None else results_fx
         self.tmp_prefix = tmp_prefix
         self.nblocks = nblocks
+        if not schedule in ('static', 'dynamic', 'balanced'):
+            raise ValueError("Unknown schedule %r. Known are 'static', "
+                             "'dynamic', 'balanced'" % (schedule,))
+        self.schedule = schedule
+        self.share_dataset = share_dataset
+        if checkpoint_dir is not None:
+            externals.exists('h5py', raise_=True)
+        self.checkpoint_dir = checkpoint_dir
         if isinstance(add_center_fa, str):
             self.__add_center_fa = add_center_fa
         elif add_center_fa:
@@ -325,6 +583,9 @@ class Searchlight(BaseSearchlight):
             + _repr_attrs(self, ['results_postproc_fx'])
             + _repr_attrs(self, ['results_backend'], default='native')
             + _repr_attrs(self, ['results_fx', 'nblocks'])
+            + _repr_attrs(self, ['schedule'], default='dynamic')
+            + _repr_attrs(self, ['share_dataset'], default=False)
+            + _repr_attrs(self, ['checkpoint_dir'])
             )
 
 
@@ -332,43 +593,84 @@ class Searchlight(BaseSearchlight):
         """Classical generic searchlight implementation
         """
         assert(self.results_backend in ('native', 'hdf5'))
+        shared_tmpdir = None
+        checkpointed = {}
+        if self.checkpoint_dir is not None:
+            checkpointed = self._checkpoint_prepare(dataset, roi_ids)
         # compute
-        if nproc is not None and nproc > 1:
-            # split all target ROIs centers into `nproc` equally sized blocks
-            nproc_needed = min(len(roi_ids), nproc)
-            nblocks = nproc_needed \
-                      if self.nblocks is None else self.nblocks
-            roi_blocks = np.array_split(roi_ids, nblocks)
-
-            # the next block sets up the infrastructure for parallel computing
-            # this can easily be changed into a ParallelPython loop, if we
-            # decide to have a PP job server in PyMVPA
-            import pprocess
-            p_results = pprocess.Map(limit=nproc_needed)
+        if (nproc is not None and nproc > 1) \
+                or self.checkpoint_dir is not None:
+            # positions (among roi_ids) of the ROIs still to be computed
+            todo = np.ones(len(roi_ids), dtype=bool)
+            for offset, (nblock, filename) in checkpointed.iteritems():
+                todo[offset:offset + nblock] = False
+            todo = np.where(todo)[0]
+            nproc_needed = max(1, min(len(todo), nproc or 1))
+            roi_blocks = []
+            if len(todo):
+                roi_blocks = self._get_roi_blocks(
+                    np.asanyarray(roi_ids)[todo], nproc_needed)
+            # blocks of positions.  Checkpointed ROIs could leave gaps, so
+            # split further to keep every block contiguous
+            pos_blocks = []
+            for pos in np.split(todo, np.cumsum([len(b)
+                                                 for b in roi_blocks])[:-1]):
+                pos_blocks += np.split(pos, np.where(np.diff(pos) != 1)[0] + 1)
+            if __debug__ and checkpointed:
+                debug('SLC', "Resuming from %d checkpointed blocks, %d ROIs "
+                      "left to compute" % (len(checkpointed), len(todo)))
+
+            proc_dataset = dataset
+            if self.share_dataset and nproc_needed > 1:
+                proc_dataset, shared_tmpdir = share_dataset(
+                    dataset,
+                    dirname=self.share_dataset
+                            if isinstance(self.share_dataset, str) else None)
+
             if __debug__:
                 debug('SLC', "Starting off %s child processes for nblocks=%i"
-                      % (nproc_needed, nblocks))
-            compute = p_results.manage(
-                        pprocess.MakeParallel(self._proc_block))
-            for iblock, block in enumerate(roi_blocks):
-                # should we maybe deepcopy the measure to have a unique and
-                # independent one per process?
-                seed = mvpa2.get_random_seed()
-                compute(block, dataset, copy.copy(self.__datameasure),
-                        seed=seed, iblock=iblock)
+                      % (nproc_needed, len(pos_blocks)))
+            # processes get their own copy of the measure upon fork, but
+            # threads share the state, so they need a truly independent one
+            copy_measure = copy.deepcopy \
+                           if get_backend(self.backend) == 'threads' \
+                           else copy.copy
+            roi_ids_ = np.asanyarray(roi_ids)
+            tasks = [((roi_ids_[pos], proc_dataset,
+                       copy_measure(self.__datameasure)),
+                      dict(seed=mvpa2.get_random_seed(), iblock=iblock,
+                           offset=pos[0]))
+                     for iblock, pos in enumerate(pos_blocks)]
+            p_results = parallel_map(self._proc_block_timed, tasks,
+                                     nproc=nproc_needed, backend=self.backend)
         else:
             # otherwise collect the results in an 1-item list
             p_results = [
-                    self._proc_block(roi_ids, dataset, self.__datameasure)]
+                self._proc_block_timed(roi_ids, dataset, self.__datameasure)]
+
+        if self.ca.is_enabled('block_timings'):
+            self.ca.block_timings = []
 
         # Finally collect and possibly process results
-        # p_results here is either a generator from pprocess.Map or a list.
+        # p_results here is either a generator from parallel_map or a list.
         # In case of a generator it allows to process results as they become
         # available
-        result_ds = self.results_fx(sl=self,
-                                    dataset=dataset,
-                                    roi_ids=roi_ids,
-                                    results=self.__handle_all_results(p_results))
+        results_fx = Searchlight._stream_results if self._stream \
+                     else self.results_fx
+        try:
+            result_ds = results_fx(
+                            sl=self,
+                            dataset=dataset,
+                            roi_ids=roi_ids,
+                            results=self.__handle_all_results(
+                                p_results, checkpointed))
+        finally:
+            if shared_tmpdir is not None:
+                shutil.rmtree(shared_tmpdir, ignore_errors=True)
+
+        if self.checkpoint_dir is not None:
+            # all done -- checkpoints are no longer needed
+            self._checkpoint_cleanup()
 
         # Assure having a dataset (for paranoid ones)
         if not is_datasetlike(result_ds):
@@ -387,7 +689,68 @@ class Searchlight(BaseSearchlight):
         return result_ds
 
 
-    def _proc_block(self, block, ds, measure, seed=None, iblock='main'):
+    def _get_roi_blocks(self, roi_ids, nproc):
+        """Split ROI centers into blocks according to the schedule
+        """
+        nrois = len(roi_ids)
+        nblocks = self.nblocks
+        if nblocks is None:
+            nblocks = nproc if self.schedule == 'static' \
+                      else nproc * self._nblocks_per_proc
+        nblocks = max(1, min(nblocks, nrois))
+        if self.schedule != 'balanced':
+            return np.array_split(roi_ids, nblocks)
+
+        # split into contiguous blocks of approximately equal cost,
+        # where cost is assessed as the number of features in the ROI
+        costs = np.array([len(self._get_roi_fids(f)) for f in roi_ids],
+                         dtype=float)
+        cumcosts = np.cumsum(costs)
+        splits = np.searchsorted(
+            cumcosts, cumcosts[-1] * np.arange(1, nblocks) / nblocks,
+            side='right')
+        return [b for b in np.split(roi_ids, splits) if len(b)]
+
+
+    def _get_roi_fids(self, f):
+        """Return feature ids of the ROI for center `f`"""
+        roi_specs = self._queryengine[f]
+        if is_datasetlike(roi_specs):
+            assert(len(roi_specs) == 1)
+            return roi_specs.samples[0]
+        return roi_specs
+
+
+    @property
+    def _stream(self):
+        """Either results should be assembled incrementally"""
+        return self.results_fx is Searchlight._concat_results \
+               and self.results_postproc_fx is None
+
+
+    def _proc_block_timed(self, block, ds, measure, seed=None, iblock='main',
+                          offset=0):
+        """Process a block while collecting its timing information
+
+        Returns
+        -------
+        timing : dict
+          Timing information for the block.
+        results
+          Results of `_proc_block`.
+        """
+        worker = '%s/%s' % (multiprocessing.current_process().name,
+                            threading.current_thread().name)
+        start_time = time.time()
+        results = self._proc_block(block, ds, measure, seed=seed,
+                                   iblock=iblock, offset=offset)
+        timing = dict(iblock=iblock, worker=worker, nrois=len(block),
+                      offset=offset, start=start_time, duration=time.time() - start_time)
+        return timing, results
+
+
+    def _proc_block(self, block, ds, measure, seed=None, iblock='main',
+                    offset=0):
         """Little helper to capture the parts of the computation that can be
         parallelized
 
@@ -401,6 +764,11 @@ class Searchlight(BaseSearchlight):
           Critical for generating non-colliding temp filenames in case
           of hdf5 backend.  Otherwise RNGs of different processes might
           collide in their temporary file names leading to problems.
+        offset
+          Position of the first ROI of the block among all ROIs.  Used
+          only if results are assembled incrementally, in which case a
+          single dataset with the results of all ROIs of the block is
+          returned instead of a list of per-ROI results.
         """
         if seed is not None:
             mvpa2.seed(seed)
@@ -418,71 +786,129 @@ class Searchlight(BaseSearchlight):
                               store_roi_sizes,
                               store_roi_center_ids])
 
+        stream = self._stream
+        if stream:
+            nrois = len(block)
+            sink = _StreamingHStack(nrois)
+            roi_feature_ids = [None] * nrois
+            roi_sizes = np.zeros(nrois, dtype=int)
+
         # put rois around all features in the dataset and compute the
         # measure within them
         bar = ProgressBar()
 
-        for i, f in enumerate(block):
-            # retrieve the feature ids of all features in the ROI from the query
-            # engine
-            roi_specs = self._queryengine[f]
-
-            if __debug__ and  debug_slc_:
-                debug('SLC_', 'For %r query returned roi_specs %r'
-                      % (f, roi_specs))
-
-            if is_datasetlike(roi_specs):
-                # TODO: unittest
-                assert(len(roi_specs) == 1)
-                roi_fids = roi_specs.samples[0]
-            else:
-                roi_fids = roi_specs
-
-            # slice the dataset
-            roi = ds[:, roi_fids]
-
-            if is_datasetlike(roi_specs):
-                for n, v in roi_specs.fa.iteritems():
-                    roi.fa[n] = v
-
-            if self.__add_center_fa:
-                # add fa to indicate ROI seed if requested
-                roi_seed = np.zeros(roi.nfeatures, dtype='bool')
-                if f in roi_fids:
-                    roi_seed[roi_fids.index(f)] = True
+        batches = self._get_roi_batches(block, ds, measure)
+        if batches is not None:
+            # compute the measure for multiple ROIs at once
+            for start, stop, batch_fids in batches:
+                nbatch = stop - start
+                sizes = np.array([len(x) for x in batch_fids], dtype=int)
+                mask = np.arange(max(1, sizes.max())) < sizes[:, None]
+                fids = np.zeros(mask.shape, dtype=int)
+                fids[mask] = np.hstack(batch_fids)
+                samples = ds.samples[:, fids]
+                samples[:, ~mask] = 0
+                res = measure.call_batch(samples, mask, ds)
+                if not is_datasetlike(res):
+                    res = Dataset(np.atleast_2d(res))
+                if stream:
+                    sink.add(res, start, nbatch)
+                    if store_roi_feature_ids:
+                        roi_feature_ids[start:stop] = batch_fids
+                    roi_sizes[start:stop] = sizes
                 else:
-                    warning("Center feature attribute id %s not found" % f)
-                roi.fa[self.__add_center_fa] = roi_seed
-
-            # compute the datameasure and store in results
-            res = measure(roi)
-
-            if assure_dataset and not is_datasetlike(res):
-                res = Dataset(np.atleast_1d(res))
-            if store_roi_feature_ids:
-                # add roi feature ids to intermediate result dataset for later
-                # aggregation
-                res.a['roi_feature_ids'] = roi_fids
-            if store_roi_sizes:
-                res.a['roi_sizes'] = roi.nfeatures
-            if store_roi_center_ids:
-                res.a['roi_center_ids'] = f
-            results.append(res)
+                    # split into per-ROI results
+                    nf = res.nfeatures // nbatch
+                    for i in xrange(nbatch):
+                        res_ = res[:, i * nf:(i + 1) * nf]
+                        self._store_roi_info(res_, sizes[i], batch_fids[i],
+                                             block[start + i])
+                        results.append(res_)
+                if __debug__:
+                    msg = 'ROIs %i-%i (%i/%i)' % (start + 1, stop, stop,
+                                                  len(block))
+                    debug('SLC', bar(float(stop) / len(block), msg), cr=True)
+        else:
+            for i, f in enumerate(block):
+                # retrieve the feature ids of all features in the ROI from the query
+                # engine
+                roi_specs = self._queryengine[f]
+
+                if __debug__ and  debug_slc_:
+                    debug('SLC_', 'For %r query returned roi_specs %r'
+                          % (f, roi_specs))
+
+                if is_datasetlike(roi_specs):
+                    # TODO: unittest
+                    assert(len(roi_specs) == 1)
+                    roi_fids = roi_specs.samples[0]
+                else:
+                    roi_fids = roi_specs
+
+                # slice the dataset -- attributes get selected only if the
+                # measure accesses them
+                roi = ds.__getitem__((slice(None), roi_fids), _lazy=True)
+
+                if is_datasetlike(roi_specs):
+                    for n, v in roi_specs.fa.iteritems():
+                        roi.fa[n] = v
+
+                if self.__add_center_fa:
+                    # add fa to indicate ROI seed if requested
+                    roi_seed = np.zeros(roi.nfeatures, dtype='bool')
+                    if f in roi_fids:
+                        roi_seed[list(roi_fids).index(f)] = True
+                    else:
+                        warning("Center feature attribute id %s not found" % f)
+                    roi.fa[self.__add_center_fa] = roi_seed
+
+                # compute the datameasure and store in results
+                res = measure(roi)
+
+                if stream:
+                    if not is_datasetlike(res):
+                        res = np.atleast_1d(res)
+                        if not assure_dataset and res.ndim == 1:
+                            # hstack of plain results would treat them as rows
+                            res = res[None]
+                        res = Dataset(res)
+                    sink.add(res, i)
+                    if store_roi_feature_ids:
+                        roi_feature_ids[i] = roi_fids
+                    roi_sizes[i] = roi.nfeatures
+                else:
+                    if assure_dataset and not is_datasetlike(res):
+                        res = Dataset(np.atleast_1d(res))
+                    self._store_roi_info(res, roi.nfeatures, roi_fids, f)
+                    results.append(res)
 
-            if __debug__:
-                msg = 'ROI %i (%i/%i), %i features' % \
-                            (f + 1, i + 1, len(block), roi.nfeatures)
-                debug('SLC', bar(float(i + 1) / len(block), msg), cr=True)
+                if __debug__:
+                    msg = 'ROI %i (%i/%i), %i features' % \
+                                (f + 1, i + 1, len(block), roi.nfeatures)
+                    debug('SLC', bar(float(i + 1) / len(block), msg), cr=True)
 
         if __debug__:
             # just to get to new line
             debug('SLC', '')
 
+        if stream:
+            results = sink.get()
+            results.a['roi_offset'] = offset
+            results.a['roi_nrois'] = nrois
+            if store_roi_feature_ids:
+                results.a['roi_feature_ids'] = roi_feature_ids
+            if store_roi_sizes:
+                results.a['roi_sizes'] = roi_sizes
+            if store_roi_center_ids:
+                results.a['roi_center_ids'] = np.asanyarray(block)
+
         if self.results_postproc_fx:
             if __debug__:
                 debug('SLC', "Post-processing %d results in proc_block using %s"
                       % (len(results), self.results_postproc_fx))
             results = self.results_postproc_fx(results)
+        if self.checkpoint_dir is not None:
+            self._checkpoint_store(results, offset, len(block))
         if self.results_backend == 'native':
             pass                        # nothing special
         elif self.results_backend == 'hdf5':
@@ -500,6 +926,146 @@ class Searchlight(BaseSearchlight):
         return results
 
 
+    _checkpoint_version = 2
+    _checkpoint_manifest = 'manifest.json'
+    _checkpoint_block_re = re.compile(r'^block-(\d+)-(\d+)\.hdf5$')
+    _checkpoint_address_re = re.compile(r' at 0x[0-9a-fA-F]+')
+
+    def _checkpoint_repr(self, obj):
+        """repr() of an object without memory addresses, which would
+        differ between processes"""
+        return self._checkpoint_address_re.sub('', repr(obj))
+
+    def _checkpoint_fingerprint(self, dataset, roi_ids):
+        """Digest identifying the computation to be checkpointed
+
+        It covers the data (samples and numeric feature attributes), the
+        ROI centers, the query engine (with its neighborhood definitions),
+        and the format of the per-block results.  The measure is verified
+        separately.
+        """
+        md5 = hashlib.md5()
+        samples = dataset.samples
+        md5.update(repr((samples.shape, samples.dtype.str)))
+        # hash in chunks of samples to not duplicate the whole array
+        for i in xrange(0, len(samples), 64):
+            md5.update(np.ascontiguousarray(samples[i:i + 64]).data)
+        for k in sorted(dataset.fa.keys()):
+            v = dataset.fa[k].value
+            md5.update(k)
+            if isinstance(v, np.ndarray) and v.dtype.kind in 'biufc':
+                md5.update(np.ascontiguousarray(v).data)
+        md5.update(np.ascontiguousarray(roi_ids, dtype=np.int64).data)
+        md5.update(self._checkpoint_repr(self._queryengine))
+        md5.update(repr([self._stream]
+                        + [self.ca.is_enabled(c)
+                           for c in ('roi_feature_ids', 'roi_sizes',
+                                     'roi_center_ids')]))
+        return md5.hexdigest()
+
+    def _checkpoint_prepare(self, dataset, roi_ids):
+        """Initialize the checkpoint directory or verify the existing one
+
+        Returns
+        -------
+        dict
+          Already checkpointed blocks: offset -> (nrois, filename).
+        """
+        cdir = self.checkpoint_dir
+        if not os.path.exists(cdir):
+            os.makedirs(cdir)
+        manifest = dict(version=self._checkpoint_version,
+                        nrois=len(roi_ids),
+                        fingerprint=self._checkpoint_fingerprint(dataset,
+                                                                 roi_ids),
+                        measure=self._checkpoint_repr(self.__datameasure))
+        manifest_file = os.path.join(cdir, self._checkpoint_manifest)
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                existing = json.load(f)
+            for k in ('version', 'nrois', 'fingerprint', 'measure'):
+                if existing.get(k) != manifest[k]:
+                    raise ValueError(
+                        "Checkpoint directory %s was populated by a different "
+                        "computation (%s differs). Use a clean directory."
+                        % (cdir, k))
+        else:
+            with open(manifest_file, 'w') as f:
+                json.dump(manifest, f)
+
+        checkpointed = {}
+        for filename in os.listdir(cdir):
+            match = self._checkpoint_block_re.match(filename)
+            if match:
+                offset, nblock = [int(x) for x in match.groups()]
+                checkpointed[offset] = (nblock, os.path.join(cdir, filename))
+        return checkpointed
+
+    def _checkpoint_store(self, results, offset, nrois):
+        """Store results of a block into the checkpoint directory"""
+        filename = os.path.join(self.checkpoint_dir, 'block-%09d-%09d.hdf5'
+                                % (offset, nrois))
+        # write under a temporary name first so an interruption could not
+        # leave an incomplete block behind
+        tmp_filename = os.path.join(self.checkpoint_dir,
+                                    '.%s.tmp%d' % (os.path.basename(filename),
+                                                   os.getpid()))
+        h5save(tmp_filename, results)
+        os.rename(tmp_filename, filename)
+        if __debug__:
+            debug('SLC', "Checkpointed %d ROIs at offset %d into %s"
+                  % (nrois, offset, filename))
+
+    def _checkpoint_cleanup(self):
+        """Remove checkpoints after successful completion"""
+        cdir = self.checkpoint_dir
+        for filename in os.listdir(cdir):
+            if self._checkpoint_block_re.match(filename) \
+                    or filename == self._checkpoint_manifest:
+                os.unlink(os.path.join(cdir, filename))
+
+
+    def _get_roi_batches(self, block, ds, measure):
+        """Split the block into batches of ROIs to be computed at once
+
+        Returns
+        -------
+        list of (start, stop, fids) or None
+          None if the measure does not support batches, or ROIs could not
+          be passed as plain arrays (e.g. ROI specific feature attributes
+          are needed).
+        """
+        if not getattr(measure, 'is_batchable', False) \
+               or self.__add_center_fa or not isinstance(ds.samples, np.ndarray):
+            return None
+        roi_fids = []
+        for f in block:
+            roi_specs = self._queryengine[f]
+            if is_datasetlike(roi_specs):
+                return None
+            roi_fids.append(roi_specs)
+        if not len(roi_fids):
+            return []
+        # bound the size of padded arrays of samples
+        maxsize = max(1, max([len(x) for x in roi_fids]))
+        nbatch = max(1, self._batch_nelements // (len(ds) * maxsize))
+        return [(start, min(start + nbatch, len(block)),
+                 roi_fids[start:start + nbatch])
+                for start in xrange(0, len(block), nbatch)]
+
+
+    def _store_roi_info(self, res, nfeatures, roi_fids, f):
+        """Store information about the ROI within its result dataset"""
+        if self.ca.is_enabled('roi_feature_ids'):
+            # add roi feature ids to intermediate result dataset for later
+            # aggregation
+            res.a['roi_feature_ids'] = roi_fids
+        if self.ca.is_enabled('roi_sizes'):
+            res.a['roi_sizes'] = nfeatures
+        if self.ca.is_enabled('roi_center_ids'):
+            res.a['roi_center_ids'] = f
+
+
     def __set_datameasure(self, datameasure):
         """Set the datameasure"""
         self.untrain()
@@ -520,12 +1086,28 @@ class Searchlight(BaseSearchlight):
         else:
             return results
 
-    def __handle_all_results(self, results):
+    def __handle_all_results(self, results, checkpointed=None):
         """Helper generator to decorate passing the results out to
         results_fx
+
+        Results of `checkpointed` blocks are loaded and passed out in the
+        order of their offsets among the computed ones.
         """
-        for r in results:
+        store_timings = self.ca.is_enabled('block_timings')
+        checkpointed = sorted((checkpointed or {}).items())
+        for timing, r in results:
+            while checkpointed and checkpointed[0][0] < timing['offset']:
+                yield self.__load_checkpoint(checkpointed.pop(0)[1][1])
+            if store_timings:
+                self.ca.block_timings.append(timing)
             yield self.__handle_results(r)
+        for offset, (nblock, filename) in checkpointed:
+            yield self.__load_checkpoint(filename)
+
+    def __load_checkpoint(self, filename):
+        if __debug__:
+            debug('SLC', "Loading checkpointed results from %s" % filename)
+        return h5load(filename)
 
 
     datameasure = property(fget=lambda self: self.__datameasure,
@@ -44,6 +44,11 @@ class UnivariateStatsModels(FeaturewiseMeasure):
     it is possible to perform t-contrasts/t-tests of parameter estimates, as
     well as F-tests for contrast matrices.
 
+    Fitting a model to each feature separately is slow for large datasets.
+    For OLS models
+    :class:`~mvpa2.mappers.glm.native_glm.MassUnivariateGLM` computes
+    parameter estimates and t-/F-tests for all features at once.
+
     Examples
     --------
     Some example data: two features, seven samples
@@ -10,19 +10,31 @@
 
 import numpy as np
 from numpy import array
+import os
 import sys
 import itertools
+import hashlib
+import threading
 
 from mvpa2.base import warning
 from mvpa2.base.types import is_sequence_type
 from mvpa2.base.dochelpers import borrowkwargs, borrowdoc, _repr_attrs, _repr
-from mvpa2.clfs.distance import cartesian_distance
+from mvpa2.clfs.distance import cartesian_distance, manhatten_distance, \
+     absmin_distance
 
 from mvpa2.misc.support import idhash as idhash_
 
 if __debug__:
     from mvpa2.base import debug
 
+# Vectorized versions of known distance functions computing the distances
+# of all points (rows) from the origin at once
+_vectorized_norms = {
+    cartesian_distance: lambda x: np.sqrt(np.sum(x * x, axis=1)),
+    manhatten_distance: lambda x: np.sum(np.abs(x), axis=1),
+    absmin_distance: lambda x: np.max(np.abs(x), axis=1),
+    }
+
 class IdentityNeighborhood(object):
     """Trivial neighborhood.
 
@@ -139,8 +151,16 @@ class Sphere(object):
     def distance_func(self):
         return self._distance_func
 
-    def _get_increments(self, ndim):
-        """Creates a list of increments for a given dimensionality
+    def _get_tentative_increments(self, ndim):
+        """Increments within the bounding box of the sphere and their distances
+
+        Returns
+        -------
+        increments : ndarray
+          Integer offsets (one per row) covering the bounding box.
+        distances : ndarray
+          Distances of the offsets from the center, taking
+          `element_sizes` into account.
         """
         # Set element_sizes
         element_sizes = self._element_sizes
@@ -153,18 +173,29 @@ class Sphere(object):
                       "to constructor had %i dimensions, whenever queried " \
                       "coordinate had %i" \
                       % (element_sizes, len(element_sizes), ndim)
-        center = np.zeros(ndim)
 
         element_sizes = np.asanyarray(element_sizes)
         # What range for each dimension
         erange = np.ceil(self._radius / element_sizes).astype(int)
 
-        tentative_increments = np.array(list(np.ndindex(tuple(erange*2 + 1)))) \
-                               - erange
+        tentative_increments = np.indices(tuple(erange*2 + 1)).reshape(
+                                   (ndim, -1)).T - erange
+        scaled = tentative_increments * element_sizes
+        norm = _vectorized_norms.get(self._distance_func, None)
+        if norm is not None:
+            distances = norm(scaled)
+        else:
+            center = np.zeros(ndim)
+            distances = np.array([self._distance_func(x, center)
+                                  for x in scaled])
+        return tentative_increments, distances
+
+    def _get_increments(self, ndim):
+        """Creates a list of increments for a given dimensionality
+        """
+        increments, distances = self._get_tentative_increments(ndim)
         # Filter out the ones beyond the "sphere"
-        return array([x for x in tentative_increments
-                      if self._distance_func(x * element_sizes, center)
-                      <= self._radius])
+        return increments[distances <= self._radius]
 
 
     def train(self, dataset):
@@ -303,40 +334,91 @@ class HollowSphere(Sphere):
 
     def _get_increments(self, ndim):
         """Creates a list of increments for a given dimensionality
-
-        RF: lame yoh just cut-pasted and tuned up because everything
-            depends on ndim...
         """
-        # Set element_sizes
-        element_sizes = self._element_sizes
-        if element_sizes is None:
-            element_sizes = np.ones(ndim)
-        else:
-            if (ndim != len(element_sizes)):
-                raise ValueError, \
-                      "Dimensionality mismatch: element_sizes %s provided " \
-                      "to constructor had %i dimensions, whenever queried " \
-                      "coordinate had %i" \
-                      % (element_sizes, len(element_sizes), ndim)
-        center = np.zeros(ndim)
-
-        element_sizes = np.asanyarray(element_sizes)
-        # What range for each dimension
-        erange = np.ceil(self._radius / element_sizes).astype(int)
-
-        tentative_increments = np.array(list(np.ndindex(tuple(erange*2 + 1)))) \
-                               - erange
-        # Filter out the ones beyond the "sphere"
-        res = array([x for x in tentative_increments
-                      if self._inner_radius
-                      < self._distance_func(x * element_sizes, center)
-                      <= self._radius])
+        increments, distances = self._get_tentative_increments(ndim)
+        # Filter out the ones beyond the "sphere" or within the hollow part
+        res = increments[(self._inner_radius < distances)
+                         & (distances <= self._radius)]
 
         if not len(res):
             warning("%s defines no neighbors" % self)
         return np.vstack([np.zeros(ndim,dtype='int'),res]) if self.include_center else res
 
 
+class NeighborhoodIndex(object):
+    """Neighborhoods of all features in a compressed sparse row layout
+
+    Feature ids of the neighbors of the i-th feature are stored in
+    ``indices[indptr[i]:indptr[i+1]]``, so a query is just a slice of
+    an array.  Both arrays could be saved into a directory and loaded back
+    memory-mapped, so the index could be shared among processes and reused
+    across sessions.
+    """
+
+    _filenames = ('indptr.npy', 'indices.npy')
+
+    def __init__(self, indptr, indices):
+        """
+        Parameters
+        ----------
+        indptr : ndarray
+          Offsets of the neighborhoods within `indices` (one more than the
+          number of neighborhoods).
+        indices : ndarray
+          Concatenated feature ids of all neighborhoods.
+        """
+        self.indptr = indptr
+        self.indices = indices
+
+    def __repr__(self):
+        return "<%s: %d neighborhoods, %d elements>" \
+               % (self.__class__.__name__, len(self), len(self.indices))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    @property
+    def sizes(self):
+        """Number of features in every neighborhood"""
+        return np.diff(self.indptr)
+
+    @classmethod
+    def from_lists(cls, neighborhoods):
+        """Create the index from a sequence of sequences of feature ids"""
+        sizes = [len(n) for n in neighborhoods]
+        indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+        indices = np.zeros(indptr[-1], dtype=np.int64)
+        for i, n in enumerate(neighborhoods):
+            indices[indptr[i]:indptr[i + 1]] = n
+        return cls(indptr, indices)
+
+    def save(self, dirname):
+        """Store the index into .npy files within `dirname`"""
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        for fname, arr in zip(self._filenames, (self.indptr, self.indices)):
+            np.save(os.path.join(dirname, fname), arr)
+
+    @classmethod
+    def load(cls, dirname, mmap_mode='r'):
+        """Load the index stored by `save`, by default memory-mapped"""
+        # plain ndarray views, so queries do not give np.memmap instances
+        return cls(*[np.asarray(np.load(os.path.join(dirname, fname),
+                                        mmap_mode=mmap_mode))
+                     for fname in cls._filenames])
+
+    @classmethod
+    def exists(cls, dirname):
+        """Either `dirname` contains a stored index"""
+        return all([os.path.exists(os.path.join(dirname, fname))
+                    for fname in cls._filenames])
+
+
+
 class QueryEngineInterface(object):
     """Very basic class for `QueryEngine`\s defining the interface
 
@@ -447,12 +529,23 @@ class IndexQueryEngine(QueryEngine):
     - repr
     """
 
-    def __init__(self, sorted=True, **kwargs):
+    def __init__(self, sorted=True, precompute=False, **kwargs):
         """
         Parameters
         ----------
         sorted : bool
           Results of query get sorted
+        precompute : bool or str
+          If True, neighborhoods of all features get computed upon `train`
+          into a :class:`NeighborhoodIndex`, so `query_byid` just returns a
+          slice of it (an array instead of a list).  It is done in a single
+          vectorized pass if all spaces either have a :class:`Sphere`
+          query object on integer coordinates or no query object at all.
+          If a string, it is a directory where to store the index, or from
+          where to load it memory-mapped if it was stored already.  No
+          checking is done on either the stored index corresponds to the
+          dataset besides the number of features, so CAUTION should be paid
+          to not reuse it for different datasets.
         """
         QueryEngine.__init__(self, **kwargs)
         self._spaceorder = None
@@ -465,12 +558,21 @@ class IndexQueryEngine(QueryEngine):
         """Actual searcharray"""
         self.sorted = sorted
         """Either to sort the query results"""
+        self.precompute = precompute
+        self._nbindex = None
+        """Precomputed neighborhoods of all features"""
 
 
     def __repr__(self, prefixes=[]):
         return super(IndexQueryEngine, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['sorted'], default=True))
+            + _repr_attrs(self, ['sorted'], default=True)
+            + _repr_attrs(self, ['precompute'], default=False))
+
+    @property
+    def neighborhood_index(self):
+        """Precomputed :class:`NeighborhoodIndex` (None if not precomputed)"""
+        return self._nbindex
 
 
     def _train(self, dataset):
@@ -543,6 +645,126 @@ class IndexQueryEngine(QueryEngine):
                              "cases -- use another appropriate query engine"
                              % (self._spaceorder, self))
 
+        self._nbindex = None
+        if self.precompute:
+            self._nbindex = self._get_neighborhood_index(dataset)
+
+
+    def _get_neighborhood_index(self, dataset):
+        """Load or compute (and possibly store) the neighborhood index"""
+        dirname = self.precompute \
+                  if isinstance(self.precompute, basestring) else None
+        if dirname is not None and NeighborhoodIndex.exists(dirname):
+            if __debug__:
+                debug('NBH', "Loading neighborhood index from %s" % dirname)
+            nbindex = NeighborhoodIndex.load(dirname)
+            if len(nbindex) != dataset.nfeatures:
+                raise ValueError(
+                    "Neighborhood index in %s was computed for %d features "
+                    "whenever dataset has %d. Remove it or provide another "
+                    "directory." % (dirname, len(nbindex), dataset.nfeatures))
+            return nbindex
+
+        nbindex = self._compute_neighborhood_index(dataset.nfeatures)
+        if nbindex is None:
+            if __debug__:
+                debug('NBH', "Querying neighborhoods of all %d features one "
+                      "by one" % dataset.nfeatures)
+            nbindex = NeighborhoodIndex.from_lists(
+                [QueryEngine.query_byid(self, fid)
+                 for fid in xrange(dataset.nfeatures)])
+        if dirname is not None:
+            nbindex.save(dirname)
+            # use the stored one, so processes could share it
+            nbindex = NeighborhoodIndex.load(dirname)
+        return nbindex
+
+
+    def _compute_neighborhood_index(self, nfeatures, chunk_size=2**21):
+        """Compute neighborhoods of all features in a vectorized fashion
+
+        All spaces get combined into a single integer coordinate space:
+        spaces without a query object contribute the index of the value
+        (with no increments), and spaces with a `Sphere` -- their
+        coordinates (with the increments of the sphere).  Neighbors are
+        found by looking up linearized coordinates of all centers shifted
+        by all increments in the sorted linearized coordinates of the
+        features.
+
+        Returns
+        -------
+        NeighborhoodIndex or None
+          None if some space is not suitable for vectorized computation.
+        """
+        coords, increments = [], []
+        for space in self._spaceorder:
+            qobj = self._queryobjs[space]
+            if qobj is None:
+                qattr = self._queryattrs[space]
+                if isinstance(qattr, np.ndarray) and len(qattr.shape) > 1:
+                    qattr = [tuple(x) for x in qattr]
+                lookup = self._lookups[space]
+                coords.append(np.array([lookup[x] for x in qattr])[:, None])
+                increments.append(np.zeros((1, 1), dtype=int))
+            elif isinstance(qobj, Sphere):
+                qattr = np.asanyarray(self._queryattrs[space])
+                if not qattr.dtype.char in np.typecodes['AllInteger']:
+                    return None
+                if qattr.ndim == 1:
+                    qattr = qattr[:, None]
+                coords.append(qattr)
+                increments.append(qobj._get_increments(qattr.shape[1]))
+            else:
+                return None
+        if __debug__:
+            debug('NBH', "Computing neighborhood index for %d features "
+                  "using vectorized lookup" % nfeatures)
+        coords = np.hstack(coords).astype(np.int64)
+        # all combinations of increments across spaces
+        increments = np.array([np.hstack(x)
+                               for x in itertools.product(*increments)],
+                              dtype=np.int64).reshape((-1, coords.shape[1]))
+        ninc = len(increments)
+
+        # linearize coordinates within the bounding box
+        mins = coords.min(axis=0)
+        shape = coords.max(axis=0) - mins + 1
+        strides = np.r_[np.cumprod(shape[::-1])[::-1][1:], 1]
+        coords = coords - mins
+        lin = np.dot(coords, strides)
+        order = np.argsort(lin)
+        lin_sorted = lin[order]
+
+        sizes = np.zeros(nfeatures, dtype=np.int64)
+        indices = []
+        step = max(1, chunk_size // max(1, ninc * coords.shape[1]))
+        for start in xrange(0, nfeatures, step):
+            # candidate neighbors of centers within the chunk
+            cand = coords[start:start + step, None, :] + increments[None]
+            valid = np.all((cand >= 0) & (cand < shape), axis=2)
+            cand_lin = np.dot(cand, strides)
+            pos = np.searchsorted(lin_sorted, cand_lin)
+            pos[pos == nfeatures] = 0
+            found = valid & (lin_sorted[pos] == cand_lin)
+            ids = np.where(found, order[pos], -1)
+            if self.sorted:
+                # -1s (not found) end up in front
+                ids.sort(axis=1)
+            sizes[start:start + step] = found.sum(axis=1)
+            indices.append(ids[ids >= 0])
+
+        indptr = np.zeros(nfeatures + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+        return NeighborhoodIndex(indptr, np.hstack(indices))
+
+
+    def query_byid(self, fid):
+        """Return feature ids of neighbors for a given feature id
+        """
+        if self._nbindex is not None:
+            return self._nbindex[fid]
+        return QueryEngine.query_byid(self, fid)
+
 
     def query(self, **kwargs):
         # construct the search array slicer
@@ -591,12 +813,25 @@ class CachedQueryEngine(QueryEngineInterface):
     -----
 
     This QueryEngine simply remembers the results of the previous
-    queries.  Not much checking is done on either datasets it gets in
-    :meth:`train` is the same as the on in previous sweep of queries,
-    i.e. either none of the relevant for underlying QueryEngine
-    feature attributes was modified.  So, CAUTION should be paid to
-    avoid calling the same instance of `CachedQueryEngine` on
-    different datasets (which might have different masking etc) .
+    queries.  Results are kept separately for every "fingerprint" of the
+    dataset it was trained on, i.e. a digest of the feature attributes
+    relevant for the underlying query engine (its spaces, or all feature
+    attributes if those are not known) along with the `repr` of the
+    engine.  Thus the same instance could be safely (re)used on
+    different datasets, e.g. of multiple subjects in the same space or
+    permutations of the same dataset, and neighborhoods of the datasets
+    sharing the fingerprint would be computed only once.  The underlying
+    query engine gets trained only when some query is not cached yet.
+
+    The total size of the cache could be bounded (`maxsize`), in which
+    case least recently used results get evicted first.  Results of
+    :meth:`query_byid` could be stored to and loaded from a file (see
+    :meth:`save` and :meth:`load`) to reuse them across sessions.
+
+    Queries could be issued concurrently from multiple threads (e.g. by a
+    searchlight with 'threads' backend): the cache and (re)training of
+    the underlying query engine are guarded by a lock, while the
+    underlying engine gets queried for missing results concurrently.
 
     :func:`query_byid` should be working reliably and without
     surprises.
@@ -605,66 +840,177 @@ class CachedQueryEngine(QueryEngineInterface):
     collision! Thus consider it EXPERIMENTAL for now.
     """
 
-    def __init__(self, queryengine):
+    def __init__(self, queryengine, maxsize=None):
         """
         Parameters
         ----------
         queryengine : QueryEngine
           Results of which engine to cache
+        maxsize : None or int
+          Maximal total number of feature ids in all cached results.  If
+          None, the cache is not bounded.
         """
         super(CachedQueryEngine, self).__init__()
         self._queryengine = queryengine
-        self._trained_ds_fa_hash = None
-        """Will give information about either dataset's FA were changed
-        """
-        self._lookup_ids = None
+        self.maxsize = maxsize
+        self._fingerprint = None
+        """Fingerprint of the dataset it was trained on last"""
+        self._trained_fingerprint = None
+        """Fingerprint of the dataset underlying engine was trained on"""
+        self._dataset = None
+        """Dataset to train underlying engine on whenever necessary"""
+        self._ids = {}
+        """ids known to the underlying engine per fingerprint"""
         self._lookup = None
+        self._size = 0
+        """Total number of feature ids in the cache"""
+        self._lock = threading.RLock()
+        """Guards the cache and training of the underlying engine"""
+        self._reset_lookup()
+
+    def __getstate__(self):
+        # locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
     def __repr__(self, prefixes=[]):
         return super(CachedQueryEngine, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['queryengine']))
+            + _repr_attrs(self, ['queryengine'])
+            + _repr_attrs(self, ['maxsize']))
+
+    def _reset_lookup(self):
+        if self.maxsize is None:
+            self._lookup = {}
+        else:
+            # we need to track the order of use
+            from collections import OrderedDict
+            self._lookup = OrderedDict()
+        self._size = 0
+
+    def _get_fingerprint(self, dataset):
+        """Digest of the feature attributes relevant for the query engine"""
+        md5 = hashlib.md5()
+        md5.update(repr(self._queryengine))
+        md5.update(':%d' % dataset.nfeatures)
+        spaces = getattr(self._queryengine, '_queryobjs', None)
+        if spaces is None:
+            spaces = dataset.fa.keys()
+        for space in sorted(spaces):
+            md5.update(':' + space)
+            if not space in dataset.fa:
+                continue
+            value = dataset.fa[space].value
+            if isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+                md5.update(value.dtype.str + repr(value.shape))
+                md5.update(np.ascontiguousarray(value).data)
+            else:
+                md5.update(repr([v for v in value]))
+        return md5.hexdigest()
 
+    @property
+    def fingerprint(self):
+        """Fingerprint of the dataset `CachedQueryEngine` was trained on"""
+        return self._fingerprint
 
     def train(self, dataset):
         """'Train' `CachedQueryEngine`.
 
-        Raises
-        ------
-        ValueError
-          If `dataset`'s .fa were changed -- it would raise an
-          exception telling to `untrain` explicitly, since the idea is
-          to reuse CachedQueryEngine with the same engine and same
-          dataset (up to variation of .sa, such as labels permutation)
+        The underlying query engine gets trained right away only if there
+        is nothing cached for the `dataset`'s fingerprint yet.  Otherwise
+        it happens only upon the first query not found in the cache.
         """
-        ds_fa_hash = idhash_(dataset.fa) + ':%d' % dataset.fa._uniform_length
-        if self._trained_ds_fa_hash is None:
-            # First time is called
-            self._trained_ds_fa_hash = ds_fa_hash
-            self._queryengine.train(dataset)     # train the queryengine
-            self._lookup_ids = [None] * dataset.nfeatures # lookup for query_byid
-            self._lookup = {}           # generic lookup
-        elif self._trained_ds_fa_hash != ds_fa_hash:
-            raise ValueError, \
-                  "Feature attributes of %s (idhash=%r) were changed from " \
-                  "what this %s was trained on (idhash=%r). Untrain it " \
-                  "explicitly if you like to reuse it on some other data." \
-                  % (dataset, ds_fa_hash, self, self._trained_ds_fa_hash)
-        else:
-            pass
+        fingerprint = self._get_fingerprint(dataset)
+        with self._lock:
+            self._fingerprint = fingerprint
+            if fingerprint == self._trained_fingerprint:
+                self._dataset = None
+            elif fingerprint in self._ids:
+                # train later on if necessary
+                self._dataset = dataset
+            else:
+                self._dataset = dataset
+                self._train_queryengine()
+
+    def _train_queryengine(self):
+        if __debug__:
+            debug('NBH', "Training %s for fingerprint %s"
+                  % (self._queryengine, self._fingerprint))
+        self._queryengine.train(self._dataset)
+        self._trained_fingerprint = self._fingerprint
+        self._ids[self._fingerprint] = self._queryengine.ids
+        self._dataset = None
 
     def untrain(self):
         """Forgetting that CachedQueryEngine was already trained
+
+        Cached results are kept.  Use :meth:`clear` to discard them.
         """
-        self._trained_ds_fa_hash = None
+        self._fingerprint = None
+        self._dataset = None
+
+    def clear(self):
+        """Discard all cached results"""
+        with self._lock:
+            self._reset_lookup()
+            self._ids = {}
+            if self._trained_fingerprint is not None:
+                self._ids[self._trained_fingerprint] = self._queryengine.ids
+            if self._fingerprint is not None \
+                    and not self._fingerprint in self._ids:
+                # nothing is known about it anymore
+                self._train_queryengine()
 
+    @property
+    def ids(self):
+        if self._fingerprint is None:
+            return None
+        return self._ids[self._fingerprint]
+
+    def _get(self, key, compute):
+        """Obtain result from the cache, or compute and store it"""
+        if self._fingerprint is None:
+            raise RuntimeError("%s must be trained before being queried"
+                               % self)
+        key = (self._fingerprint,) + key
+        with self._lock:
+            lookup = self._lookup
+            v = lookup.get(key, None)
+            if v is not None:
+                if self.maxsize is not None:
+                    # mark as the most recently used
+                    del lookup[key]
+                    lookup[key] = v
+                return v
+            if self._fingerprint != self._trained_fingerprint:
+                self._train_queryengine()
+        # querying itself does not modify the underlying engine
+        v = compute()
+        self._store(key, v)
+        return v
+
+    def _store(self, key, v):
+        with self._lock:
+            lookup = self._lookup
+            if key in lookup:
+                # stored by another thread meanwhile
+                self._size -= len(lookup.pop(key))
+            lookup[key] = v
+            self._size += len(v)
+            if self.maxsize is not None:
+                # evict least recently used ones, but keep the new one
+                while self._size > self.maxsize and len(lookup) > 1:
+                    self._size -= len(lookup.popitem(last=False)[1])
 
     @borrowdoc(QueryEngineInterface)
     def query_byid(self, fid):
-        v = self._lookup_ids[fid]
-        if v is None:
-            self._lookup_ids[fid] = v = self._queryengine.query_byid(fid)
-        return v
+        return self._get(('id', fid),
+                         lambda: self._queryengine.query_byid(fid))
 
     @borrowdoc(QueryEngineInterface)
     def query(self, **kwargs):
@@ -701,13 +1047,53 @@ class CachedQueryEngine(QueryEngineInterface):
         # still need to store actual values to resolve collisions
         # which would boil down to the same scenario
         k = to_hashable(kwargs)
-        v = self._lookup.get(k, None)
-        if v is None:
-            self._lookup[k] = v = self._queryengine.query(**kwargs)
-        return v
+        return self._get(('query', k),
+                         lambda: self._queryengine.query(**kwargs))
 
-    queryengine = property(fget=lambda self: self._queryengine)
+    def save(self, filename):
+        """Store cached results of `query_byid` into a .npz file
 
+        Results of `query` are not stored.
+        """
+        byfp = {}
+        for key, v in self._lookup.iteritems():
+            fingerprint, kind, k = key
+            if kind == 'id':
+                byfp.setdefault(fingerprint, []).append((k, v))
+        arrays = {}
+        for i, fingerprint in enumerate(sorted(self._ids)):
+            entries = sorted(byfp.get(fingerprint, []))
+            nbindex = NeighborhoodIndex.from_lists([v for k, v in entries])
+            arrays.update({
+                'fingerprint_%d' % i: np.array(fingerprint),
+                'ids_%d' % i: np.asanyarray(self._ids[fingerprint]),
+                'fids_%d' % i: np.array([k for k, v in entries],
+                                        dtype=np.int64),
+                'indptr_%d' % i: nbindex.indptr,
+                'indices_%d' % i: nbindex.indices})
+        np.savez(filename, nfingerprints=len(self._ids), **arrays)
+
+    def load(self, filename):
+        """Add results stored by :meth:`save` into the cache"""
+        stored = np.load(filename)
+        try:
+            for i in xrange(int(stored['nfingerprints'])):
+                fingerprint = str(stored['fingerprint_%d' % i])
+                if not fingerprint in self._ids:
+                    self._ids[fingerprint] = list(stored['ids_%d' % i])
+                nbindex = NeighborhoodIndex(stored['indptr_%d' % i],
+                                            stored['indices_%d' % i])
+                for fid, j in zip(stored['fids_%d' % i],
+                                  xrange(len(nbindex))):
+                    key = (fingerprint, 'id', int(fid))
+                    if not key in self._lookup:
+                        self._store(key, nbindex[j])
+        finally:
+            stored.close()
+        if __debug__:
+            debug('NBH', "Loaded cached neighborhoods from %s" % filename)
+
+    queryengine = property(fget=lambda self: self._queryengine)
 
 
 def scatter_neighborhoods(neighbor_gen, coords, deterministic=False):
@@ -798,3 +798,37 @@ def get_nelements_per_value(data):
 
     return result
 
+
+
+def get_unique_codes(data):
+    """Returns the unique values of some sequence and a code per element.
+
+    Parameters
+    ----------
+    data : sequence
+      This can be any sequence. In addition also ArrayCollectables are
+      supported.
+
+    Returns
+    -------
+    (uniquevalues, codes)
+      `codes` is an integer array with the index of the value of each
+      element in `uniquevalues`, i.e. ``uniquevalues[codes]`` reconstructs
+      the sequence.
+    """
+    if hasattr(data, 'unique'):
+        values = data.value
+    else:
+        values = data
+    values = np.asanyarray(values)
+    if values.dtype == np.object:
+        # might be hard to sort -- match each unique value
+        if hasattr(data, 'unique'):
+            uniquevalues = data.unique
+        else:
+            uniquevalues = np.unique(values)
+        codes = np.empty(len(values), dtype=int)
+        for i, u in enumerate(uniquevalues):
+            codes[array_whereequal(values, u)] = i
+        return uniquevalues, codes
+    return np.unique(values, return_inverse=True)
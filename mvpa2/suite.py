@@ -59,6 +59,8 @@ else:
 
 __sdebug('algorithms')
 from mvpa2.algorithms.hyperalignment import *
+if externals.exists('scipy'):
+    from mvpa2.algorithms.searchlight_hyperalignment import *
 
 __sdebug('clfs')
 from mvpa2 import clfs
@@ -123,6 +125,7 @@ from mvpa2.datasets.sources import *
 from mvpa2.datasets.sources.openfmri import *
 from mvpa2.datasets import niml
 from mvpa2.datasets.niml import from_niml, to_niml
+from mvpa2.datasets.npz import from_npz, to_npz
 from mvpa2.datasets import eeglab
 from mvpa2.datasets.eeglab import eeglab_dataset
 if externals.exists('scipy') :
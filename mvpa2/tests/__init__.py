@@ -195,6 +195,7 @@ def collect_nose_tests(verbosity=1):
 
         # Misc supporting
         'test_neighborhood',
+        'test_parallel',
         'test_stats',
         'test_stats_sp',
 
@@ -92,6 +92,35 @@ class CrossValidationTests(unittest.TestCase):
         assert_raises(ValueError, cv, data)
 
 
+    def test_parallel_folds(self):
+        data = get_mv_pattern(3)
+        def get_cv(**kwargs):
+            folds = []
+            cv = CrossValidation(
+                sample_clf_nl, NFoldPartitioner(),
+                callback=lambda data, node, result: folds.append(
+                    data.sa.chunks[data.sa.partitions == 2][0]),
+                enable_ca=['stats', 'training_stats'], **kwargs)
+            return cv, folds
+
+        cv, folds = get_cv()
+        results = cv(data)
+        for backend in ('threads', 'multiprocessing'):
+            cv_p, folds_p = get_cv(nproc=2, backend=backend)
+            ok_('nproc=2' in repr(cv_p))
+            sample_clf_nl.untrain()
+            results_p = cv_p(data)
+            assert_array_equal(results, results_p)
+            assert_array_equal(results.sa.cvfolds, results_p.sa.cvfolds)
+            # callbacks were called in the order of folds
+            assert_equal(folds, folds_p)
+            for ca in ('stats', 'training_stats'):
+                assert_array_equal(cv.ca[ca].value.matrix,
+                                   cv_p.ca[ca].value.matrix)
+            # embedded learner was not trained in the main process
+            ok_(not cv_p.transfermeasure.measure.trained)
+
+
 def suite():  # pragma: no cover
     return unittest.makeSuite(CrossValidationTests)
 
@@ -12,6 +12,7 @@ from mvpa2.testing import *
 from mvpa2.testing.datasets import datasets
 
 from mvpa2.datasets.formats import *
+from mvpa2.datasets.npz import to_npz, from_npz
 
 import tempfile
 import os
@@ -36,3 +37,41 @@ def test_format_lightsvm_basic():
         else:
             assert_array_almost_equal(ds.targets, ds_.targets, decimal=3)
         assert_array_almost_equal(ds.samples, ds_.samples)
+
+
+@sweepargs(compress=(False, True))
+@sweepargs(mmap=(False, True))
+@with_tempfile(suffix='.npz')
+def test_npz(fname, compress, mmap):
+    # has a mapper, and a sample attribute of objects
+    ds = datasets['3dsmall'].copy()
+    ds.a['some_array'] = np.arange(3)
+    ds.a['some_string'] = 'blurb'
+    to_npz(ds, fname, compress=compress)
+    ds_ = from_npz(fname, mmap=mmap)
+    assert_equal(ds_.__class__, ds.__class__)
+    assert_array_equal(ds_.samples, ds.samples)
+    assert_equal(ds_.samples.dtype, ds.samples.dtype)
+    assert_equal(sorted(ds_.sa.keys()), sorted(ds.sa.keys()))
+    assert_equal(sorted(ds_.fa.keys()), sorted(ds.fa.keys()))
+    assert_equal(sorted(ds_.a.keys()), sorted(ds.a.keys()))
+    for col in ('sa', 'fa'):
+        for k, v in getattr(ds, col).iteritems():
+            assert_array_equal(getattr(ds_, col)[k].value, v.value)
+    assert_array_equal(ds_.a.some_array, ds.a.some_array)
+    assert_equal(ds_.a.some_string, 'blurb')
+    # mapper is functional
+    assert_array_equal(ds_.a.mapper.reverse(ds_).samples,
+                       ds.a.mapper.reverse(ds).samples)
+    # memory-mapped only if asked for and possible
+    assert_equal(ds_.samples.flags.writeable, not (mmap and not compress))
+    # still an npz for numpy
+    npz = np.load(fname)
+    assert_array_equal(npz['samples'], ds.samples)
+    npz.close()
+
+
+@with_tempfile(suffix='.npz')
+def test_npz_errors(fname):
+    np.savez(fname, samples=np.arange(3))
+    assert_raises(ValueError, from_npz, fname)
@@ -413,6 +413,93 @@ def test_hstack():
         assert_array_equal(v[:nf1], v[nf1:2 * nf1])
         assert_array_equal(v[2 * nf1:], v[nf1:2 * nf1])
 
+def test_stack_iterables():
+    dss = [Dataset.from_wizard(np.arange(i, i + 6).reshape((2, 3)) * (1 + i),
+                               targets=['t%d' % i] * 2, chunks=i)
+           for i in xrange(5)]
+    # mixed dtypes and string lengths get upcasted as by numpy
+    dss.append(Dataset.from_wizard(np.ones((1, 3)) / 2., targets=['longer'],
+                                   chunks=5))
+    for ds in dss:
+        ds.a['fixed'] = np.arange(3)
+    dss[2].a['fixed'] = np.arange(3) + 1
+    dss[3].a['some'] = 'value'
+    for a in (None, 'drop_nonunique', 'uniques', 'all', 2, -1):
+        merged = vstack(dss, a=a)
+        # generator and a list give the same
+        merged_gen = vstack((ds for ds in dss), a=a)
+        for m in (merged, merged_gen):
+            assert_equal(m.shape, (11, 3))
+            assert_array_equal(
+                m.samples, np.concatenate([ds.samples for ds in dss]))
+            assert_equal(m.samples.dtype, np.float)
+            assert_array_equal(m.targets,
+                               np.concatenate([ds.targets for ds in dss]))
+            assert_equal(m.targets[-1], 'longer')
+            assert_equal(sorted(m.a.keys()), sorted(merged.a.keys()))
+        if a == 'uniques':
+            assert_equal(len(merged_gen.a.fixed), 2)
+            assert_equal(merged_gen.a.some, ('value',))
+        elif a == 'all':
+            assert_equal(len(merged_gen.a.fixed), 6)
+            assert_equal(merged_gen.a.some, (None,) * 3 + ('value',)
+                                            + (None,) * 2)
+        elif a == 'drop_nonunique':
+            assert_equal(sorted(merged_gen.a.keys()), ['some'])
+        elif a == 2:
+            assert_array_equal(merged_gen.a.fixed, np.arange(3) + 1)
+        elif a == -1:
+            assert_array_equal(merged_gen.a.fixed, np.arange(3))
+            ok_(not 'some' in merged_gen.a)
+
+    # hstack as well
+    dss = [Dataset.from_wizard(np.ones((2, i + 1)) * i, targets=[1, 2])
+           for i in xrange(4)]
+    merged = hstack(iter(dss))
+    assert_equal(merged.shape, (2, 10))
+    assert_array_equal(merged.samples,
+                       np.hstack([ds.samples for ds in dss]))
+    # a single dataset is returned as is
+    ok_(vstack(iter(dss[:1])) is dss[0])
+    assert_raises(ValueError, vstack, iter([]))
+    # mismatching shapes are detected
+    assert_raises(ValueError, vstack, iter(dss))
+
+    # values of different types might still be equal
+    dss = [Dataset(np.ones((1, 1))) for i in xrange(3)]
+    dss[0].a['v'] = np.array([1, 2])
+    dss[1].a['v'] = [1, 2]
+    dss[2].a['v'] = (1, 2)
+    assert_equal(len(vstack(dss, a='uniques').a.v), 1)
+    assert_array_equal(vstack(dss, a='unique').a.v, [1, 2])
+    # ... as well as arrays of different dtypes
+    dss[1].a['v'] = np.array([1., 2.])
+    dss[2].a['v'] = np.array([1, 2], dtype=np.int8)
+    assert_equal(len(vstack(dss, a='uniques').a.v), 1)
+    assert_array_equal(vstack(dss, a='unique').a.v, [1, 2])
+    # (also of different lengths of strings)
+    for i, (v, dtype) in enumerate((('ab', 'S2'), ('ab', 'S4'),
+                                    ('abc', 'S3'))):
+        dss[i].a['v'] = np.array([v, 'cd'], dtype=dtype)
+    assert_equal(len(vstack(dss, a='uniques').a.v), 2)
+    ok_('v' not in vstack(dss, a='drop_nonunique').a)
+    # and objects which are equal, but hashed by their ids
+    class Header(object):
+        def __init__(self, value):
+            self.value = value
+        def __eq__(self, other):
+            return self.value == other.value
+        def __ne__(self, other):
+            return not self == other
+    for i, ds in enumerate(dss):
+        ds.a['v'] = Header(i // 2)
+    assert_equal(len(vstack(dss, a='uniques').a.v), 2)
+    for ds in dss:
+        ds.a['v'] = Header(0)
+    assert_equal(vstack(dss, a='unique').a.v.value, 0)
+    assert_equal(sorted(vstack(dss, a='drop_nonunique').a.keys()), ['v'])
+
+
 def test_stack_add_dataset_attributes():
     data0 = Dataset.from_wizard(np.ones((5, 5)), targets=1)
     data0.a['one'] = np.ones(2)
@@ -1056,6 +1143,78 @@ def test_assign_sa():
     assert_equal(ds1.sa['task'].name, 'task')
     assert_equal(ds1.sa['targets'].name,'targets')
 
+def test_lazy_attribute_selection():
+    ds = dataset_wizard(np.arange(40).reshape((8, 5)),
+                        targets=range(8), chunks=[0, 0, 1, 1, 2, 2, 3, 3])
+    ds.fa['roi'] = ['a', 'b', 'c', 'd', 'e']
+    # [] selects attributes right away, and copies them
+    sel = ds[[0, 2]]
+    ok_(sel.sa['targets']._lazy is None)
+    ds.sa.targets[0] = -1
+    assert_array_equal(sel.targets, [0, 2])
+    ds.sa.targets[0] = 0
+
+    sel = ds.select_view([1, 2, 3, 5, 7])
+    # nothing was selected yet
+    ok_(sel.sa['targets']._lazy is not None)
+    assert_equal(len(sel.sa['targets']), 5)
+    # ... hence modifications of the source show up (as with views)
+    ds.sa.targets[1] = -1
+    assert_array_equal(sel.targets, [-1, 2, 3, 5, 7])
+    ds.sa.targets[1] = 1
+    sel = ds.select_view([1, 2, 3, 5, 7])
+    # repeated selections get fused
+    sel2 = sel.select_view([True, False, True, True, False], [0, 3])
+    ok_(sel2.sa['chunks']._lazy[0] is ds.sa.chunks)
+    assert_array_equal(sel2.sa['chunks']._lazy[1], [1, 3, 5])
+    assert_array_equal(sel2.targets, [1, 3, 5])
+    assert_array_equal(sel2.chunks, [0, 1, 2])
+    assert_array_equal(sel2.fa.roi, ['a', 'd'])
+    ok_(sel2.sa['targets']._lazy is None)
+    # the same as before
+    assert_array_equal(sel2.samples, ds.samples[[1, 3, 5]][:, [0, 3]])
+    assert_array_equal(sel.targets, [1, 2, 3, 5, 7])
+    # assignment overrides postponed selection
+    sel.sa.targets = range(5)
+    assert_array_equal(sel.targets, range(5))
+    # empty selection
+    assert_equal(ds.select_view([])[:, []].shape, (0, 0))
+    assert_equal(len(ds.select_view([]).select_view([]).targets), 0)
+    # wrong length is detected right away
+    assert_raises(ValueError, sel.sa['targets'].select_from,
+                  ds.sa.targets, slice(None), 8)
+
+
+def test_select_view():
+    ds = dataset_wizard(np.arange(40).reshape((8, 5)),
+                        targets=range(8), chunks=[0, 0, 1, 1, 2, 2, 3, 3])
+    for args in ((ds.chunks == 1,),
+                 ([2, 3], [1, 2, 3]),
+                 ([1, 3, 5, 7], -1),
+                 (slice(None), np.array([0, 2, 4])),
+                 (3,),
+                 ([],),
+                 ([3, 1],),
+                 (ds.chunks > 0, [True, False, True, False, False])):
+        view = ds.select_view(*args)
+        sel = ds[args]
+        assert_array_equal(view.samples, sel.samples)
+        assert_array_equal(view.targets, sel.targets)
+    # views are views
+    view = ds.select_view(ds.chunks == 1, [1, 2, 3])
+    view.samples[0, 0] = -1
+    assert_equal(ds.samples[2, 1], -1)
+    # whenever a copy is made by []
+    ds[ds.chunks == 1, [1, 2, 3]].samples[0, 0] = -2
+    assert_equal(ds.samples[2, 1], -1)
+    # irregular selection is not a view
+    view = ds.select_view([0, 1, 3])
+    view.samples[0, 0] = -3
+    ok_(ds.samples[0, 0] != -3)
+    # dict selections are still supported
+    assert_array_equal(ds.select_view({'chunks': [2]}).targets, [4, 5])
+
+
 def test_dataset_select_getitem():
     ds = Dataset(np.arange(15).reshape((5,-1)),
                  sa=dict(targets=range(5),
@@ -14,6 +14,7 @@ from mvpa2.measures.anova import OneWayAnova
 
 import numpy as np
 from mvpa2.mappers.fx import *
+from mvpa2.mappers.shape import TransposeMapper
 from mvpa2.datasets.base import dataset_wizard, Dataset
 
 from mvpa2.testing.tools import *
@@ -148,6 +149,39 @@ def test_featuregroup_mapper():
     assert_array_equal(mapped.samples.shape, (3, 1))
 
 
+@reseed_rng()
+@sweepargs(fx=(np.mean, np.sum, np.max, np.min))
+def test_grouped_reductions(fx):
+    # disbalanced groups in random order, some samples without a group
+    targets = np.random.randint(0, 3, size=50).astype(float)
+    targets[[3, 17]] = np.nan
+    chunks = np.random.permutation(np.repeat(['a', 'b', 'c', 'd', 'e'], 10))
+    chunks[chunks == 'e'] = 'd'
+    for dtype in (float, np.float32, int):
+        ds = Dataset((np.random.randn(50, 4) * 10).astype(dtype),
+                     sa={'targets': targets, 'chunks': chunks})
+        for order in ('uattrs', 'occurrence', None):
+            for axis, d in (('samples', ds), ('features', ds.get_mapped(
+                    TransposeMapper()))):
+                kwargs = dict(uattrs=['targets', 'chunks'], order=order)
+                fast = FxMapper(axis, fx, **kwargs).forward(d)
+                # per-group application of an unknown function
+                slow = FxMapper(axis, lambda x, axis: fx(x, axis),
+                                **kwargs).forward(d)
+                assert_array_almost_equal(fast.samples, slow.samples,
+                                          decimal=2)
+                assert_equal(fast.samples.dtype, slow.samples.dtype)
+                col = axis == 'samples' and 'sa' or 'fa'
+                for attr in ('targets', 'chunks'):
+                    assert_array_equal(getattr(fast, col)[attr].value,
+                                       getattr(slow, col)[attr].value)
+    # groups of NaN targets are gone
+    ngroups = len(set([(t, c) for t, c in zip(targets, chunks)
+                       if not np.isnan(t)]))
+    assert_equal(len(fast.fa.targets), ngroups)
+    assert_false(np.any(np.isnan(fast.fa.targets)))
+
+
 def test_fxmapper():
     origdata = np.arange(24).reshape(3,8)
     ds = Dataset(origdata.copy())
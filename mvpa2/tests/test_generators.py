@@ -46,7 +46,10 @@ def test_splitter():
     for split in splits:
         # it should have perform basic slicing!
         assert_true(split.samples.base is ds.samples)
+        # attributes are not selected until accessed
+        ok_(split.sa['targets']._lazy is not None)
         assert_equal(len(split.sa['chunks'].unique), 1)
+        ok_(split.sa['chunks']._lazy is None)
         assert_true('lastsplit' in split.a)
     assert_true(splits[-1].a.lastsplit)
 
@@ -58,6 +61,7 @@ def test_splitter():
     for split in splits:
         # it should NOT have perform basic slicing!
         assert_false(split.samples.base is ds.samples)
+        ok_(split.sa['chunks']._lazy is None)
         assert_equal(len(split.sa['targets'].unique), 1)
         assert_equal(len(split.sa['chunks'].unique), 10)
     assert_true(splits[-1].a.lastsplit)
@@ -18,6 +18,7 @@ from scipy import signal
 from mvpa2.datasets import Dataset
 
 from mvpa2.mappers.glm import *
+from mvpa2.mappers.glm.native_glm import MassUnivariateGLM, _ar1_whiten
 from mvpa2.misc.fx import double_gamma_hrf, single_gamma_hrf
 
 def get_bold():
@@ -54,14 +55,12 @@ def test_glm_mapper():
     assert_equal(bold.nfeatures, 2)
     assert('model' in bold.sa)
     reg_names = ['model']
-    implementations = []
+    implementations = [NativeGLMMapper]
     if externals.exists('nipy'):
         implementations.append(NiPyGLMMapper)
     if externals.exists('statsmodels'):
         implementations.append(StatsmodelsGLMMapper)
     results = []
-    if not len(implementations):
-        raise SkipTest
     for klass in implementations:
         pest = klass(reg_names)(bold)
         assert_equal(pest.shape, (len(reg_names), bold.nfeatures))
@@ -102,3 +101,64 @@ def test_glm_mapper():
     # should really have very similar results, independent of actual model fit details
     assert(np.corrcoef(ds1.samples.ravel(), ds2.samples.ravel())[0,1] > 0.99)
 
+
+
+@reseed_rng()
+def test_mass_univariate_glm():
+    nobs, nvars = 60, 30
+    X = np.vstack((np.linspace(-1, 1, nobs),
+                   np.random.randn(nobs),
+                   np.ones(nobs))).T
+    Y = np.dot(X, np.random.randn(3, nvars)) + np.random.randn(nobs, nvars)
+    glm = MassUnivariateGLM(X).fit(Y)
+    # same as separate least squares fits
+    for i in xrange(nvars):
+        b, ssr = np.linalg.lstsq(X, Y[:, i])[:2]
+        assert_array_almost_equal(glm.params[:, i], b)
+        assert_almost_equal(glm.ssr[i], ssr[0])
+    assert_equal(glm.df_resid, nobs - 3)
+    cov = np.linalg.inv(np.dot(X.T, X))
+    assert_array_almost_equal(
+        glm.bse, np.sqrt(np.diag(cov)[:, None] * glm.scale))
+    # t-contrast of a single parameter is its t-value
+    t = glm.t_test([1, 0, 0])
+    assert_array_almost_equal(t['tvalue'], glm.tvalues[0])
+    assert_array_almost_equal(t['pvalue'], glm.pvalues[0])
+    assert_array_almost_equal(t['effect'], glm.params[0])
+    # F-test of a single contrast is the squared t-test
+    f = glm.f_test([[1, 0, 0]])
+    assert_array_almost_equal(f['fvalue'], t['tvalue'] ** 2)
+    assert_array_almost_equal(f['pvalue'], t['pvalue'])
+    if externals.exists('statsmodels'):
+        import statsmodels.api as sm
+        for i in xrange(3):
+            res = sm.OLS(Y[:, i], X).fit()
+            assert_array_almost_equal(glm.tvalues[:, i], res.tvalues)
+            fres = res.f_test([[1, 0, 0], [0, 1, 0]])
+            assert_almost_equal(
+                glm.f_test([[1, 0, 0], [0, 1, 0]])['fvalue'][i],
+                np.asscalar(fres.fvalue))
+
+    # AR(1) noise is detected and whitened
+    noise = np.random.randn(nobs, nvars)
+    for i in xrange(1, nobs):
+        noise[i] += 0.6 * noise[i - 1]
+    Y = np.dot(X, np.random.randn(3, nvars)) + noise
+    glm = MassUnivariateGLM(X, ar1=True).fit(Y)
+    assert_true(0.2 < np.mean(glm.rho) < 0.8)
+    for i in (0, 7):
+        Xw = _ar1_whiten(X, glm.rho[i])
+        Yw = _ar1_whiten(Y[:, i], glm.rho[i])
+        assert_array_almost_equal(glm.params[:, i],
+                                  np.linalg.lstsq(Xw, Yw)[0])
+
+    # as mapper
+    ds = Dataset(Y, sa={'trend': X[:, 0], 'other': X[:, 1]})
+    for results, descr in (('tvalues', 'tvalues'),
+                           ([0, 1, 0], 'tvalue'),
+                           ([[1, 0, 0], [0, 1, 0]], 'fvalue')):
+        res = NativeGLMMapper(['trend', 'other'], add_constant=True,
+                              results=results, ar1=True)(ds)
+        assert_equal(res.nfeatures, nvars)
+        assert_equal(res.sa.descr[0], descr)
+    assert_raises(ValueError, MassUnivariateGLM(X).fit, Y[:10])
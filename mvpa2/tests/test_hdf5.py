@@ -21,7 +21,8 @@ import sys
 import tempfile
 
 from mvpa2.base.dataset import AttrDataset, save
-from mvpa2.base.hdf5 import h5save, h5load, obj2hdf, HDF5ConversionError
+from mvpa2.base.hdf5 import h5save, h5load, obj2hdf, HDF5ConversionError, \
+     HDF5Array
 from mvpa2.misc.data_generators import load_example_fmri_dataset
 from mvpa2.mappers.fx import mean_sample
 from mvpa2.mappers.boxcar import BoxcarMapper
@@ -420,6 +421,106 @@ def test_save_load_FlattenMapper(f):
     fm_ = saveload(fm, f)
     assert_equal(fm_.shape, fm.shape)
 
+@sweepargs(compression=(None, 'gzip'))
+@with_tempfile()
+def test_lazy_load(f, compression):
+    ds = datasets['uni2small'].copy()
+    ds.samples = ds.samples.astype(float)
+    kwargs = {'compression': compression} if compression else {}
+    h5save(f, ds, **kwargs)
+    for lds in (h5load(f, lazy=True),
+                AttrDataset.from_hdf5(f, lazy=True)):
+        if compression is None:
+            # plain memory-mapped array
+            assert_true(isinstance(lds.samples, np.ndarray))
+            assert_false(lds.samples.flags.writeable)
+        else:
+            assert_true(isinstance(lds.samples, HDF5Array))
+        assert_equal(lds.shape, ds.shape)
+        assert_array_equal(lds.sa.targets, ds.sa.targets)
+        assert_array_equal(lds.fa.nonbogus_targets, ds.fa.nonbogus_targets)
+        assert_array_equal(np.asarray(lds.samples), ds.samples)
+        # various selections read only the requested portion
+        mask = ds.sa.targets == ds.sa.targets[0]
+        for sel in ((slice(None), slice(None)),
+                    (slice(None, None, 3), slice(1, 4)),
+                    (slice(None, None, -2), [3, 0]),
+                    (mask, slice(None)),
+                    ([5, 1, 1, 7], [0, 5, 2]),
+                    ([2], np.arange(ds.nfeatures) % 2 == 0),
+                    (3, 1),
+                    ([], slice(None))):
+            lsub, sub = lds[sel], ds[sel]
+            assert_true(isinstance(lsub.samples, np.ndarray))
+            assert_array_equal(lsub.samples, sub.samples)
+            assert_array_equal(lsub.sa.chunks, sub.sa.chunks)
+            assert_array_equal(lsub.fa.nonbogus_targets,
+                               sub.fa.nonbogus_targets)
+        if compression is not None:
+            # orthogonal indexing directly on the array
+            assert_array_equal(lds.samples[[3, 1], [0, 4, 2]],
+                               ds.samples[np.ix_([3, 1], [0, 4, 2])])
+            assert_array_equal(lds.samples[-1], ds.samples[-1])
+            assert_raises(IndexError, lambda: lds.samples[len(ds)])
+            # copies are plain arrays
+            assert_true(isinstance(lds.copy(deep=True).samples, np.ndarray))
+
+
+@sweepargs(compression=(None, 'gzip'))
+@with_tempfile()
+def test_lazy_load_closes_file(f, compression):
+    ds = datasets['uni2small'].copy()
+    ds.samples = ds.samples.astype(float)
+    kwargs = {'compression': compression} if compression else {}
+    h5save(f, ds, **kwargs)
+    for load in (h5load, AttrDataset.from_hdf5):
+        lds = load(f, lazy=True)
+        if compression is not None:
+            # file is kept open for the samples
+            assert_true(lds.samples.file.id.valid)
+            assert_array_equal(lds[:3].samples, ds[:3].samples)
+            lds.samples.close()
+            assert_false(lds.samples._hdf.id.valid)
+            # closing is harmless
+            lds.samples.close()
+        # the file is not in use anymore, so it could be overwritten
+        h5save(f, ds, **kwargs)
+        # neither is it after a failure
+        assert_raises(ValueError, load, f, name='bogus', lazy=True)
+        h5save(f, ds, **kwargs)
+
+
+@sweepargs(layout=('samples', 'features', 'tiled', (5, 2)))
+@with_tempfile()
+def test_chunk_layouts(f, layout):
+    ds = datasets['uni2small'].copy()
+    ds.samples = ds.samples.astype(float)
+    # tiny chunks to get a few of them
+    ds.save(f, compression='gzip', layout=layout, chunk_bytes=128)
+    hdf = h5py.File(f, 'r')
+    try:
+        samples = hdf['rcargs']['items']['0']
+        chunks = samples.chunks
+        if layout in ('samples', 'tiled'):
+            assert_true(np.prod(chunks) * 8 <= 128)
+        if layout == 'samples':
+            assert_equal(chunks[1], ds.nfeatures)
+        elif layout == 'features':
+            assert_equal(chunks[0], len(ds))
+        elif layout == (5, 2):
+            assert_equal(chunks, layout)
+        # attributes are not affected
+        assert_false('chunk_layout' in hdf['rcargs']['items']['1'].attrs)
+    finally:
+        hdf.close()
+    lds = h5load(f, lazy=True)
+    assert_equal(lds.samples.layout, layout)
+    assert_array_equal(lds[[4, 2, 9], [5, 0, 3]].samples,
+                       ds[[4, 2, 9], [5, 0, 3]].samples)
+    assert_array_equal(h5load(f).samples, ds.samples)
+    assert_raises(ValueError, h5save, f, ds, layout='bogus')
+
+
 @with_tempfile()
 def test_versions(f):
     h5save(f, [])
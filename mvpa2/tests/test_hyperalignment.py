@@ -20,9 +20,12 @@ from mvpa2.mappers.zscore import zscore
 from mvpa2.misc.support import idhash
 from mvpa2.misc.data_generators import random_affine_transformation
 from mvpa2.misc.fx import get_random_rotation
+from mvpa2.mappers.procrustean import ProcrusteanMapper
 
 # Somewhat slow but provides all needed ;)
 from mvpa2.testing import sweepargs, reseed_rng
+from mvpa2.testing.tools import assert_array_almost_equal, \
+     assert_array_equal, assert_equal, assert_true, skip_if_no_external
 from mvpa2.testing.datasets import datasets
 
 from mvpa2.generators.partition import NFoldPartitioner
@@ -169,6 +172,84 @@ class HyperAlignmentTests(unittest.TestCase):
         rerrors = ha.ca.residual_errors.samples
         self.assertEqual(rerrors.shape, (1, n))
 
+    @reseed_rng()
+    def test_parallel_and_streaming(self):
+        ds4l = datasets['uni4large']
+        ds_orig = ds4l[:, ds4l.a.nonbogus_features]
+        dss = [random_affine_transformation(ds_orig, scale_fac=100,
+                                            shift_fac=10)
+               for i in xrange(4)]
+        ca = ['training_residual_errors', 'residual_errors']
+        ha = Hyperalignment(level2_niter=2, enable_ca=ca)
+        mappers = ha(dss)
+        for kwargs in (
+                # serial, but combining a list of all projected datasets
+                dict(combiner2=lambda l: np.mean(l, axis=0)),
+                dict(nproc=2, backend='threads'),
+                # there are more samples than features, so it is exact
+                dict(alignment=ProcrusteanMapper(space='commonspace',
+                                                 svd='truncated'))):
+            ha_ = Hyperalignment(level2_niter=2, enable_ca=ca, **kwargs)
+            mappers_ = ha_(dss)
+            assert_array_almost_equal(ha_.commonspace, ha.commonspace)
+            for c in ca:
+                assert_array_almost_equal(ha_.ca[c].value.samples,
+                                          ha.ca[c].value.samples)
+            for m, m_, ds in zip(mappers, mappers_, dss):
+                assert_array_almost_equal(m_.forward(ds.samples),
+                                          m.forward(ds.samples))
+
+    @reseed_rng()
+    def test_searchlight_hyperalignment(self):
+        skip_if_no_external('scipy')
+        import scipy.sparse as sp
+        from mvpa2.algorithms.searchlight_hyperalignment \
+             import SearchlightHyperalignment
+        from mvpa2.misc.neighborhood import IndexQueryEngine, Sphere
+        nfeatures = 8
+        ds_orig = Dataset(np.random.randn(60, nfeatures),
+                          fa={'voxel_indices': np.arange(nfeatures)[:, None]})
+        dss = []
+        for i in xrange(3):
+            ds = ds_orig.copy()
+            ds.samples = np.dot(ds.samples, get_random_rotation(nfeatures))
+            dss.append(ds)
+
+        # a single searchlight covering all features is plain hyperalignment
+        ha = Hyperalignment(zscore_all=True)
+        mappers = ha(dss)
+        slha = SearchlightHyperalignment(
+            queryengine=IndexQueryEngine(voxel_indices=Sphere(nfeatures)),
+            roi_ids=[0], zscore_all=True, zscore_common=False)
+        slmappers = slha(dss)
+        assert_array_almost_equal(slha.commonspace, ha.commonspace)
+        for m, slm, ds in zip(mappers, slmappers, dss):
+            assert_true(sp.issparse(slm.proj))
+            assert_equal(slm.proj.shape, (nfeatures, nfeatures))
+            zds = ds.copy()
+            zscore(zds, chunks_attr=None)
+            assert_array_almost_equal(slm.forward(zds.samples),
+                                      m.forward(ds.samples))
+
+        # local searchlights give sparse projections, independent of the
+        # processing in blocks and in parallel
+        qe = IndexQueryEngine(voxel_indices=Sphere(1))
+        slmappers = SearchlightHyperalignment(queryengine=qe)(dss)
+        for kwargs in (dict(nblocks=3),
+                       dict(nproc=2, backend='threads')):
+            slmappers_ = SearchlightHyperalignment(queryengine=qe,
+                                                   **kwargs)(dss)
+            for slm, slm_ in zip(slmappers, slmappers_):
+                assert_array_almost_equal(slm_.proj.toarray(),
+                                          slm.proj.toarray())
+        for slm, ds in zip(slmappers, dss):
+            proj = slm.proj.toarray()
+            # only features within two searchlights of each other interact
+            assert_array_equal(np.triu(proj, 3), 0)
+            assert_array_equal(np.tril(proj, -3), 0)
+            assert_equal(slm.forward(ds.samples).shape, ds.shape)
+            assert_equal(slm.reverse(slm.forward(ds.samples)).shape, ds.shape)
+
     def test_hypal_michael_caused_problem(self):
         from mvpa2.misc import data_generators
         from mvpa2.mappers.zscore import zscore
@@ -14,6 +14,7 @@ from mvpa2.testing import *
 from mvpa2.testing.datasets import pure_multivariate_signal
 
 from mvpa2.clfs.knn import kNN
+from mvpa2.datasets.base import Dataset
 from mvpa2.clfs.distance import one_minus_correlation
 
 class KNNTests(unittest.TestCase):
@@ -63,6 +64,55 @@ class KNNTests(unittest.TestCase):
         self.assertTrue(not (clf.ca.distances.fa['chunks'] is train.sa['chunks']))
         self.assertTrue(not (clf.ca.distances.fa.chunks is train.sa.chunks))
 
+    @sweepargs(voting=('majority', 'weighted'))
+    def test_knn_vectorized(self, voting):
+        train = pure_multivariate_signal(20, 3)
+        test = pure_multivariate_signal(20, 3)
+        # reference with all the distances computed at once
+        clf = kNN(k=5, voting=voting, enable_ca=['distances', 'estimates'])
+        clf.train(train)
+        p_ref = clf.predict(test.samples)
+        dists = clf.ca.distances.samples
+        estimates = clf.ca.estimates
+        # votes are the counts of classes among the 5 nearest neighbors
+        knns = dists.argsort(axis=1)[:, :5]
+        for e, nns in zip(estimates, knns):
+            labels = train.targets[nns]
+            for l in e:
+                assert_equal(e[l], np.sum(labels == l))
+        # and the winners got most votes
+        for p, e in zip(p_ref, estimates):
+            assert_equal(e[p], max(e.values()))
+
+        indexes = [None]
+        if externals.exists('scipy'):
+            indexes += ['kdtree', 'auto']
+        if externals.exists('skl'):
+            indexes.append('balltree')
+        for index in indexes:
+            for block_size in (None, 1, 7):
+                clf = kNN(k=5, voting=voting, index=index,
+                          block_size=block_size)
+                clf.train(train)
+                assert_equal(clf.predict(test.samples), p_ref)
+        # k larger than the number of training samples
+        clf = kNN(k=100, voting=voting)
+        clf.train(train)
+        assert_equal(len(clf.predict(test.samples)), len(test))
+
+
+    def test_knn_ties(self):
+        train = Dataset([[0.], [1.], [3.], [5.]], sa={'targets': [1, 2, 2, 1]})
+        clf = kNN(k=2, voting='majority', index=None)
+        clf.train(train)
+        # a tie in votes -- the class with the closer neighbors wins
+        assert_equal(clf.predict(np.array([[0.6], [4.4]])), [2, 1])
+        assert_raises(ValueError, kNN, voting='bogus')
+        assert_raises(ValueError, kNN, index='bogus')
+        assert_raises(ValueError, kNN, index='kdtree',
+                      dfx=one_minus_correlation)
+
+
 def suite():  # pragma: no cover
     return unittest.makeSuite(KNNTests)
 
@@ -122,3 +122,37 @@ def test_polydetrend():
     # but if done inplace that is no longer true
     poly_detrend(ds, chunks_attr='chunks', polyord=1, space='time')
     assert_array_equal(ds, mds)
+
+
+def test_polydetrend_vs_lstsq():
+    rng = np.random.RandomState(3)
+    # contiguous and interleaved chunks of different lengths
+    chunks = np.array([0] * 7 + [1, 2] * 6 + [3] * 9)
+    nsamples = len(chunks)
+    samples = rng.normal(size=(nsamples, 6)) \
+              + np.linspace(0, 5, nsamples)[:, None]
+    ds = Dataset(samples.copy(),
+                 sa={'chunks': chunks, 'motion': rng.normal(size=nsamples)})
+    dm = PolyDetrendMapper(chunks_attr='chunks', polyord=2,
+                           opt_regs=['motion'])
+    mds = dm.forward(ds)
+    # regressors of all chunks
+    regs = dm._regs
+    assert_equal(regs.shape, (nsamples, 4 * 3 + 1))
+    fit = np.linalg.lstsq(regs, samples)[0]
+    assert_array_almost_equal(mds.samples, samples - np.dot(regs, fit))
+    assert_array_equal(ds.samples, samples)
+
+    # float32 is not upcasted
+    ds32 = ds.copy(deep=True)
+    ds32.samples = ds32.samples.astype('float32')
+    mds32 = dm.forward(ds32)
+    assert_equal(mds32.samples.dtype, np.float32)
+    assert_array_almost_equal(mds32.samples, mds.samples, decimal=4)
+
+    # in-place detrending
+    dm_inplace = PolyDetrendMapper(chunks_attr='chunks', polyord=2,
+                                   opt_regs=['motion'], inplace=True)
+    mds_inplace = dm_inplace.forward(ds32)
+    ok_(mds_inplace is ds32)
+    assert_array_almost_equal(ds32.samples, mds.samples, decimal=4)
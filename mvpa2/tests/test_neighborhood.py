@@ -146,6 +146,21 @@ def test_sphere_scaled():
     ok_(len(res) == 27)
 
 
+def test_sphere_increments_vectorized():
+    # vectorized filtering matches per-offset evaluation of distances
+    for s in (ne.Sphere(2.5), ne.Sphere(3, element_sizes=(1.5, 2, 0.7)),
+              ne.Sphere(2, distance_func=manhatten_distance),
+              ne.Sphere(2, distance_func=absmin_distance),
+              ne.Sphere(2, distance_func=lambda x, y: np.abs(x - y)[0])):
+        ndim = len(s.element_sizes) if s.element_sizes else 3
+        es = np.asarray(s.element_sizes or np.ones(ndim))
+        erange = np.ceil(s.radius / es).astype(int)
+        target = [x for x in np.array(list(np.ndindex(tuple(erange*2 + 1))))
+                  - erange
+                  if s.distance_func(x * es, np.zeros(ndim)) <= s.radius]
+        assert_array_equal(s._get_increments(ndim), target)
+
+
 def test_hollowsphere_basic():
     hs = ne.HollowSphere(1, 0)
     assert_array_equal(hs((2, 1)),  [(1, 1), (2, 0), (2, 2), (3, 1)])
@@ -228,6 +243,64 @@ def test_query_engine():
                        [0, 1, 3, 9, 27, 28, 30, 36])
 
 
+def test_query_engine_precompute():
+    import shutil, tempfile
+    ds = datasets['3dlarge'].copy()
+    data = np.arange(54)
+    ind = np.transpose((np.ones((3, 3, 3)).nonzero()))
+    ds2 = Dataset([data, data], fa={'s_ind': np.concatenate((ind, ind)),
+                                    't_ind': np.repeat([0, 1], 27),
+                                    'lit': ['roi1', 'ro2', 'r3'] * 18})
+    for d, kwargs in (
+        (ds, dict(myspace=ne.Sphere(2))),
+        (ds, dict(myspace=ne.Sphere(2, element_sizes=(1.5, 1, 2)))),
+        (ds, dict(myspace=ne.HollowSphere(2, 1, include_center=True))),
+        (ds, dict(myspace=ne.Sphere(2, distance_func=manhatten_distance))),
+        (ds2, dict(s_ind=ne.Sphere(1), t_ind=None)),
+        (ds2, dict(s_ind=ne.Sphere(1), t_ind=None, lit=None)),
+        ):
+        qe = ne.IndexQueryEngine(**kwargs)
+        qe.train(d)
+        ok_(qe.neighborhood_index is None)
+        qep = ne.IndexQueryEngine(precompute=True, **kwargs)
+        ok_('precompute=True' in repr(qep))
+        qep.train(d)
+        nbindex = qep.neighborhood_index
+        assert_equal(len(nbindex), d.nfeatures)
+        for fid in xrange(d.nfeatures):
+            assert_array_equal(qep[fid], qe[fid])
+        assert_array_equal(nbindex.sizes,
+                           [len(qe[fid]) for fid in xrange(d.nfeatures)])
+        # unsorted ones differ only in order
+        qeu = ne.IndexQueryEngine(precompute=True, sorted=False, **kwargs)
+        qeu.train(d)
+        for fid in xrange(d.nfeatures):
+            assert_array_equal(sorted(qeu[fid]), qe[fid])
+
+    # query objects without vectorized support get queried one by one
+    qe = ne.IndexQueryEngine(myspace=ne.IdentityNeighborhood(),
+                             precompute=True)
+    qe.train(ds)
+    assert_array_equal(qe.neighborhood_index.indices, np.arange(ds.nfeatures))
+
+    # store and load memory-mapped
+    tmpdir = tempfile.mkdtemp()
+    try:
+        qe = ne.IndexQueryEngine(myspace=ne.Sphere(1), precompute=tmpdir)
+        qe.train(ds)
+        ok_(ne.NeighborhoodIndex.exists(tmpdir))
+        ok_(isinstance(qe.neighborhood_index.indices.base, np.memmap))
+        # cached one gets used without recomputing
+        qe2 = ne.IndexQueryEngine(myspace=ne.Sphere(1), precompute=tmpdir)
+        qe2._compute_neighborhood_index = None
+        qe2.train(ds)
+        assert_array_equal(qe2.neighborhood_index.indices,
+                           qe.neighborhood_index.indices)
+        assert_raises(ValueError, qe2.train, ds[:, :-1])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_cached_query_engine():
     """Test cached query engine
     """
@@ -262,18 +335,114 @@ def test_cached_query_engine():
     cmp_res(results_ind[0], results_ind[1])
 
     # Now do sanity checks
-    assert_raises(ValueError, qec.train, ds[:, :-1])
-    assert_raises(ValueError, qec.train, ds.copy())
+    # different set of features gets its own results
+    qe.train(ds[:, :-1])
+    qec.train(ds[:, :-1])
+    assert_equal(len(qec.ids), ds.nfeatures - 1)
+    cmp_res([qe[fid] for fid in xrange(ds.nfeatures - 1)],
+            [qec[fid] for fid in xrange(ds.nfeatures - 1)])
+    # and the copy shares the same cache without retraining the engine
     ds2 = ds.copy()
     qec.untrain()
     qec.train(ds2)
+    ok_(qec._trained_fingerprint != qec.fingerprint)
     # should be the same results on the copy
     cmp_res(results_ind[0], [qec[fid] for fid in xrange(ds.nfeatures)])
     cmp_res(results_kw[0], [qec(myspace=x) for x in ds.fa.myspace])
+    ok_(qec._trained_fingerprint != qec.fingerprint)
+    assert_equal(qec.ids, range(ds.nfeatures))
     ok_(qec.train(ds2) is None)
-    # unfortunately we are not catching those
-    #ds2.fa.myspace = ds2.fa.myspace*3
-    #assert_raises(ValueError, qec.train, ds2)
+    # modified relevant attributes are detected
+    ds2.fa.myspace = ds2.fa.myspace * 3
+    qec.train(ds2)
+    assert_equal(list(qec[0]), [0])
+    # irrelevant ones are not
+    ds3 = ds.copy()
+    ds3.fa['irrelevant'] = np.arange(ds.nfeatures)
+    fingerprint = qec._get_fingerprint(ds)
+    assert_equal(qec._get_fingerprint(ds3), fingerprint)
+    # but the engine is
+    ok_(fingerprint != ne.CachedQueryEngine(
+        ne.IndexQueryEngine(myspace=ne.Sphere(2)))._get_fingerprint(ds))
+    # must be trained before queried
+    qec.untrain()
+    assert_raises(RuntimeError, qec.query_byid, 0)
+
+
+def test_cached_query_engine_bounded_persistent():
+    import tempfile, os
+    ds = datasets['3dlarge']
+    qe = ne.IndexQueryEngine(myspace=ne.Sphere(1))
+    qe.train(ds)
+    qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                               maxsize=30)
+    ok_('maxsize=30' in repr(qec))
+    qec.train(ds)
+    for fid in xrange(ds.nfeatures):
+        assert_array_equal(qec[fid], qe[fid])
+    # only the most recent ones are kept within the bound
+    ok_(qec._size <= 30)
+    cached = [k[2] for k in qec._lookup]
+    assert_equal(cached, range(ds.nfeatures - len(cached), ds.nfeatures))
+    # access makes it the most recently used
+    qec[cached[0]]
+    qec[0]
+    assert_equal([k[2] for k in qec._lookup][-2:], [cached[0], 0])
+
+    # persistence
+    qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)))
+    qec.train(ds)
+    res = [qec[fid] for fid in xrange(ds.nfeatures)]
+    filename = tempfile.mktemp(suffix='.npz')
+    try:
+        qec.save(filename)
+        qec2 = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)))
+        qec2.load(filename)
+        qec2.train(ds)
+        for fid in xrange(ds.nfeatures):
+            assert_array_equal(qec2[fid], res[fid])
+        # no need to train the engine
+        ok_(qec2._trained_fingerprint is None)
+        assert_equal(list(qec2.ids), range(ds.nfeatures))
+        qec2.clear()
+        assert_array_equal(qec2[0], res[0])
+        ok_(qec2._trained_fingerprint is not None)
+    finally:
+        os.unlink(filename)
+
+
+def test_cached_query_engine_threads():
+    import threading, cPickle
+    ds = datasets['3dlarge']
+    qe = ne.IndexQueryEngine(myspace=ne.Sphere(1))
+    qe.train(ds)
+    qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                               maxsize=30)
+    qec.train(ds)
+    errors = []
+    def query(fids):
+        try:
+            for fid in fids:
+                assert_array_equal(qec[fid], qe[fid])
+        except Exception, e:
+            errors.append(e)
+    # the same features get queried by all threads, in varying order
+    threads = [threading.Thread(
+                   target=query,
+                   args=(np.random.permutation(ds.nfeatures).tolist() * 3,))
+               for i in xrange(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert_equal(errors, [])
+    # bookkeeping remained consistent
+    assert_equal(qec._size, sum(len(v) for v in qec._lookup.itervalues()))
+    ok_(qec._size <= 30)
+    # could be pickled (e.g. for HDF5 storage), despite the lock
+    qec2 = cPickle.loads(cPickle.dumps(qec))
+    assert_array_equal(qec2[0], qe[0])
+
 
 def test_scattered_neighborhoods():
     radius = 1
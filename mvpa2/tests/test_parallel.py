@@ -0,0 +1,145 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Unit tests for parallelization backends"""
+
+import os
+import numpy as np
+
+import shutil
+
+from mvpa2.base.parallel import get_backend, get_nproc, parallel_map, \
+     backends, _jobs, share_dataset
+from mvpa2.datasets.base import Dataset
+from mvpa2.base import externals
+from mvpa2.testing.tools import ok_, assert_raises, assert_equal, \
+     assert_array_equal, skip_if_no_external, SkipTest
+from mvpa2.testing.sweep import sweepargs
+
+
+def test_get_backend():
+    for b in backends:
+        assert_equal(get_backend(b), b)
+        assert_equal(get_backend(b.upper()), b)
+    ok_(get_backend('auto') in backends)
+    ok_(get_backend() in backends)
+    assert_raises(ValueError, get_backend, 'magic')
+
+
+def test_get_nproc():
+    assert_equal(get_nproc(4, 'serial'), 1)
+    assert_equal(get_nproc(4, 'threads'), 4)
+    ok_(get_nproc(None, 'threads') >= 1)
+
+
+@sweepargs(backend=backends)
+def test_parallel_map(backend):
+    if backend == 'pprocess':
+        skip_if_no_external('pprocess')
+    # does not need to be picklable
+    offset = np.arange(3)
+    def fx(x, power=1):
+        return (offset + x) ** power, os.getpid()
+
+    tasks = [((i,), dict(power=i % 3)) for i in range(7)]
+    results = list(parallel_map(fx, tasks, nproc=3, backend=backend))
+    assert_equal(len(results), len(tasks))
+    for i, (r, pid) in enumerate(results):
+        assert_array_equal(r, (offset + i) ** (i % 3))
+    if backend in ('multiprocessing', 'pprocess'):
+        ok_(not os.getpid() in [pid for r, pid in results])
+    else:
+        ok_(np.all([pid == os.getpid() for r, pid in results]))
+    # nothing left behind
+    assert_equal(len(_jobs), 0)
+
+    # unordered results are the same up to the order
+    results = list(parallel_map(fx, tasks, nproc=3, backend=backend,
+                                ordered=False))
+    assert_equal(sorted([tuple(r) for r, pid in results]),
+                 sorted([tuple((offset + i) ** (i % 3)) for i in range(7)]))
+
+
+@sweepargs(backend=('serial', 'threads', 'multiprocessing'))
+def test_parallel_map_iterator(backend):
+    generated = []
+    def gen_tasks():
+        for i in xrange(1000):
+            generated.append(i)
+            yield (i,), dict(power=2)
+    def fx(x, power=1):
+        return x ** power
+
+    results = parallel_map(fx, gen_tasks(), nproc=2, backend=backend)
+    for i, r in enumerate(results):
+        assert_equal(r, i ** 2)
+        if i == 9:
+            break
+    # tasks are generated only a few ahead of the consumed results
+    ok_(len(generated) < 100)
+    results.close()
+    assert_equal(len(_jobs), 0)
+    # exhausting the iterator
+    assert_equal(list(parallel_map(fx, iter([((i,), {}) for i in range(5)]),
+                                   nproc=2, backend=backend)),
+                 range(5))
+    assert_equal(len(_jobs), 0)
+
+
+@sweepargs(backend=('serial', 'threads', 'multiprocessing'))
+def test_parallel_map_exception(backend):
+    def fx(x):
+        if x == 2:
+            raise ValueError("bad %d" % x)
+        return x
+    tasks = [((i,), {}) for i in range(4)]
+    assert_raises(ValueError, list,
+                  parallel_map(fx, tasks, nproc=2, backend=backend))
+    assert_equal(len(_jobs), 0)
+
+
+def test_parallel_map_dead_worker():
+    if not hasattr(os, 'fork'):
+        raise SkipTest("Test requires fork")
+    def fx(x):
+        if x == 2:
+            # as if killed by the OOM killer
+            os._exit(1)
+        return x
+    tasks = [((i,), {}) for i in range(4)]
+    assert_raises(RuntimeError, list,
+                  parallel_map(fx, tasks, nproc=2,
+                               backend='multiprocessing'))
+    assert_equal(len(_jobs), 0)
+
+
+def test_share_dataset():
+    ds = Dataset(np.arange(24, dtype=np.float32).reshape((4, 6)),
+                 sa=dict(targets=['a', 'b', 'a', 'b'], chunks=range(4)),
+                 fa=dict(voxel_indices=np.arange(12).reshape((6, 2))),
+                 a=dict(some='thing'))
+    sds, tmpdir = share_dataset(ds)
+    try:
+        # numeric arrays are memory mapped, others are not
+        for v, orig in ((sds.samples, ds.samples),
+                        (sds.sa.chunks, ds.sa.chunks),
+                        (sds.fa.voxel_indices, ds.fa.voxel_indices)):
+            ok_(isinstance(v.base, np.memmap))
+            assert_array_equal(v, orig)
+            assert_equal(v.dtype, orig.dtype)
+            # read-only
+            assert_raises((ValueError, RuntimeError), v.__setitem__, 0, 1)
+        ok_(not isinstance(sds.sa.targets.base, np.memmap))
+        assert_array_equal(sds.sa.targets, ds.sa.targets)
+        assert_equal(sds.a.some, 'thing')
+        assert_equal(len(os.listdir(tmpdir)), 3)
+        # computations give regular arrays
+        ok_(type(sds.samples.mean(axis=0)) is np.ndarray)
+        ok_(type(sds[:, [1, 2]].samples) is np.ndarray)
+    finally:
+        shutil.rmtree(tmpdir)
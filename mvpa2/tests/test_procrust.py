@@ -19,7 +19,7 @@ from mvpa2.testing import *
 from mvpa2.testing.datasets import *
 from mvpa2.mappers.procrustean import ProcrusteanMapper
 
-svds = ['numpy']
+svds = ['numpy', 'truncated']
 if externals.exists('liblapack.so'):
     svds += ['dgesvd']
 if externals.exists('scipy'):
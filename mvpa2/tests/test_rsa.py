@@ -17,6 +17,7 @@ from mvpa2.measures.anova import OneWayAnova
 import numpy as np
 from mvpa2.mappers.fx import *
 from mvpa2.datasets.base import dataset_wizard, Dataset
+from mvpa2.datasets import hstack
 
 from mvpa2.testing.tools import *
 
@@ -137,3 +138,50 @@ def test_PDistTargetSimilarity():
 
 
 
+
+
+def _get_batch(ds, rois):
+    """Padded samples and mask for a batch of ROIs"""
+    maxf = max([len(r) for r in rois])
+    mask = np.zeros((len(rois), maxf), dtype=bool)
+    samples = np.zeros((len(ds), len(rois), maxf))
+    for i, r in enumerate(rois):
+        mask[i, :len(r)] = True
+        samples[:, i, :len(r)] = ds.samples[:, r]
+    return samples, mask
+
+
+def test_batches():
+    ds = Dataset(np.hstack((data, data[::-1] ** 2)),
+                 sa=dict(targets=range(len(data))))
+    rois = [[0, 1, 2], [3, 4, 5, 6, 7], [1, 8, 9, 4], [2, 7]]
+    samples, mask = _get_batch(ds, rois)
+    tdsm = np.arange(15) % 4
+    for m in [PDist(pairwise_metric=metric, center_data=center,
+                    square=square)
+              for metric in ('correlation', 'cosine', 'euclidean',
+                             'sqeuclidean')
+              for center in (False, True)
+              for square in (False, True)] \
+             + [PDistTargetSimilarity(tdsm, pairwise_metric=metric,
+                                      center_data=center,
+                                      corrcoef_only=corrcoef_only)
+                for metric in ('correlation', 'euclidean')
+                for center in (False, True)
+                for corrcoef_only in (False, True)]:
+        ok_(m.is_batchable)
+        res = m.call_batch(samples, mask, ds)
+        target = hstack([m(ds[:, r]) for r in rois])
+        assert_array_almost_equal(res.samples, target.samples)
+        assert_equal(sorted(res.sa.keys()), sorted(target.sa.keys()))
+        for k in target.sa.keys():
+            assert_array_equal(res.sa[k].value, target.sa[k].value)
+        for k in target.fa.keys():
+            assert_array_equal(res.fa[k].value, target.fa[k].value)
+
+    # not batchable
+    ok_(not PDist(pairwise_metric='chebyshev').is_batchable)
+    ok_(not PDistTargetSimilarity(tdsm,
+                                  comparison_metric='spearman').is_batchable)
+    ok_(not PDist(postproc=lambda x: x).is_batchable)
+    ok_(not PDistConsistency().is_batchable)
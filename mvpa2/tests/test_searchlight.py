@@ -40,6 +40,14 @@ from mvpa2.generators.permutation import AttributePermutator
 from mvpa2.measures.base import CrossValidation
 
 
+def _assert_datasets_equal(x, y):
+    assert_array_equal(x.samples, y.samples)
+    for cx, cy in ((x.sa, y.sa), (x.fa, y.fa)):
+        assert_equal(sorted(cx.keys()), sorted(cy.keys()))
+        for k in cx.keys():
+            assert_array_equal(cx[k].value, cy[k].value)
+
+
 class SearchlightTests(unittest.TestCase):
 
     def setUp(self):
@@ -53,11 +61,10 @@ class SearchlightTests(unittest.TestCase):
     # https://github.com/PyMVPA/PyMVPA/issues/67
     # https://github.com/PyMVPA/PyMVPA/issues/69
     def test_gnbsearchlight_doc(self):
-        # Test either we excluded nproc from the docstrings
-        ok_(not 'nproc' in GNBSearchlight.__init__.__doc__)
-        ok_(not 'nproc' in GNBSearchlight.__doc__)
-        ok_(not 'nproc' in sphere_gnbsearchlight.__doc__)
-        # but present elsewhere
+        # Test either we documented nproc (splits are processed in
+        # parallel) in the docstrings
+        ok_('nproc' in GNBSearchlight.__init__.__doc__)
+        ok_('nproc' in sphere_gnbsearchlight.__doc__)
         ok_('nproc' in sphere_searchlight.__doc__)
         ok_('nproc' in Searchlight.__init__.__doc__)
 
@@ -183,9 +190,24 @@ class SearchlightTests(unittest.TestCase):
         if externals.exists('scipy'):
             sls += [ SL(sllrn, partitioner, indexsum='sparse', **skwargs)]
 
+        # dense indicator matrices and benchmarked choice of the engine
+        sls += [SL(sllrn, partitioner, indexsum=indexsum,
+                   **dict(skwargs, enable_ca=skwargs['enable_ca']
+                                             + ['indexsum_timings']))
+                for indexsum in ('dense', 'auto')]
+
+        # splits processed in parallel
+        sls += [SL(sllrn, partitioner, nproc=2, backend=backend, **skwargs)
+                for backend in ('multiprocessing', 'threads')]
+
         # Test nproc just once
-        if externals.exists('pprocess') and not self._tested_pprocess:
-            sls += [sphere_searchlight(cv, nproc=2, **skwargs)]
+        if not self._tested_pprocess:
+            backends = ['multiprocessing', 'threads']
+            if externals.exists('pprocess'):
+                backends += ['pprocess']
+            sls += [sphere_searchlight(cv, nproc=2, backend=backend,
+                                       **skwargs)
+                    for backend in backends]
             self._tested_pprocess = True
 
         # Provide the dataset and all those searchlights for testing
@@ -240,6 +262,11 @@ class SearchlightTests(unittest.TestCase):
 
             # check base-class state
             self.assertEqual(sl.ca.raw_results.nfeatures, nroi)
+            if getattr(sl, 'indexsum', None) == 'auto':
+                timings = sl.ca.indexsum_timings
+                self.assertTrue(set(timings) >= set(['fancy', 'dense']))
+                assert_equal(sl.ca.indexsum_engine,
+                             min(timings, key=timings.get))
 
             # Test if we got results correctly for 'selected' roi ids
             if do_roi:
@@ -254,15 +281,22 @@ class SearchlightTests(unittest.TestCase):
             self.assertTrue(dmax <= 1e-13)
 
         # Test the searchlight's reuse of neighbors
-        for indexsum in ['fancy'] + (
+        for indexsum in ['fancy', 'dense', 'auto'] + (
             externals.exists('scipy') and ['sparse'] or []):
-            sl = SL(sllrn, partitioner, indexsum='fancy',
+            sl = SL(sllrn, partitioner, indexsum=indexsum,
                     reuse_neighbors=True, **skwargs)
             mvpa2.seed()
             result1 = sl(ds)
+            engine = sl.ca.indexsum_engine
+            if indexsum == 'auto':
+                self.assertTrue(engine in ('fancy', 'dense', 'sparse'))
+            else:
+                assert_equal(engine, indexsum)
             mvpa2.seed()
             result2 = sl(ds)                # must be faster
             assert_array_equal(result1, result2)
+            # the same engine is used while reusing neighbors
+            assert_equal(sl.ca.indexsum_engine, engine)
 
     @reseed_rng()
     def test_adhocsearchlight_perm_testing(self):
@@ -628,17 +662,293 @@ class SearchlightTests(unittest.TestCase):
         assert_equal(len(tempfiles), 0)
 
 
-    def test_nblocks(self):
-        skip_if_no_external('pprocess')
+    @sweepargs(backend=('multiprocessing', 'threads', 'pprocess'))
+    def test_nblocks(self, backend):
+        if backend == 'pprocess':
+            skip_if_no_external('pprocess')
         # just a basic test to see that we are getting the same
         # results with different nblocks
         ds = datasets['3dsmall'].copy(deep=True)[:, :13]
         ds.fa['voxel_indices'] = ds.fa.myspace
         cv = CrossValidation(GNB(), OddEvenPartitioner())
-        res1 = sphere_searchlight(cv, radius=1, nproc=2)(ds)
-        res2 = sphere_searchlight(cv, radius=1, nproc=2, nblocks=5)(ds)
+        res1 = sphere_searchlight(cv, radius=1, nproc=2, backend=backend)(ds)
+        res2 = sphere_searchlight(cv, radius=1, nproc=2, nblocks=5,
+                                  backend=backend)(ds)
+        assert_array_equal(res1, res2)
+        # and the same as serial
+        res3 = sphere_searchlight(cv, radius=1, nproc=1)(ds)
+        assert_array_equal(res1, res3)
+
+
+    @sweepargs(schedule=('static', 'dynamic', 'balanced'))
+    def test_schedule(self, schedule):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :17]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), OddEvenPartitioner())
+        res_serial = sphere_searchlight(cv, radius=1, nproc=1)(ds)
+        sl = sphere_searchlight(cv, radius=1, nproc=2, schedule=schedule,
+                                backend='multiprocessing',
+                                enable_ca=['block_timings'])
+        res = sl(ds)
+        assert_array_equal(res_serial, res)
+        assert_array_equal(res.fa.center_ids, np.arange(ds.nfeatures))
+        timings = sl.ca.block_timings
+        # all ROIs were processed exactly once
+        assert_equal(sum([t['nrois'] for t in timings]), ds.nfeatures)
+        assert_equal(sorted([t['iblock'] for t in timings]),
+                     range(len(timings)))
+        if schedule == 'static':
+            assert_equal(len(timings), 2)
+        else:
+            ok_(len(timings) > 2)
+        for t in timings:
+            ok_(t['duration'] >= 0)
+            ok_(t['worker'])
+
+        assert_raises(ValueError, sphere_searchlight, cv, schedule='magic')
+
+    @sweepargs(backend=('multiprocessing', 'threads'))
+    def test_share_dataset(self, backend):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), OddEvenPartitioner())
+        res1 = sphere_searchlight(cv, radius=1, nproc=1)(ds)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            res2 = sphere_searchlight(cv, radius=1, nproc=2, backend=backend,
+                                      share_dataset=tmpdir)(ds)
+            # shared files got cleaned up
+            assert_equal(os.listdir(tmpdir), [])
+        finally:
+            os.rmdir(tmpdir)
         assert_array_equal(res1, res2)
 
+    @sweepargs(nproc=(1, 2))
+    @sweepargs(postproc=(None, lambda x: x))
+    def test_checkpoint_resume(self, nproc, postproc):
+        skip_if_no_external('h5py')
+        import shutil
+        ds = datasets['3dsmall'].copy(deep=True)[:, :20]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        ds.fa['ids'] = np.arange(ds.nfeatures)
+        ca = ['roi_sizes', 'roi_center_ids']
+        fail_at = [None]
+        def measure(roi):
+            center = roi.fa.ids[roi.fa.roi_seed][0]
+            if center == fail_at[0]:
+                raise RuntimeError("pre-empted at %d" % center)
+            return np.array([roi.samples.mean(), center])
+
+        def get_sl(measure=measure, radius=1, **kwargs):
+            return sphere_searchlight(measure, radius=radius, nproc=nproc,
+                                      add_center_fa=True, nblocks=5,
+                                      results_postproc_fx=postproc,
+                                      enable_ca=ca, **kwargs)
+        sl_full = get_sl()
+        res_full = sl_full(ds)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            sl = get_sl(checkpoint_dir=tmpdir)
+            ok_("checkpoint_dir=%r" % tmpdir in repr(sl))
+            # blocks of 4 ROIs each -- fails in the 3rd block
+            fail_at[0] = 9
+            assert_raises(RuntimeError, sl, ds)
+            blocks = sorted(f for f in os.listdir(tmpdir)
+                            if f.startswith('block-'))
+            ok_('manifest.json' in os.listdir(tmpdir))
+            ok_(len(blocks) >= 2)
+            ok_('block-000000000-000000004.hdf5' in blocks)
+            ok_(not 'block-000000008-000000004.hdf5' in blocks)
+
+            # resume: only the remaining ROIs get computed
+            fail_at[0] = None
+            sl.ca.enable('block_timings')
+            res = sl(ds)
+            _assert_datasets_equal(res, res_full)
+            for c in ca:
+                assert_array_equal(sl.ca[c].value, sl_full.ca[c].value)
+            assert_equal(sum(t['nrois'] for t in sl.ca.block_timings),
+                         ds.nfeatures - 4 * len(blocks))
+            # everything got cleaned up upon completion
+            assert_equal(os.listdir(tmpdir), [])
+
+            # checkpoints of a different computation are refused
+            fail_at[0] = 9
+            assert_raises(RuntimeError, sl, ds)
+            fail_at[0] = None
+            assert_raises(ValueError, sl, ds[:, :19])
+            # ... also for a different neighborhood or measure
+            assert_raises(ValueError,
+                          get_sl(radius=2, checkpoint_dir=tmpdir), ds)
+            def measure2(roi):
+                return np.array([roi.samples.std(), 0])
+            assert_raises(ValueError,
+                          get_sl(measure=measure2, checkpoint_dir=tmpdir), ds)
+            # but not for an identical one
+            res = get_sl(checkpoint_dir=tmpdir)(ds)
+            _assert_datasets_equal(res, res_full)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lazy_roi_attributes(self):
+        ds = datasets['3dsmall'].copy(deep=True)
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        lazy = []
+        def measure(roi):
+            # attributes of the ROI were not selected
+            lazy.append(roi.sa['targets']._lazy is not None
+                        and roi.fa['voxel_indices']._lazy is not None)
+            # but are available
+            assert_equal(len(roi.fa.voxel_indices), roi.nfeatures)
+            # samples are a copy
+            ok_(not roi.samples.base is ds.samples)
+            return np.array([roi.samples.mean()])
+        # in the same process, to collect the flags
+        res = sphere_searchlight(measure, radius=1, nproc=1)(ds)
+        assert_equal(len(lazy), ds.nfeatures)
+        ok_(all(lazy))
+
+    def test_adhoc_searchlight_serial_by_default(self):
+        import mvpa2.measures.adhocsearchlightbase as adhoc
+        ds = datasets['3dsmall'].copy(deep=True)
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        nproc_calls = []
+        parallel_map = adhoc.parallel_map
+        def parallel_map_(*args, **kwargs):
+            nproc_calls.append(kwargs['nproc'])
+            return parallel_map(*args, **kwargs)
+        adhoc.parallel_map = parallel_map_
+        try:
+            res = sphere_gnbsearchlight(GNB(), NFoldPartitioner(),
+                                        radius=1)(ds)
+            # splits were not processed in parallel with default nproc
+            assert_equal(nproc_calls, [])
+            res_parallel = sphere_gnbsearchlight(GNB(), NFoldPartitioner(),
+                                                 radius=1, nproc=2)(ds)
+            assert_equal(nproc_calls, [2])
+        finally:
+            adhoc.parallel_map = parallel_map
+        assert_array_equal(res.samples, res_parallel.samples)
+
+    def test_precomputed_neighborhoods(self):
+        ds = datasets['3dsmall'].copy(deep=True)
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        measure = lambda roi: np.array([roi.nfeatures,
+                                        np.argmax(roi.fa.roi_seed)])
+        res = []
+        for precompute in (False, True):
+            qe = IndexQueryEngine(voxel_indices=Sphere(1),
+                                  precompute=precompute)
+            sl = Searchlight(measure, queryengine=qe, add_center_fa=True,
+                             enable_ca=['roi_feature_ids'])
+            res.append(sl(ds))
+            if precompute:
+                ok_(qe.neighborhood_index is not None)
+        _assert_datasets_equal(res[0], res[1])
+
+    @sweepargs(postproc=(None, lambda x: x))
+    def test_batched_measure(self, postproc):
+        skip_if_no_external('scipy')
+        from mvpa2.measures.rsa import PDistTargetSimilarity
+        ds = datasets['3dsmall'].copy(deep=True)
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        tdsm = np.arange(len(ds) * (len(ds) - 1) / 2) % 7
+        measure = PDistTargetSimilarity(tdsm, corrcoef_only=True)
+        ok_(measure.is_batchable)
+        ca = ['roi_sizes', 'roi_feature_ids', 'roi_center_ids']
+        calls = []
+        def measure_roi(roi):
+            calls.append(1)
+            return measure(roi)
+        res = []
+        for m in (measure_roi, measure):
+            sl = sphere_searchlight(m, radius=1, enable_ca=ca,
+                                    results_postproc_fx=postproc)
+            # few ROIs per batch
+            sl._batch_nelements = 7 * len(ds) * 5
+            res.append((sl(ds), sl))
+        # the batched one did not go through the per-ROI path
+        assert_equal(len(calls), ds.nfeatures)
+        (res1, sl1), (res2, sl2) = res
+        assert_array_almost_equal(res1.samples, res2.samples)
+        assert_array_equal(res1.fa.center_ids, res2.fa.center_ids)
+        assert_array_equal(res1.fa.metrics, res2.fa.metrics)
+        for c in ca:
+            for x, y in zip(sl1.ca[c].value, sl2.ca[c].value):
+                assert_array_equal(x, y)
+
+    def test_balanced_blocks(self):
+        ds = datasets['3dsmall'].copy(deep=True)
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        sl = sphere_searchlight(None, radius=1, schedule='balanced', nblocks=4)
+        sl.queryengine.train(ds)
+        roi_ids = np.arange(ds.nfeatures)
+        blocks = sl._get_roi_blocks(roi_ids, 2)
+        assert_array_equal(np.hstack(blocks), roi_ids)
+        costs = [sum(len(sl.queryengine[f]) for f in b) for b in blocks]
+        # blocks are balanced up to a size of a single ROI
+        ok_(max(costs) - min(costs) <= 2 * 7)
+
+    @sweepargs(nproc=(1, 2))
+    def test_streaming_results(self, nproc):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :15]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), NFoldPartitioner())
+        ca = ['roi_sizes', 'roi_feature_ids', 'roi_center_ids']
+
+        def get_sl(**kwargs):
+            return sphere_searchlight(cv, radius=1, nproc=nproc,
+                                      enable_ca=ca, **kwargs)
+        sl_stream = get_sl()
+        ok_(sl_stream._stream)
+        # any results_postproc_fx forces collection of per-ROI results
+        sl_list = get_sl(results_postproc_fx=lambda x: x)
+        ok_(not sl_list._stream)
+        res_stream = sl_stream(ds)
+        res_list = sl_list(ds)
+        _assert_datasets_equal(res_stream, res_list)
+        for c in ca:
+            assert_equal(len(sl_stream.ca[c].value), ds.nfeatures)
+            for x, y in zip(sl_stream.ca[c].value, sl_list.ca[c].value):
+                assert_array_equal(x, y)
+
+        # varying number of results per ROI, plain (non-dataset) results
+        def measure(ds_):
+            return np.arange(ds_.nfeatures) + ds_.fa.center_ids[0]
+        ds.fa['center_ids'] = np.arange(ds.nfeatures)
+        for kwargs in ({}, dict(disable_ca=ca)):
+            sl_stream = sphere_searchlight(measure, radius=1, nproc=nproc,
+                                           **kwargs)
+            sl_list = sphere_searchlight(measure, radius=1, nproc=nproc,
+                                         results_postproc_fx=lambda x: x,
+                                         **kwargs)
+            # center_ids do not match the number of features
+            assert_raises(ValueError, sl_stream, ds)
+            assert_raises(ValueError, sl_list, ds)
+
+    def test_streaming_hstack(self):
+        from mvpa2.measures.searchlight import _StreamingHStack
+        dss = [Dataset(np.arange(6).reshape((3, 2)) + i * 10,
+                       sa=dict(targets=range(3)),
+                       fa=dict(name=['f%d' % i, 'feat%d' % i],
+                               ids=[i, i]))
+               for i in range(5)]
+        dss[3].samples = dss[3].samples.astype(float) + 0.5
+        sink = _StreamingHStack(5)
+        for i in (2, 0, 4, 1, 3):
+            sink.add(dss[i], i)
+        res = sink.get()
+        _assert_datasets_equal(res, hstack(dss))
+        eq_(res.samples.dtype, np.float)
+        eq_(res.fa.name.dtype, hstack(dss).fa.name.dtype)
+
+        # blocks of units and fall back to pieces if varying nfeatures
+        sink = _StreamingHStack(5)
+        sink.add(hstack(dss[:2]), 0, 2)
+        sink.add(dss[4][:, :1], 4)
+        sink.add(hstack(dss[2:4]), 2, 2)
+        _assert_datasets_equal(sink.get(), hstack(dss[:4] + [dss[4][:, :1]]))
 
     def test_custom_results_fx_logic(self):
         # results_fx was introduced for the blow-up-the-memory-Swaroop
@@ -655,7 +965,6 @@ class SearchlightTests(unittest.TestCase):
         # handled by the results_fx function and removed in this case
         # to check if we indeed have desired high number of blocks while
         # only limited nproc.
-        skip_if_no_external('pprocess')
 
         tfile = tempfile.mktemp('mvpa', 'test-sl')
 
@@ -734,6 +1043,7 @@ class SearchlightTests(unittest.TestCase):
         sl = sphere_searchlight(measure,
                                 radius=0,
                                 nproc=nproc,
+                                backend='multiprocessing',
                                 nblocks=nblocks,
                                 results_postproc_fx=results_postproc_fx,
                                 results_fx=results_fx,
@@ -11,9 +11,14 @@
 from mvpa2.testing import *
 from mvpa2.testing.datasets import datasets
 
+import os
+import sys
+
+import mvpa2
 from mvpa2 import cfg
 from mvpa2.base import externals
-from mvpa2.clfs.stats import MCNullDist, FixedNullDist, NullDist
+from mvpa2.clfs.stats import MCNullDist, FixedNullDist, NullDist, \
+     Nonparametric, NonparametricArray
 from mvpa2.generators.permutation import AttributePermutator
 from mvpa2.datasets import Dataset
 from mvpa2.measures.anova import OneWayAnova, CompoundOneWayAnova
@@ -80,6 +85,162 @@ class StatsTests(unittest.TestCase):
             self.assertRaises(ValueError, null.p, [5, 3, 4])
 
 
+    def test_mcnulldist_parallel(self):
+        ds = datasets['uni2small']
+        def get_null(**kwargs):
+            return MCNullDist(AttributePermutator('targets', count=20),
+                              tail='right', **kwargs)
+        mseed = mvpa2.get_random_seed()
+        mvpa2.seed(mseed)
+        null = get_null()
+        null.fit(OneWayAnova(), ds)
+        for backend in ('threads', 'multiprocessing'):
+            null_p = get_null(nproc=2, backend=backend)
+            ok_('nproc=2' in repr(null_p))
+            mvpa2.seed(mseed)
+            null_p.fit(OneWayAnova(), ds)
+            # the same permutations were evaluated
+            assert_array_equal(null.ca.dist_samples.samples,
+                               null_p.ca.dist_samples.samples)
+            assert_equal(null_p.ca.stopped_early, None)
+
+
+    def test_mcnulldist_parallel_random_measure(self):
+        if not hasattr(os, 'fork'):
+            raise SkipTest("Test requires fork")
+        ds = datasets['uni2small']
+        anova = OneWayAnova()
+        def measure(ds):
+            # draws random numbers, as e.g. a classifier with random
+            # initialization would
+            res = anova(ds)
+            res.samples = res.samples + np.random.uniform(size=res.shape)
+            return res
+        def get_null(**kwargs):
+            return MCNullDist(AttributePermutator('targets', count=20),
+                              tail='right', **kwargs)
+        mseed = mvpa2.get_random_seed()
+        dist_samples = []
+        # several batches get computed in parallel
+        for m, kwargs in ((anova, {}),
+                          (measure, {}),
+                          (measure, dict(nproc=2,
+                                         backend='multiprocessing'))):
+            null = get_null(**kwargs)
+            mvpa2.seed(mseed)
+            null.fit(m, ds)
+            dist_samples.append(null.ca.dist_samples.samples)
+        assert_array_equal(dist_samples[1], dist_samples[2])
+        # random numbers of the measure do not affect the permutations,
+        # but differ among them
+        noise = dist_samples[1] - dist_samples[0]
+        ok_(np.all(noise >= 0) and np.all(noise < 1))
+        ok_(len(np.unique(noise[0, 0])) == noise.shape[-1])
+
+
+    @reseed_rng()
+    def test_mcnulldist_early_stop(self):
+        ds = datasets['uni2small']
+        permutator = AttributePermutator('targets', count=1000)
+        null = MCNullDist(permutator, tail='right', early_stop_alpha=0.05,
+                          early_stop_step=10, early_stop_confidence=0.9)
+        ok_('early_stop_alpha=0.05' in repr(null))
+        skip_if_no_external('scipy')
+        # make all the features strongly informative, so p-values are
+        # decided quickly
+        ds = ds.copy()
+        ds.samples += 10 * (ds.sa.targets == ds.UT[0])[:, None]
+        null.fit(OneWayAnova(), ds)
+        # has not gone through all the permutations
+        ok_(null.ca.stopped_early is not None)
+        ok_(null.ca.stopped_early < permutator.count)
+        assert_equal(null.ca.stopped_early % 10, 0)
+        assert_equal(null.ca.dist_samples.shape[-1], null.ca.stopped_early)
+        assert_true(np.all(null.p(OneWayAnova()(ds).samples) < 0.05))
+
+
+    def test_mcnulldist_early_stop_fraction(self):
+        skip_if_no_external('scipy')
+        permutator = AttributePermutator('targets', count=1000)
+        # 3 elements are decided, one has p-value right at alpha
+        counts_ge = np.array([0, 2, 500, 50])
+        counts_le = 1000 - counts_ge
+        for fraction, decided in ((1.0, False), (0.8, False), (0.75, True)):
+            null = MCNullDist(permutator, tail='right', early_stop_alpha=0.05,
+                              early_stop_fraction=fraction)
+            if fraction != 1.0:
+                ok_('early_stop_fraction=%s' % fraction in repr(null))
+            assert_equal(null._is_decided(counts_le, counts_ge, 1000), decided)
+
+
+    @reseed_rng()
+    def test_nonparametric_array(self):
+        samples = np.random.randint(0, 10, size=(50, 7)).astype(float)
+        samples[3, 1] = np.nan
+        dists = [Nonparametric(s) for s in samples.T]
+        dist = NonparametricArray(samples)
+        assert_equal(len(dist), len(dists))
+        for x in ([-1] * 7, [10] * 7, np.arange(7), np.arange(7) + 0.5,
+                  samples[0], samples[-1], np.arange(7).reshape((1, -1))):
+            x = np.asanyarray(x)
+            for f in ('cdf', 'rcdf'):
+                res = getattr(dist, f)(x)
+                assert_equal(res.shape, x.shape)
+                assert_array_almost_equal(
+                    res.ravel(),
+                    [getattr(d, f)(v) for d, v in zip(dists, x.ravel())])
+        # behaves as a sequence of Nonparametric's
+        assert_array_equal(dist[2].cdf(4), dists[2].cdf(4))
+        assert_equal(len(list(dist)), 7)
+        assert_raises(ValueError, dist.cdf, np.arange(3))
+
+        # reduced precision storage
+        dist32 = NonparametricArray(samples, dtype=np.float32)
+        assert_equal(dist32.dist_samples.dtype, np.float32)
+        ok_('float32' in repr(dist32))
+        assert_array_equal(dist32.cdf(np.arange(7)), dist.cdf(np.arange(7)))
+
+        # MCNullDist uses it for Nonparametric
+        ds = datasets['uni2small']
+        null = MCNullDist(AttributePermutator('targets', count=10),
+                          tail='right', dtype=np.float32)
+        null.fit(OneWayAnova(), ds)
+        ok_(isinstance(null.dists(), NonparametricArray))
+        assert_equal(len(null.dists()), ds.nfeatures)
+        assert_equal(null.p(np.zeros(ds.nfeatures)).shape, (ds.nfeatures,))
+
+
+    @with_tempfile()
+    def test_mcnulldist_samples_dir(self, tmpdir):
+        os.mkdir(tmpdir)
+        ds = datasets['uni2small']
+        mseed = mvpa2.get_random_seed()
+        nulls = []
+        class Uncounted(object):
+            # generator without a count, so the storage has to grow
+            def generate(self, ds):
+                return AttributePermutator('targets', count=150).generate(ds)
+        for samples_dir in (None, tmpdir):
+            null = MCNullDist(Uncounted(), tail='right',
+                              samples_dir=samples_dir,
+                              enable_ca=['dist_samples'])
+            mvpa2.seed(mseed)
+            null.fit(OneWayAnova(), ds)
+            nulls.append(null)
+        null, null_mm = nulls
+        ok_("samples_dir=%r" % tmpdir in repr(null_mm))
+        assert_equal(null_mm.ca.dist_samples.shape, (1, ds.nfeatures, 150))
+        assert_array_equal(null.ca.dist_samples.samples,
+                           null_mm.ca.dist_samples.samples)
+        assert_array_equal(null.dists().dist_samples,
+                           null_mm.dists().dist_samples)
+        x = np.arange(ds.nfeatures)
+        assert_array_equal(null.p(x), null_mm.p(x))
+        # files are not left behind (where the platform allows)
+        if not sys.platform.startswith('win'):
+            assert_equal(os.listdir(tmpdir), [])
+
+
     def test_anova(self):
         """Do some extended testing of OneWayAnova
 
@@ -203,4 +203,47 @@ def test_zscore_withoutchunks():
     zscore(ds, chunks_attr=None)
     assert(np.any(ds.samples != np.arange(32).reshape((8,-1))))
     ds_summary = ds.summary()
-    assert(ds_summary is not None)
\ No newline at end of file
+    assert(ds_summary is not None)
+
+def test_zscore_chunkwise_float32():
+    rng = np.random.RandomState(4)
+    samples = (rng.normal(size=(30, 5)) * 10 + 3).astype('float32')
+    samples[:, 2] = 7               # invariant feature
+    # interleaved chunks
+    chunks = np.arange(30) % 3
+    ds = dataset_wizard(samples.copy(), targets=chunks % 2, chunks=chunks)
+    zm = ZScoreMapper()
+    zds = zm.forward(ds)
+    # precision is kept, and the source is not modified
+    assert_equal(zds.samples.dtype, np.float32)
+    assert_array_equal(ds.samples, samples)
+    for c in range(3):
+        csamples = samples[chunks == c].astype(float)
+        std = csamples.std(axis=0)
+        std[std == 0] = 1
+        assert_array_almost_equal(zds.samples[chunks == c],
+                                  (csamples - csamples.mean(axis=0)) / std,
+                                  decimal=5)
+
+    # estimation on a subset of samples per chunk
+    zds = ZScoreMapper(param_est=('targets', [0])).forward(ds)
+    for c in range(3):
+        est = samples[(chunks == c) & (ds.sa.targets == 0)].astype(float)
+        assert_array_almost_equal(zds.samples[chunks == c].mean(axis=0)[:2],
+                                  ((samples[chunks == c].mean(axis=0)
+                                    - est.mean(axis=0)) / est.std(axis=0))[:2],
+                                  decimal=5)
+
+    # in-place operation
+    zm = ZScoreMapper(inplace=True)
+    ok_(zm.inplace)
+    ds_ = ds.copy(deep=True)
+    zds = zm.forward(ds_)
+    ok_(zds is ds_)
+    assert_array_almost_equal(zds.samples, ZScoreMapper().forward(ds).samples)
+
+    # integer data gets upcasted to the desired dtype
+    ds_int = dataset_wizard(np.arange(40).reshape(10, 4), chunks=[0, 1] * 5)
+    zds = ZScoreMapper(dtype='float32').forward(ds_int)
+    assert_equal(zds.samples.dtype, np.float32)
+    assert_array_equal(ds_int.samples, np.arange(40).reshape(10, 4))